@@ -23,16 +23,18 @@ Both the CLI and GUI versions are launched from within this script.
 
 # Commandline mode
 import argparse
+import atexit
 import pdb
 
 import threading
+import time
 import xml.etree.ElementTree as ET
 import sys
 from messageInfo import *
 from backend import *
 from setoptions import *
 import printmessage
-from printmessage import ID, PGN, BODY, RAW
+from printmessage import ID, PGN, BODY, RAW, OUTPUT_MODES, LINE_MODE
 
 
 def main():
@@ -46,6 +48,26 @@ def main():
     except Exception as e:
         print("ERROR in data backend: " + str(e))
         return
+
+    # Record every frame received to a binary capture file, if asked. The index is
+    # written when the program exits.
+    if args.capture:
+        from captureFile import CaptureWriter
+        dataBack.capture = CaptureWriter(args.capture, args.metadata,
+                                         channels=[name for name, port in dataBack.channels])
+        atexit.register(dataBack.capture.close)
+
+    # Forward frames between buses, if asked
+    if args.bridge:
+        if not args.nogui:
+            print("ERROR: --bridge only works with --nogui")
+            return
+        from bridge import Bridge
+        try:
+            dataBack.bridge = Bridge(dataBack)
+        except Exception as e:
+            print("ERROR: " + str(e))
+            return
     # If the user doesn't want a GUI, run only the required things
     if args.nogui:
         try:
@@ -54,25 +76,34 @@ def main():
             print("ERROR: " + str(e))
             return
 
-        # Check to see if the user has given a --canbaud arg, and if the arg is valid
+        # Frames come from a recording rather than the serial port. When bridging the
+        # recording onto a port, that port is opened first.
+        if args.replay and not args.bridge:
+            replayNoGuiRun(dataBack)
+            return
+
+        # Check to see if the user has given a --canbaud arg, and if the arg is valid. One baud
+        # applies to every port, otherwise there must be one for each port, in the same order.
         from canport import BAUDLIST
-        try:
-            canbaudString = args.canbaud[0]
-        except TypeError:
-            canbaudString = None
-        if canbaudString:
+        canbaudStrings = args.canbaud or ['250k'] # 250k is the default value
+        for canbaudString in canbaudStrings:
             if canbaudString not in BAUDLIST:
                 print("Choose a baud from", ", ".join(BAUDLIST))
                 return
-        else:
-            # 250k is the default value
-            canbaudString = '250k'
-        ErrorType = pyserialNoGuiInit(dataBack, canbaudString)
+        if len(canbaudStrings) == 1:
+            canbaudStrings = canbaudStrings * len(dataBack.channels)
+        elif len(canbaudStrings) != len(dataBack.channels):
+            print("Give either one --canbaud for every port, or one for each port")
+            return
+        ErrorType = pyserialNoGuiInit(dataBack, canbaudStrings)
 
         # Make sure the serial port was initialized properly before settings things up to read from
         #  it.
         if type(ErrorType) != int:
-            pyserialNoGuiRun(dataBack)
+            if args.replay:
+                replayNoGuiRun(dataBack)
+            else:
+                pyserialNoGuiRun(dataBack)
         # Later on when we define the different error cases for serial init, we can reportback to
         # the user here.
         elif ErrorType == dataBack.canPort.ERROR_NO_DATA:
@@ -94,26 +125,75 @@ def parserInit(parser):
     # for noGUI mode:
     parser.add_argument('--nogui', action='store_true',
             help="CLI mode")
-    parser.add_argument('-p', '--port', nargs=1, metavar='PORT',
-            help="Choose port from command line (required for CLI, optional for GUI)")
+    parser.add_argument('-p', '--port', nargs='+', metavar='PORT',
+            help="Choose port from command line (required for CLI, optional for GUI). The CLI can\
+                    read several buses at once, given as several ports. Name a bus with\
+                    'name=port', otherwise it is named after its position: 0, 1, ...")
     parser.add_argument('-m', '--metadata', metavar="File",
             help="Specify the messages file")
     parser.add_argument('--filter', metavar="FilterID", nargs=1,
             help="Comma-separated list (CLI), eg --filter='WSO100{airspeed[mph],\
-                    wind_dir},DST800' float values must match precision")
+                    wind_dir},DST800' float values must match precision. 'Name@channel' chooses a message\
+                    only from the port with that channel name")
     parser.add_argument('--display', nargs=1,
             help="Comma-separated list, eg: --display=ID,pgn,raw,body")
     parser.add_argument('--csv', action="store_true",
             help="Gives output in CSV format (CLI)")
     parser.add_argument('--time', action="store_true",
             help="Time stamped output for CSV mode (CLI)")
+    parser.add_argument('--timestamps', action="store_true",
+            help="Turn on the CANusb's millisecond timestamps and use them for message times,\
+                    rather than the time each message is printed")
+    parser.add_argument('--output-mode', choices=OUTPUT_MODES, default=LINE_MODE,
+            help="'line' writes messages out as soon as each batch is decoded, for live use like\
+                    pipePlotter.py. 'throughput' holds them for up to --flush-ms, for capturing\
+                    to a file (CLI). Defaults to line")
+    parser.add_argument('--flush-ms', type=float, default=20, metavar='MS',
+            help="How long output may be held in throughput mode. Defaults to 20 (CLI)")
     parser.add_argument('--zero', action="store_true",
             help="Give zero-order hold output for CSV mode (CLI)")
     parser.add_argument('--debug', action='store_true',
                         help='Add debug buttons in GUI mode')
-    parser.add_argument('--canbaud', nargs=1,# metavar='canbaud',
+    parser.add_argument('--canbaud', nargs='+',# metavar='canbaud',
             help="Choose a baud for the CAN to USB device. Example: 100k, 125k, 250k, etc.\
-                    Defaults to 250k, the maritime standard")
+                    Defaults to 250k, the maritime standard. With several ports, give one\
+                    baud for all of them or one for each")
+    parser.add_argument('--queue-size', type=int, default=0, metavar='N',
+            help="Most frames or messages each receive queue may hold. Defaults to 0, unbounded")
+    parser.add_argument('--queue-policy', choices=QUEUE_POLICIES, default=BLOCK,
+            help="What a full receive queue does with new data: wait for room (block),\
+                    drop the oldest or the newest, or replace older data with the same ID.\
+                    Replacing can break up fast-packet and transport protocol messages.\
+                    Defaults to block")
+    parser.add_argument('--replay', metavar="File",
+            help="Decode the frames in a recording instead of reading a serial port: a --capture\
+                    file, a candump .log file, or raw CANusb output (CLI)")
+    parser.add_argument('--replay-speed', type=float, default=1.0, metavar='X',
+            help="Replay at X times the recorded pace, or 0 for as fast as possible. Defaults to 1")
+    parser.add_argument('--capture', metavar="File",
+            help="Record every frame received to this binary capture file. Read it back with\
+                    captureFile.py or batchDecoder.py")
+    parser.add_argument('--stats', type=float, metavar='SECONDS',
+            help="Report the queues' fill levels and drop counts, and the output rate,\
+                    to stderr this often (CLI)")
+    parser.add_argument('--no-hardware-filter', action='store_true',
+            help="Have the CANusb send every frame, rather than only those of the messages\
+                    chosen with --filter (CLI)")
+    parser.add_argument('--bridge', action='store_true',
+            help="Forward frames between the two ports given with --port, or from the recording\
+                    given with --replay onto the port. Only frames with messages in the\
+                    metadata (and --filter) are decoded (CLI)")
+    parser.add_argument('--bridge-allow', metavar='LIST',
+            help="Only forward these IDs (hex) and PGNs, eg: 1F2,18FF0001,pgn:129029")
+    parser.add_argument('--bridge-deny', metavar='LIST',
+            help="Never forward these IDs (hex) and PGNs, eg: 1F2,pgn:59904")
+    parser.add_argument('--bridge-rewrite', action='append', metavar='OLD:NEW',
+            help="Forward frames with ID OLD as ID NEW, both in hex. An OLD of up to 3 digits is\
+                    a standard ID, a longer one extended, eg: 1F2:1F3 or 000001F2:18FF0001.\
+                    May be given several times")
+    parser.add_argument('--bridge-rate', type=float, nargs='+', metavar='N',
+            help="Forward at most N frames per second, dropping the rest. Give one rate for\
+                    both directions, or one for each. Defaults to no limit")
 
 
 def canacondaNoGuiInit(dataBack):
@@ -144,6 +224,9 @@ def canacondaNoGuiInit(dataBack):
             print("createListAndDict failed")
             return
 
+        # Take any 'Name@channel' qualifiers off the message names
+        setFilterChannels(dataBack)
+
         # The following function takes the messageInfo_to_fields
         # and checks for empty list in the dictionary values.
         # If empty, populate list with all the fields in the
@@ -201,29 +284,64 @@ def canacondaNoGuiInit(dataBack):
         # Setup for the CSV display
         else:
             setDisplayCSVmode(dataBack)
+    elif dataBack.bridge:
+        print("Bridging", ", ".join(direction.name for direction in dataBack.bridge.directions))
+    elif args.replay:
+        print("Replaying", args.replay)
     else:
-        print("Opening connection to", dataBack.comport)
+        print("Opening connection to", ", ".join(comport if len(dataBack.channels) == 1 else
+                                                 "{} ({})".format(comport, channel)
+                                                 for channel, comport in dataBack.channels))
   
 
-def pyserialNoGuiInit(dataBack, canbaudString):
+def pyserialNoGuiInit(dataBack, canbaudStrings):
     from canport import CANPortCLI
-    # Create a threading object that communicates with the serial bus
-    dataBack.canPort = CANPortCLI(dataBack)
-    # initialize the serial connection to the CANusb device
-
     from canport import BAUDMAP
-    canbaud = BAUDMAP[canbaudString]
-    serialCAN = dataBack.canPort.pyserialInit(57600, canbaud)
-
-    # If we successfully initialized the CANusb hardware and connected,
-    # start up a thread for processing messages
-    if type(serialCAN) != int:
-        dataBack.serialThread = threading.Thread(target=dataBack.canPort.getMessages, args=(serialCAN,))
-
-    # Create another threading object that will encode and decode CAN messages
-    from CanDataTranscoder import CanTranscoderCLI
-    canTranscoder = CanTranscoderCLI(dataBack)
-    dataBack.transcoderThread = threading.Thread(target=canTranscoder.CanTranscoderRun)
+    from acceptance import AcceptanceFilter
+    # Create a threading object that communicates with each serial bus, and
+    # initialize the serial connection to its CANusb device
+    dataBack.serialThreads = []
+    for (channel, comport), canbaudString in zip(dataBack.channels, canbaudStrings):
+        canPort = CANPortCLI(dataBack, comport, channel)
+        dataBack.canPorts.append(canPort)
+        if len(dataBack.canPorts) == 1:
+            dataBack.canPort = canPort
+        if dataBack.bridge:
+            dataBack.bridge.attach(canPort, channel)
+        # Have the CANusb only send the frames of the messages chosen with --filter. A
+        # bridge forwards everything, so it needs every frame.
+        elif not dataBack.args.no_hardware_filter:
+            canPort.acceptance = AcceptanceFilter.fromMessages(dataBack, channel)
+            canPort.busStats.filtered = canPort.acceptance is not None
+        serialCAN = canPort.pyserialInit(57600, BAUDMAP[canbaudString])
+
+        # If we successfully initialized the CANusb hardware and connected, start
+        # reading from it straight away, so that its frames don't pile up while any
+        # other ports are opened. Otherwise stop the ports already open, and report
+        # which port failed.
+        if type(serialCAN) == int:
+            for openPort in dataBack.canPorts:
+                openPort.live = False
+            dataBack.comport = comport
+            return serialCAN
+        serialThread = threading.Thread(target=canPort.getMessages, args=(serialCAN,))
+        serialThread.start()
+        dataBack.serialThreads.append(serialThread)
+
+        # Messages are only transmitted on the first port, unless bridging, when each
+        # port transmits the frames forwarded to it
+        if len(dataBack.canPorts) == 1 or dataBack.bridge:
+            txThread = threading.Thread(target=canPort.sendMessages, args=(serialCAN,))
+            dataBack.serialTxThreads.append(txThread)
+            if len(dataBack.canPorts) == 1:
+                dataBack.serialTxThread = txThread
+
+    # Create another threading object that will encode and decode CAN messages. When
+    # a recording is being bridged onto the port, replayNoGuiRun() does this instead.
+    if not dataBack.args.replay:
+        from CanDataTranscoder import CanTranscoderCLI
+        canTranscoder = CanTranscoderCLI(dataBack)
+        dataBack.transcoderThread = threading.Thread(target=canTranscoder.CanTranscoderRun)
 
     # Pass through the return value from pyserialInit()
     # FIXME: find a way to intercept KeyBoardInterrupt exception when quitting
@@ -232,12 +350,110 @@ def pyserialNoGuiInit(dataBack, canbaudString):
 def pyserialNoGuiRun(dataBack):
     try:
         dataBack.transcoderThread.start()
-        dataBack.serialThread.start()
+        for txThread in dataBack.serialTxThreads:
+            txThread.start()
+        if dataBack.args.stats:
+            statsThread = threading.Thread(target=reportStats, args=(dataBack, dataBack.args.stats))
+            statsThread.daemon = True
+            statsThread.start()
 
     # This is the error thrown if serialThread did not initialize
     except AttributeError:
         pass
 
+# Run the transcoder on the frames from a recording until they have all been printed,
+# reporting how fast that went to stderr.
+def replayNoGuiRun(dataBack):
+    from replay import ReplayPort
+    from bridge import REPLAY_SOURCE, BRIDGE_DRAIN_TIMEOUT
+    from CanDataTranscoder import CanTranscoderCLI
+    args = dataBack.args
+    replayPort = ReplayPort(dataBack, args.replay, args.replay_speed)
+    dataBack.replayPort = replayPort
+    if dataBack.bridge:
+        dataBack.bridge.attach(replayPort, REPLAY_SOURCE)
+        for txThread in dataBack.serialTxThreads:
+            txThread.start()
+    canTranscoder = CanTranscoderCLI(dataBack)
+    dataBack.serialThread = threading.Thread(target=replayPort.run)
+    dataBack.transcoderThread = threading.Thread(target=canTranscoder.CanTranscoderRun)
+    dataBack.transcoderThread.start()
+    dataBack.serialThread.start()
+    if args.stats:
+        statsThread = threading.Thread(target=reportStats, args=(dataBack, args.stats))
+        statsThread.daemon = True
+        statsThread.start()
+    dataBack.serialThread.join()
+    dataBack.transcoderThread.join()
+    print(replayPort, file=sys.stderr)
+    printReassembly(dataBack)
+    if dataBack.prefilter:
+        print(dataBack.prefilter, file=sys.stderr)
+
+    # Once everything has been forwarded, close the port the recording was bridged onto
+    if dataBack.bridge:
+        dataBack.bridge.drain(BRIDGE_DRAIN_TIMEOUT)
+        for canPort in dataBack.canPorts:
+            canPort.live = False
+        print(dataBack.bridge, file=sys.stderr)
+
+# Print a line for each queue, the output statistics and each bus's throughput to stderr
+# every 'period' seconds, so that overload shows up without getting mixed into the
+# messages on stdout.
+def reportStats(dataBack, period):
+    # Each bus's frame and byte counts at the last report, to work out their rates
+    lastCounts = {}
+    while True:
+        time.sleep(period)
+        for q in dataBack.queues():
+            print(q, file=sys.stderr)
+        for canPort in dataBack.canPorts:
+            frames, bytesRead = lastCounts.get(canPort.channel, (0, 0))
+            print("bus {} ({}): {} frames, {:.0f} frames/s, {:.0f} bytes/s".format(
+                  canPort.channel, canPort.comport, canPort.framesRead,
+                  (canPort.framesRead - frames) / period, (canPort.bytesRead - bytesRead) / period), file=sys.stderr)
+            lastCounts[canPort.channel] = (canPort.framesRead, canPort.bytesRead)
+            # What each ID adds to the load on the bus
+            canPort.busStats.update(canPort.canBaudRate)
+            print("    " + canPort.busStats.summary(), file=sys.stderr)
+            for line in canPort.busStats.idLines():
+                print("    " + line, file=sys.stderr)
+            if canPort.acceptance:
+                print("    " + str(canPort.acceptance), file=sys.stderr)
+        printReassembly(dataBack)
+        if dataBack.bridge:
+            print(dataBack.bridge, file=sys.stderr)
+        if dataBack.prefilter:
+            print(dataBack.prefilter, file=sys.stderr)
+        # How often each message is arriving, and how steadily. The transcoder may add
+        # messages meanwhile, so a copy is taken. Replayed messages keep their recorded
+        # times, so how long ago they were seen means nothing then. How steadily they
+        # arrive is only known from frames with times of their own (see frequency.py),
+        # which a recording may not have.
+        now = time.time()
+        if dataBack.replayPort:
+            intervals = dataBack.replayPort.frameTimes
+        else:
+            intervals = bool(dataBack.args.timestamps)
+        for name, tracker in sorted(list(dataBack.frequencyMap.items())):
+            if dataBack.args.replay:
+                print("message {}: {}".format(name, tracker.summary(intervals)), file=sys.stderr)
+            else:
+                print("message {}: {}, last seen {:.1f} s ago".format(name, tracker.summary(intervals), tracker.age(now)),
+                      file=sys.stderr)
+        if dataBack.output:
+            print(dataBack.output, file=sys.stderr)
+        sys.stderr.flush()
+
+# Print how many fast-packet and transport protocol messages each bus's reassembler
+# has completed, and how many it had to give up on
+def printReassembly(dataBack):
+    for channel, reassembler in list(dataBack.reassemblers.items()):
+        if channel is None:
+            print("reassembly: {}".format(reassembler), file=sys.stderr)
+        else:
+            print("reassembly on bus {}: {}".format(channel, reassembler), file=sys.stderr)
+
 # Create the serial thread. Don't call .start() yet, since this 
 # must be done after the GUI thread has started and user input
 # is obtained for certain parameters.
@@ -23,28 +23,35 @@ CLI mode: When the threading object is created in CANaconda.py, the target funct
 GUI mode: When the threading object is created in ui_mainwindow.py, the target function is Can
 
 This function waits for raw CAN messages to be pushed to the CanacondaRx_Transcode_queue. Once
-a raw message is popped it gets decoded with CANacondaMessageParse() and then printed from here.
+a raw message is popped, messages split over several frames are reassembled (see reassembly.py),
+and then it gets decoded with CANacondaMessageParse() and printed from here.
 
 
 Notes:
 
 CANacondaMessageParse -- main parser
 
-A Regex Match object is passed to this parsing function contained in this file.
-Example parsed message:
-(None, '09FD0284', '8', 'D410002841FAFFFF', '5CCC')
-parsedmsg.groups() will give:
-     (1)               (2)            (3)          (4)       (5)
-header for 't'    header for 'T'     length        body      junk
+A RawFrame (see CanMessage.py) is passed to this parsing function contained in this file.
+It is created by lawicel.parseFrame() from a line such as 'T09FD02848D410002841FAFFFF':
+    frame.id        0x09FD0284
+    frame.extended  True
+    frame.dlc       8
+    frame.payload   b'\xd4\x10\x00\x28\x41\xfa\xff\xff'
 '''
 from backend import conversionMap
 from Nmea2000 import Iso11783Decode
-from queue import Queue
+from queue import Empty
 from CanMessage import *
 from printmessage import *
 import time
 import sys
 from math import ceil, fmod
+from itertools import groupby
+from operator import attrgetter
+from reassembly import Reassembler
+from replay import END_OF_REPLAY
+from multiport import FrameMerger
+from frequency import FrequencyTracker
 
 from messageInfo import CAN_FORMAT_EXTENDED, ACTIVE, EQUAL, LT, GT, ZERO, MessageInfo, Field
 
@@ -57,18 +64,78 @@ class CanTranscoder():
         # The user-defined metadata needed for parsing messages, via MessageInfo objects
         self.metaData = dataBack.messages
 
-        # A queue that has regex match objects that come off the serial port
+        # A queue that has RawFrame objects that come off the serial port
         self.CanacondaRx_TranscodeQueue = dataBack.CANacondaRx_TranscodeQueue
 
         # A queue that has CanMessage objects that the UI will use
         self.CanacondaRxMsg_queue = dataBack.CANacondaRxMsg_queue
 
+        # Rebuild fast-packet and transport protocol messages from their frames before
+        # they are decoded. Each bus has its own reassembler, since node addresses are
+        # only unique within a bus. They are made as each channel is first seen, as a
+        # replayed capture may hold frames from several buses.
+        self.reassemblers = {}
+        dataBack.reassemblers = self.reassemblers
+
+        # Set once a replay has been played through, so the run loop returns
+        self.finished = False
+
+        # When reading several buses, their frames are merged into time order
+        self.merger = None
+        if dataBack.multiChannel:
+            for channel, port in dataBack.channels:
+                self.reassemblers[channel] = Reassembler()
+            self.merger = FrameMerger(self.reassemblers)
+
+    # Take every frame that is waiting, as the serial thread pushes them in batches,
+    # and reassemble any messages that span several frames. Raises queue.Empty if
+    # nothing arrives within 'timeout' seconds. Sets 'finished' at the end of a replay.
+    #
+    # With several buses, frames may be held back for a moment to put them in time
+    # order, so this can return an empty list, and waits no longer than the merger can
+    # hold a frame.
+    def getFrames(self, timeout=None):
+        merger = self.merger
+        if merger is not None:
+            mergeTimeout = merger.timeUntilRelease(time.time())
+            if mergeTimeout is not None and (timeout is None or mergeTimeout < timeout):
+                timeout = mergeTimeout
+        try:
+            frames = self.CanacondaRx_TranscodeQueue.getMany(timeout=timeout)
+        except Empty:
+            if merger is None or not len(merger):
+                raise
+            frames = []
+        if frames and frames[-1] is END_OF_REPLAY:
+            frames.pop()
+            self.finished = True
+        fastPacketPgns = self.dataBack.dispatchTable.fastPacketPgns
+        if merger is None:
+            return self.reassemble(frames, fastPacketPgns)
+
+        byChannel = {}
+        for frame in frames:
+            byChannel.setdefault(frame.channel, []).append(frame)
+        for channel, channelFrames in byChannel.items():
+            merger.add(self.reassemblers[channel].process(channelFrames, fastPacketPgns))
+        return merger.release(time.time())
+
+    # Pass frames through the reassembler of their channel, keeping them in order
+    def reassemble(self, frames, fastPacketPgns):
+        output = []
+        for channel, run in groupby(frames, attrgetter('channel')):
+            reassembler = self.reassemblers.get(channel)
+            if reassembler is None:
+                reassembler = self.reassemblers[channel] = Reassembler()
+            output.extend(reassembler.process(list(run), fastPacketPgns))
+        return output
+
     def CanTranscoderRun(self):
-        while True:
-            msg = self.CanacondaRx_TranscodeQueue.get()
-            newCanMessage = CANacondaMessageParse(msg, self.dataBack)
-            # Pretty-print the message to the terminal. Note that this is used only in the command-line version
-            self.PrintMessage(newCanMessage)
+        while not self.finished:
+            for msg in self.getFrames():
+                newCanMessage = CANacondaMessageParse(msg, self.dataBack)
+                # Pretty-print the message to the terminal. Note that this is used only in the command-line version
+                self.PrintMessage(newCanMessage)
 
 
 try:
@@ -81,29 +148,93 @@ try:
         def __init__(self, dataBack):
             CanTranscoder.__init__(self, dataBack)
             QObject.__init__(self)
+            # How many messages have been decoded, for the GUI's messages/s readout
+            self.messagesParsed = 0
+
+        getFrames = CanTranscoder.getFrames
+        reassemble = CanTranscoder.reassemble
 
         # Continuously pop from the transcode queue, parse, and put to the 'RxMsg_queue'
         # for access to the CANacondaMessage objects from within the GUI thread.
         # This queue separates the serial layer from the rest of the program.
+        # Each batch of frames is decoded and queued together, and signalled once, so
+        # the GUI isn't sent a signal for every message.
         def CanTranscoderRun(self):
-            while True:
-                matchedMsg = self.CanacondaRx_TranscodeQueue.get()
-                newCanMessage = CANacondaMessageParse(matchedMsg, self.dataBack)
-                self.dataBack.CANacondaRxMsg_queue.put(newCanMessage)
+            while not self.finished:
+                messages = [CANacondaMessageParse(frame, self.dataBack) for frame in self.getFrames()]
+                if not messages:
+                    continue
+                self.dataBack.CANacondaRxMsg_queue.putMany(messages)
+                self.messagesParsed += len(messages)
+                if self.dataBack.plotSignals is not None:
+                    self.dataBack.plotSignals.add(messages)
                 self.parsedMsgPut.emit()
                 # If not present already, add the message's messageInfo
                 # and field name to the dataBack.messagesSeenSoFar dict,
-                # and emit a signal for redrawing the messages table
-                if newCanMessage.name not in self.dataBack.messagesSeenSoFar and newCanMessage.name is not '':
-                    self.dataBack.messagesSeenSoFar[newCanMessage.name] = []
-                    for field in newCanMessage.body:
-                        self.dataBack.messagesSeenSoFar[newCanMessage.name].append(field)
-                        self.newMessageUp.emit()
+                # and emit a signal for adding them to the messages table
+                newMessage = False
+                for newCanMessage in messages:
+                    if newCanMessage.name not in self.dataBack.messagesSeenSoFar and newCanMessage.name != '':
+                        self.dataBack.messagesSeenSoFar[newCanMessage.name] = list(newCanMessage.body)
+                        newMessage = True
+                if newMessage:
+                    self.newMessageUp.emit()
 
 except ImportError:
     pass
 
 
+# Picks out, from the header alone, the frames whose messages were chosen with
+# '--filter', so that the CLI doesn't decode messages it would never print. A frame
+# that gets through is decoded with only the fields that were chosen from its message.
+#
+# The answer for each ID is worked out the first time it is seen and cached.
+class MessagePrefilter():
+    def __init__(self, dataBack):
+        self.dataBack = dataBack
+        # (id, extended, channel) -> (MessageInfo, Fields to decode, PGN), or None if
+        # frames with that ID aren't wanted
+        self.selections = {}
+
+        # Statistics
+        self.startTime = time.monotonic()
+        self.checked = 0
+        self.rejected = 0
+
+    def selection(self, frame):
+        key = (frame.id, frame.extended, frame.channel)
+        try:
+            return self.selections[key]
+        except KeyError:
+            pass
+        dataBack = self.dataBack
+        pgn = Iso11783Decode(frame.id)[0]
+        messageInfo = dataBack.dispatchTable.find(frame.extended, frame.id, pgn, frame.channel)
+        selected = None
+        if (messageInfo is not None and messageInfo.name in dataBack.messageInfo_to_fields and
+                dataBack.chosenOnChannel(messageInfo.name, frame.channel)):
+            chosen = dataBack.messageInfo_to_fields[messageInfo.name]
+            # Fields filtered by value are always chosen, so they are decoded too
+            fields = tuple(field for field in messageInfo.fields.values()
+                           if field.name in chosen or field.byValue[ACTIVE])
+            if fields:
+                selected = (messageInfo, fields, pgn)
+        self.selections[key] = selected
+        return selected
+
+    # Pair each frame with its selection, which is None for the frames not wanted
+    def select(self, frames):
+        selected = [(frame, self.selection(frame)) for frame in frames]
+        self.checked += len(frames)
+        self.rejected += sum(1 for frame, selection in selected if selection is None)
+        return selected
+
+    def __str__(self):
+        elapsed = time.monotonic() - self.startTime
+        return "prefilter: {} frames, {} rejected ({:.0f} frames/s)".format(
+               self.checked, self.rejected, self.rejected / elapsed if elapsed else 0.0)
+
+
 class CanTranscoderCLI(CanTranscoder):
 
     def __init__(self, dataBack):
@@ -111,6 +242,41 @@ class CanTranscoderCLI(CanTranscoder):
         super().__init__(dataBack)
         self.args = dataBack.args
 
+        # Messages are written to stdout in batches rather than one by one. The writer
+        # is kept in the dataBack so that its statistics can be reported.
+        self.output = BufferedOutput(sys.stdout, self.args.output_mode, self.args.flush_ms / 1000)
+        dataBack.output = self.output
+
+        # Only the messages chosen with '--filter' are printed, so only they are decoded
+        self.prefilter = None
+        if self.args.filter and dataBack.messageInfo_to_fields:
+            self.prefilter = MessagePrefilter(dataBack)
+            dataBack.prefilter = self.prefilter
+        # The zero-order hold CSV output has a line for every frame, chosen or not
+        self.holdAll = bool(self.args.csv and self.args.zero)
+
+    # As CanTranscoder.CanTranscoderRun(), but the output is written out at the end of
+    # each batch, or when it is due if no more messages come in.
+    def CanTranscoderRun(self):
+        while not self.finished:
+            try:
+                frames = self.getFrames(self.output.timeUntilFlush())
+            except Empty:
+                self.output.flush()
+                continue
+            if self.prefilter:
+                for msg, selected in self.prefilter.select(frames):
+                    if selected is not None:
+                        self.PrintMessage(CANacondaMessageParse(msg, self.dataBack, selected))
+                    elif self.holdAll:
+                        self.PrintMessage(heldMessage(msg))
+            else:
+                for msg in frames:
+                    newCanMessage = CANacondaMessageParse(msg, self.dataBack)
+                    self.PrintMessage(newCanMessage)
+            self.output.batchDone()
+        self.output.flush()
+
     def PrintMessage(self, canacondamessage):
         """Print the given message to stdout. It accounts for some program settings regarding how the output should look."""
         outmsg = ''
@@ -133,108 +299,118 @@ class CanTranscoderCLI(CanTranscoder):
             else:
                 # Prepend timestamp to millisecond precision if the user requested it.
                 if self.args.time:
-                    outmsg = "{0:0.3f} ".format(time.time())
+                    outmsg = "{0:0.3f} ".format(messageTime(canacondamessage))
+
+                # Then the bus it came from, if there are several
+                if self.dataBack.multiChannel:
+                    outmsg += "[{}] ".format(canacondamessage.channel)
 
                 # And then output the raw message data.
                 outmsg += str(canacondamessage)
 
-        # Finally print the message data. We call flush here to speed up the output.
-        # This allows the CSV output to be used as input for pipePlotter and render
-        # in real-time.
+        # Finally hand the message data to the output buffer. In line mode it is flushed
+        # at the end of every batch, so that the CSV output can be used as input for
+        # pipePlotter and render in real-time.
         if outmsg:
-            print(outmsg)
-            sys.stdout.flush()
+            self.output.write(outmsg)
 
 
 # The goal here is to fill in all of the following:
 # name, pgn, id, body (aka 'payload'), raw
-# Parameters... mactch: a regex match object...
+# Parameters... frame: a RawFrame from lawicel.parseFrame()...
 # dataBack: The God Object.
-def CANacondaMessageParse(match, dataBack):
-    """Parses the fields of a Regex Match object into a CanMessage object that is then returned."""
-    metaData = dataBack.messages
-
+# selected: the frame's selection from MessagePrefilter, if it was prefiltered, in
+# which case only the fields it lists are decoded.
+def CANacondaMessageParse(frame, dataBack, selected=None):
+    """Parses the fields of a RawFrame object into a CanMessage object that is then returned."""
     newCanMessage = CanMessage()
 
-    # Parse out the ID from the regex Match object. Keep it an integer!
-    if match.group(1):
-        newCanMessage.id = int(match.group(1), 16)
-        newCanMessage.type = CanMessage.StandardType
-    elif match.group(2):
-        newCanMessage.id = int(match.group(2), 16)
+    # Copy the header over from the frame. Keep the ID an integer!
+    newCanMessage.id = frame.id
+    if frame.extended:
         newCanMessage.type = CanMessage.ExtendedType
+    else:
+        newCanMessage.type = CanMessage.StandardType
 
-    payloadSize = int(match.group(3))
-
-    payloadString = match.group(4)
-    if payloadSize * 2 != len(payloadString):
-        payloadString = payloadString[0:2 * payloadSize]
-
-    newCanMessage.payload = ParseBody(payloadString)
-
-    # This bit string is a big-endian representation of the above.
-    # Do this here once rather than each time a payload field is parsed below
-    newCanMessage.payloadBitstring = ParseBodyBits(payloadString)
-
-    # Now grab a PGN value if one's found
-    [pgn, x, y, z] = Iso11783Decode(newCanMessage.id)
-    newCanMessage.pgn = pgn
-
-    # Now that we have the current message's ID, raw, and pgn values,
-    # find and assign the message's name to newCanMessage.name
-    for key in metaData.keys():
-        if metaData[key].pgn == str(newCanMessage.pgn) or metaData[key].id == newCanMessage.id:
-            newCanMessage.name = metaData[key].name
-            break
-
-    # If newCanMessage.name is still None, then there is no metadata for this
-    # message, so give it a special name and bail.
-    if not newCanMessage.name:
-        CANacondaMessageParse_raw(newCanMessage, match, dataBack)
-        return newCanMessage
+    newCanMessage.payload = frame.payload
+    newCanMessage.time = frame.time
+    newCanMessage.channel = frame.channel
 
-    # In order to continue assigning values to newCanMessage, we need access to the
-    # corresponding MessageInfo object. First, try with filter ID. Then PGN.
-    try:
-        currentMessageInfo = metaData[dataBack.id_to_name[newCanMessage.id]]
-    except KeyError:
-        currentMessageInfo = metaData[dataBack.pgn_to_name[str(newCanMessage.pgn)]]
-    if newCanMessage.id not in dataBack.IDencodeMap.values():
+    # The prefilter has already found the MessageInfo and PGN
+    if selected is not None:
+        currentMessageInfo, fields, newCanMessage.pgn = selected
+    else:
+        # Now grab a PGN value if one's found
+        [pgn, x, y, z] = Iso11783Decode(newCanMessage.id)
+        newCanMessage.pgn = pgn
+
+        # Now that we have the current message's ID and pgn values, find the
+        # corresponding MessageInfo object with a single lookup.
+        currentMessageInfo = dataBack.dispatchTable.find(frame.extended, frame.id, pgn, frame.channel)
+
+        # If there is no MessageInfo, then there is no metadata for this
+        # message, so give it a special name and bail.
+        if currentMessageInfo is None:
+            CANacondaMessageParse_raw(newCanMessage, frame, dataBack)
+            return newCanMessage
+        fields = currentMessageInfo.fields.values()
+
+    newCanMessage.name = currentMessageInfo.name
+    if dataBack.IDencodeMap.get(newCanMessage.name) != newCanMessage.id:
         dataBack.IDencodeMap[newCanMessage.name] = newCanMessage.id
-    # grab the values from the data field(s)
-    for fieldName in currentMessageInfo.fields:
+    # grab the values from the data field(s). The payload is read once as a little-endian
+    # integer, and each field is shifted and masked out of it using the values that
+    # Field.compileDecoder() worked out when the metadata was loaded.
+    payloadInt = int.from_bytes(frame.payload, byteorder='little')
+    payloadLength = 8 * frame.dlc
+    body = newCanMessage.body
+    for dataFilter in fields:
         #dataFilter is a MessageInfo.Field object. Used for parsing field data.
-        dataFilter = currentMessageInfo.fields[fieldName]
+
+        # A frame that is too short to hold all of the field goes through the bit
+        # string decoder instead, which is what defines the result in that case.
+        if dataFilter.offset + dataFilter.length > payloadLength:
+            body[dataFilter.name] = decodeFieldFromBits(dataFilter, newCanMessage)
+            continue
+
+        payloadData = (payloadInt >> dataFilter.offset) & dataFilter.mask
+        if dataFilter.byteSwap:
+            payloadData = int.from_bytes(payloadData.to_bytes(dataFilter.byteCount, byteorder='little'), byteorder='big')
 
         # The field data may be an int or a bitfield, depending on the type
         # specified in metadata.
-        payloadData = getBodyFieldData(dataFilter, newCanMessage)
         if dataFilter.type == 'bitfield':
-            newCanMessage.body[dataFilter.name] = bitfieldFilterPayloadByValue(payloadData, dataFilter)
+            body[dataFilter.name] = bitfieldFilterPayloadByValue(dataFilter.bitfieldFormat.format(payloadData), dataFilter)
         else:
-            newCanMessage.body[dataFilter.name] = scale_filter_convert(dataFilter, newCanMessage, payloadData)
+            if payloadData & dataFilter.signBit:
+                payloadData -= dataFilter.signRange
+            body[dataFilter.name] = scale_filter_convert(dataFilter, newCanMessage, payloadData)
 
-    if not dataBack.nogui:
-        # Now to calculate message frequency:
-        calcFrequency(newCanMessage, dataBack)
+    # Now to calculate message frequency:
+    calcFrequency(newCanMessage, dataBack)
 
-        # Add a copy of the CANacondaMessage to the 'latest_messages' dictionary:
-        dataBack.latest_CANacondaMessages[newCanMessage.name] = newCanMessage.body
+    if not dataBack.nogui:
+        updateLatest(newCanMessage, dataBack)
 
-        # Add the frequency to the 'latest_frequencies' dictionary:
-        dataBack.latest_frequencies[newCanMessage.name] = newCanMessage.freq
+    return newCanMessage
 
+# A message with nothing decoded, standing in for a frame that was prefiltered out
+# when a line is printed for it anyway. Only its time is used.
+def heldMessage(frame):
+    newCanMessage = CanMessage()
+    newCanMessage.time = frame.time
+    newCanMessage.channel = frame.channel
     return newCanMessage
 
-def CANacondaMessageParse_raw(newCanMessage, match, dataBack):
+def CANacondaMessageParse_raw(newCanMessage, frame, dataBack):
     """Parse a a message that does not show up in the metadata file.  Create a CanMessage object with name 'Unknown message ID... ' and set a single field to {'Raw Data': <raw data>}. Also create a MessageInfo object that gets stored in dataBack.messages, with messageInfo.anonymous = True. This step is necessary to access the message later on."""
     # Generate a pretty name with the header info
     if newCanMessage.type == CanMessage.ExtendedType:
         newCanMessage.name = "Extended message 0x{0:X} (PGN: {1:d})".format(newCanMessage.id, newCanMessage.pgn)
     else:
         newCanMessage.name = "Standard message 0x{0:X}".format(newCanMessage.id)
-    newCanMessage.payloadHex = "0x{0:X}".format(int(newCanMessage.payloadBitstring,2))
-    newCanMessage.body['Raw Data'] = newCanMessage.payload
+    newCanMessage.payloadHex = "0x{0:X}".format(int.from_bytes(frame.payload, byteorder='little'))
+    newCanMessage.body['Raw Data'] = list(frame.payload)
     newCanMessage.noMetadata = True
 
     # Since this messages was not given in the metadata, we must create the metadata (messageInfo) and
@@ -248,15 +424,40 @@ def CANacondaMessageParse_raw(newCanMessage, match, dataBack):
         # The 'anonymous' flag tells us that the message is not in any meta data
         dataBack.messages[newMessageInfo.name].anonymous = True
 
+    # Now to calculate message frequency:
+    calcFrequency(newCanMessage, dataBack)
+
     if not dataBack.nogui:
-        # Now to calculate message frequency:
-        calcFrequency(newCanMessage, dataBack)
+        updateLatest(newCanMessage, dataBack)
+
+
+# Keep the latest values of each message for the GUI's table, and mark the fields whose
+# values are new as changed, so that the table only redraws their cells (see
+# FilterTable.updateValueInTable())
+def updateLatest(newCanMessage, dataBack):
+    body = newCanMessage.body
+    previous = dataBack.latest_CANacondaMessages.get(newCanMessage.name)
+    dataBack.latest_CANacondaMessages[newCanMessage.name] = body
+    dataBack.latest_frequencies[newCanMessage.name] = newCanMessage.freq
+    if previous is None:
+        changed = list(body)
+    else:
+        changed = [field for field, value in body.items() if field not in previous or previous[field] != value]
+    if changed:
+        dataBack.changedFields.update((newCanMessage.name, field) for field in changed)
 
-        # Add a copy of the CanMessage to the 'latest_messages' dictionary:
-        dataBack.latest_CANacondaMessages[newCanMessage.name] = newCanMessage.body
 
-        # Add the frequency to the 'latest_frequencies' dictionary:
-        dataBack.latest_frequencies[newCanMessage.name] = newCanMessage.freq
+# Decode a single field using the payload bit string. This is the original decoder, and is
+# now only used for fields that run past the end of the frame.
+def decodeFieldFromBits(dataFilter, newCanMessage):
+    # This bit string is a big-endian representation of the payload. Only build it once
+    # for the message, and only if it is needed.
+    if not newCanMessage.payloadBitstring:
+        newCanMessage.payloadBitstring = ParseBodyBits(newCanMessage.payload)
+    payloadData = getBodyFieldData(dataFilter, newCanMessage)
+    if dataFilter.type == 'bitfield':
+        return bitfieldFilterPayloadByValue(payloadData, dataFilter)
+    return scale_filter_convert(dataFilter, newCanMessage, payloadData)
 
 
 # A helper function that further parses the payloadData for the newCanacondaMessage
@@ -345,38 +546,26 @@ def getBodyFieldData(dataFilter, newCanMessage):
 
 # Convert units as input by the user, i.e. from degrees Celsius Fahrenheit
 def convertUnits(payloadData, dataFilter):
-    try:
     # Data conversion done by adding, multiplying, then
-    # adding the tuple entries found in the conversion map
-    # in backend.py
+    # adding the coefficients that were taken from the conversion
+    # map in backend.py when the units were chosen.
     # FIXME: the conversion relation is linear in two variables, not three
-        payloadData += float(conversionMap[dataFilter.units][
-                                dataFilter.unitsConversion][1])
-        payloadData *= float(conversionMap[dataFilter.units][
-                                dataFilter.unitsConversion][0])
-        payloadData += float(conversionMap[dataFilter.units][
-                                dataFilter.unitsConversion][2])
-    except KeyError:
-        pass
+    conversion = dataFilter.conversion
+    if conversion:
+        payloadData += conversion[0]
+        payloadData *= conversion[1]
+        payloadData += conversion[2]
     return payloadData
 
 
-# Calculate the frequeny at which the message is being broadcast. Useful for GUI mode only
+# Track the rate at which the message is being broadcast (see frequency.py). It is
+# timed by when it was received, so the clock is only read if that isn't known.
 def calcFrequency(newCanMessage, dataBack):
-    if newCanMessage.name not in dataBack.frequencyMap:
-        dataBack.frequencyMap[newCanMessage.name] = Queue()
-    else:
-        dataBack.frequencyMap[newCanMessage.name].put(time.time())
-
-    # If the first element(s) in the queue is/are older than 5 seconds, remove:
-    # FIXME: This is a hacked circular buffer. Do a real one.
-    if dataBack.frequencyMap[newCanMessage.name].qsize() > 0:
-        while time.time() - dataBack.frequencyMap[newCanMessage.name].queue[0] > 5.0:
-            null = dataBack.frequencyMap[newCanMessage.name].get()
-            if dataBack.frequencyMap[newCanMessage.name].empty():
-                break
-    # Division by 5 now gives us a running average
-    newCanMessage.freq = dataBack.frequencyMap[newCanMessage.name].qsize()/5.0
+    tracker = dataBack.frequencyMap.get(newCanMessage.name)
+    if tracker is None:
+        tracker = dataBack.frequencyMap[newCanMessage.name] = FrequencyTracker()
+    tracker.update(messageTime(newCanMessage))
+    newCanMessage.freq = tracker.rate()
 
 
 # getByteSubArray: Before using the int.from_bytes function, we must format the data
@@ -430,35 +619,15 @@ def formatPayloadFromInts(payload):
     return "".join(newPayload)
 
 
-def ParseBody(payloadString):
-    """Parse out an array of integers from a string of hex chars. Return the raw value, not human-readable"""
-    # Set the size of the output array
-    payloadSize = len(payloadString) // 2
-
-    # Parse out each byte from the payload string into an integer array
-    payload = [None] * payloadSize
-    for i in range(payloadSize):
-        charIndex = 2 * i
-        payload[i] = (int(payloadString[charIndex], 16) << 4) + int(payloadString[charIndex + 1], 16)
-
-    return payload
-
-
 # ParseBodyBits
-# 'hexData' is the string of bytes that represent the message body. This function
-# changes the endianness of this hex string and changes its representation to bits.
-def ParseBodyBits(hexData):
-    count = len(hexData)
-    dataflipped = ""
-    while count > 0:
-        # this flips the order of all the hex bits to switch from little
-        # to big endian
-        dataflipped = dataflipped + hexData[count-2:count]
-        count -= 2
-    binaryData = bin(int(dataflipped, 16))  # converts the data to binary
-    # Strip the '0b' and pad with leading 0's
-    binaryData = (4 * len(hexData) - (len(binaryData) - 2)) * '0' + binaryData[2:]
-    return binaryData
+# 'payload' is the bytes object that holds the message body. This function changes
+# the endianness of the payload and changes its representation to bits.
+def ParseBodyBits(payload):
+    if not payload:
+        return ''
+    # Reading the bytes as little endian flips their order, then format as binary
+    # padded with leading 0's
+    return format(int.from_bytes(payload, byteorder='little'), '0{}b'.format(8 * len(payload)))
 
 
 # Function parameters:
@@ -483,7 +652,7 @@ def payloadSwitch(endian, signed, byteArray):
     #big endian unsigned
     elif endian == "big" and signed == "no":
         pay = int.from_bytes(byteArray, byteorder='big', signed=False)
-    else 
+    else:
         pay = 0
     return pay
 
@@ -36,6 +36,8 @@ class CanMessage():
         self.body = {}
         self.freq = 0
         self.noMetadata = False
+        self.time = None # When the message was received, in seconds since the epoch (see RawFrame.time)
+        self.channel = None # The name of the bus the message came from (see RawFrame.channel)
 
     def __str__(self):
         """Convert the CAN message to a human readable version."""
@@ -49,6 +51,27 @@ class CanMessage():
 
         return "Head: 0x{:X}{}, Body: 0x[{}]".format(self.id, pgnStr, dataString)
 
+# A CAN frame exactly as it came off the bus, before any decoding. These are created for
+# every frame received, so they are kept as small as possible.
+class RawFrame():
+    __slots__ = ('id', 'extended', 'dlc', 'payload', 'timestamp', 'time', 'channel')
+
+    def __init__(self, id, extended, dlc, payload, timestamp=None, time=None, channel=None):
+        self.id = id # The message id, as an integer.
+        self.extended = extended # True for 29-bit IDs, False for 11-bit IDs
+        self.dlc = dlc # The number of payload bytes
+        self.payload = payload # The payload as a bytes object
+        self.timestamp = timestamp # The CANusb millisecond timestamp, or None if timestamps are off
+        self.time = time # When the frame was received, in seconds since the epoch. Set by CANPort
+                         # from the CANusb timestamp if device timestamps are on, otherwise from
+                         # the host clock when the frame was read.
+        self.channel = channel # The name of the bus the frame came from, when reading several
+
+    def __str__(self):
+        if self.extended:
+            return "T{:08X}{:d}{}".format(self.id, self.dlc, self.payload.hex().upper())
+        return "t{:03X}{:d}{}".format(self.id, self.dlc, self.payload.hex().upper())
+
 # For transmitting a CAN message generated by the application. The application can generate a message based
 # on metadata, or it can generate a message based on the bytes entered by the user. This class provides the
 # framework for both types of outgoing messages.
@@ -19,7 +19,6 @@
 #include <stdlib.h>
 
 #include "Canaconda.h"
-#include "Ecan1.h"
 
 // Set constants for every state used in the command decoder
 typedef enum {
@@ -46,15 +45,27 @@ typedef enum {
     COMMAND_PARSER_STATE_TRANSMIT_PAYLOAD,
     COMMAND_PARSER_STATE_TRANSMIT_CR,
 
+    // States for the acceptance code and mask commands
+    COMMAND_PARSER_STATE_ACCEPTANCE_VALUE, // Captured the 'M' or 'm', waiting for 8 hex digits
+    COMMAND_PARSER_STATE_ACCEPTANCE_CR, // Captured the value, waiting for '\r'
+
 } CommandParserState;
 
 void (*commandFunction[])(const void *) = {
     NULL, // Open
     NULL, // Close
     NULL, // Setup
-    NULL // Transmit
+    NULL, // Transmit
+    NULL, // Acceptance code
+    NULL // Acceptance mask
 };
 
+// The bits of an acceptance filter compared with each frame type's header. For standard
+// frames the low 4 bits of each filter hold half of the first data byte instead.
+#define ACCEPTANCE_STD_BITS 0xFFF0
+#define ACCEPTANCE_EXT_BITS 0xFFFF
+#define ACCEPTANCE_DATA_BITS 0x000F
+
 /**
  * Store a mapping between the baud rate arguments to the Setup command and the
  * actual baud rate values in baud.
@@ -104,7 +115,7 @@ int MessageToString(char *s, size_t n, const CanMessage *m)
             return 0;
         }
     } else {
-        charsWritten += sprintf(&s[charsWritten], "%08lX", m->id);
+        charsWritten += sprintf(&s[charsWritten], "%08lX", (unsigned long)m->id);
         if (charsWritten <= 1) {
             return 0;
         }
@@ -200,6 +211,50 @@ bool IsHexDigit(char c)
     return ((c >= '0' && c <= '9') || (c >= 'A' && c <= 'F') || (c >= 'a' && c <= 'f'));
 }
 
+/**
+ * Checks a message against an acceptance filter, as set by the 'M' (code) and 'm'
+ * (mask) commands. See Canaconda.h for how the filters are laid out.
+ * @param m The message to check.
+ * @param code The acceptance code.
+ * @param mask The acceptance mask.
+ * @return True if the message is accepted.
+ */
+bool AcceptanceFilterMatch(const CanMessage *m, uint32_t code, uint32_t mask)
+{
+    // Build the part of the header that the filters are compared with
+    uint16_t field;
+    if (m->frame_type == CAN_FRAME_EXT) {
+        field = (uint16_t)(m->id >> 13);
+
+        // Accept the message if either filter matches it
+        uint16_t filter1 = (uint16_t)((field ^ (code >> 16)) & ~(mask >> 16) & ACCEPTANCE_EXT_BITS);
+        uint16_t filter2 = (uint16_t)((field ^ code) & ~mask & ACCEPTANCE_EXT_BITS);
+        return filter1 == 0 || filter2 == 0;
+    }
+
+    field = (uint16_t)(m->id << 5);
+    if (m->message_type == CAN_MSG_RTR) {
+        field |= 0x10;
+    }
+
+    // Filter 2 only compares the header of a standard message
+    if (((field ^ code) & ~mask & ACCEPTANCE_STD_BITS) == 0) {
+        return true;
+    }
+
+    // Filter 1 also compares the first data byte, if there is one: its high nibble with
+    // the low 4 bits of filter 1, and its low nibble with the low 4 bits of filter 2
+    uint16_t filter1;
+    if (m->validBytes > 0) {
+        field |= m->payload[0] >> 4;
+        filter1 = (uint16_t)((field ^ (code >> 16)) & ~(mask >> 16) & ACCEPTANCE_EXT_BITS);
+        filter1 |= (uint16_t)((m->payload[0] ^ code) & ~mask & ACCEPTANCE_DATA_BITS);
+    } else {
+        filter1 = (uint16_t)((field ^ (code >> 16)) & ~(mask >> 16) & ACCEPTANCE_STD_BITS);
+    }
+    return filter1 == 0;
+}
+
 /**
  * Process all UART input to this board, decoding any commands an executing them
  * as they're found.
@@ -214,6 +269,8 @@ int ProcessIncomingCommandStream(uint8_t c)
     static uint8_t loopCounter = 0; // A loop counter for reading in characters
     static char tmpData[16]; // An array to store input characters until they're decoded. The index being written to corresponds to loopCounter.
     static CanMessage msg;
+    static uint8_t acceptanceCommand; // Which acceptance command is being read, 'M' or 'm'
+    static uint32_t acceptanceValue; // The value given to the acceptance command
 
     switch (state) {
     case COMMAND_PARSER_STATE_WAITING:
@@ -236,6 +293,11 @@ int ProcessIncomingCommandStream(uint8_t c)
             msg.frame_type = CAN_FRAME_EXT;
             state = COMMAND_PARSER_STATE_TRANSMITEXT_ID;
             return 0;
+        } else if (c == 'M' || c == 'm') { // Acceptance code and mask commands
+            loopCounter = 0;
+            acceptanceCommand = c;
+            state = COMMAND_PARSER_STATE_ACCEPTANCE_VALUE;
+            return 0;
         } else if (c == '\r') { // If an invalid command was specified, return an error.
             return -1;
         } else { // Otherwise ignore the input.
@@ -352,6 +414,30 @@ int ProcessIncomingCommandStream(uint8_t c)
             state = COMMAND_PARSER_STATE_WAITING;
             return -1;
         }
+    case COMMAND_PARSER_STATE_ACCEPTANCE_VALUE:
+        if (IsHexDigit(c)) {
+            tmpData[loopCounter] = c;
+            ++loopCounter;
+            if (loopCounter >= 8) {
+                tmpData[loopCounter] = '\0';
+                acceptanceValue = (uint32_t)strtoul(tmpData, 0, 16);
+                state = COMMAND_PARSER_STATE_ACCEPTANCE_CR;
+            }
+            return 0;
+        }
+        state = COMMAND_PARSER_STATE_WAITING;
+        return -1;
+    case COMMAND_PARSER_STATE_ACCEPTANCE_CR:
+        state = COMMAND_PARSER_STATE_WAITING;
+        if (c == '\r') {
+            CommandFunctionIndices index = (acceptanceCommand == 'M') ?
+                COMMAND_FUNCTION_INDEX_ACCEPTANCE_CODE : COMMAND_FUNCTION_INDEX_ACCEPTANCE_MASK;
+            if (commandFunction[index]) {
+                (commandFunction[index])(&acceptanceValue);
+            }
+            return 1;
+        }
+        return -1;
     default:
         state = COMMAND_PARSER_STATE_WAITING;
         return 0;
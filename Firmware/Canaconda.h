@@ -30,9 +30,15 @@ typedef enum {
     COMMAND_FUNCTION_INDEX_OPEN = 0,
     COMMAND_FUNCTION_INDEX_CLOSE,
     COMMAND_FUNCTION_INDEX_SETUP,
-    COMMAND_FUNCTION_INDEX_TRANSMIT
+    COMMAND_FUNCTION_INDEX_TRANSMIT,
+    COMMAND_FUNCTION_INDEX_ACCEPTANCE_CODE,
+    COMMAND_FUNCTION_INDEX_ACCEPTANCE_MASK
 } CommandFunctionIndices;
 
+// The acceptance code and mask that let every message through, which are the defaults
+#define ACCEPTANCE_CODE_ALL 0x00000000UL
+#define ACCEPTANCE_MASK_ALL 0xFFFFFFFFUL
+
 /**
  * Set this array with function pointers to be called when commands are executed.
  * The index of a functionc corresponds to the value of the CommandFunctionIndices
@@ -78,6 +84,23 @@ uint8_t HexToByte(const char x[2]);
  */
 bool IsHexDigit(char c);
 
+/**
+ * Checks a message against an acceptance filter, as set by the 'M' (code) and 'm'
+ * (mask) commands. These follow the SJA1000 used by the CANusb in dual filter mode:
+ * the code and mask each hold two 16-bit filters, the first in the upper 16 bits,
+ * and a message is accepted if either filter matches it. A filter is compared
+ * against ID.28-13 of an extended ID, or against ID.10-0 and the RTR bit of a
+ * standard ID. For a standard message with data, the first filter also compares
+ * the first data byte, its high nibble with the low 4 bits of the first filter and
+ * its low nibble with the low 4 bits of the second. A mask bit of 1 means that bit
+ * of the code isn't compared.
+ * @param m The message to check.
+ * @param code The acceptance code.
+ * @param mask The acceptance mask.
+ * @return True if the message is accepted.
+ */
+bool AcceptanceFilterMatch(const CanMessage *m, uint32_t code, uint32_t mask);
+
 /**
  * Process all UART input to this board, decoding any commands an executing them
  * as they're found.
@@ -44,6 +44,8 @@ void CommandOpen(const void *);
 void CommandClose(const void *);
 void CommandSetup(const void *);
 void CommandTransmit(const void *d);
+void CommandAcceptanceCode(const void *d);
+void CommandAcceptanceMask(const void *d);
 
 // Store the operating state
 typedef enum {
@@ -53,6 +55,11 @@ typedef enum {
 } RunState;
 RunState opMode = INACTIVE; // True if the CAN hardware is enabled and receiving messages.
 
+// The acceptance filter, set by the M and m commands. Only messages that it accepts
+// are sent out over the UART.
+uint32_t acceptanceCode = ACCEPTANCE_CODE_ALL;
+uint32_t acceptanceMask = ACCEPTANCE_MASK_ALL;
+
 // Set processor configuration settings
 #ifdef __dsPIC33FJ128MC802__
 // Use internal RC to start; we then switch to PLL'd iRC.
@@ -105,8 +112,10 @@ int main()
             // Turn on the yellow LED whenever a CAN message is received
             _LATA4 = 1;
 
+            // Only send the messages the host asked for, as the UART is far slower than the bus
             int bytesToSend;
-            if ((bytesToSend = MessageToString(outStr, sizeof(outStr), &rxMsg))) {
+            if (AcceptanceFilterMatch(&rxMsg, acceptanceCode, acceptanceMask) &&
+                (bytesToSend = MessageToString(outStr, sizeof(outStr), &rxMsg))) {
                 // We send 1 less than the output, because that last part is just
                 // a NUL character.
                 Uart1WriteData(outStr, bytesToSend - 1);
@@ -193,6 +202,8 @@ void Init(void)
     commandFunction[COMMAND_FUNCTION_INDEX_CLOSE] = CommandClose;
     commandFunction[COMMAND_FUNCTION_INDEX_SETUP] = CommandSetup;
     commandFunction[COMMAND_FUNCTION_INDEX_TRANSMIT] = CommandTransmit;
+    commandFunction[COMMAND_FUNCTION_INDEX_ACCEPTANCE_CODE] = CommandAcceptanceCode;
+    commandFunction[COMMAND_FUNCTION_INDEX_ACCEPTANCE_MASK] = CommandAcceptanceMask;
 }
 
 void CommandOpen(const void *d)
@@ -224,3 +235,18 @@ void CommandTransmit(const void *d)
         Ecan1Transmit((CanMessage*)d);
     }
 }
+
+// Like the CANusb, the acceptance filter can only be changed while the channel is closed
+void CommandAcceptanceCode(const void *d)
+{
+    if (opMode != ACTIVE) {
+        acceptanceCode = *(uint32_t*)d;
+    }
+}
+
+void CommandAcceptanceMask(const void *d)
+{
+    if (opMode != ACTIVE) {
+        acceptanceMask = *(uint32_t*)d;
+    }
+}
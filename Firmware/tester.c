@@ -15,13 +15,28 @@
  * along with this program.  If not, see <http://www.gnu.org/licenses.
  */
 
+// This runs either on the dsPIC, under the debugger, or on a PC, where it can be built
+// and run with:
+//     gcc -std=c99 -o tester tester.c Canaconda.c && ./tester
+
 // Standard C libraries
 #include <string.h>
 #include <stdint.h>
 
+#ifdef __XC16__
 // Microchip libraries
 #include <xc.h>
 
+// On the dsPIC, a test failure stops in an infinite loop for the debugger to find
+#define FAIL(name) while (1)
+#else
+#include <stdio.h>
+#include <stdlib.h>
+
+// On a PC, a test failure is reported and the tests stop
+#define FAIL(name) do { printf("FAILED: %s\n", name); exit(1); } while (0)
+#endif
+
 // User libraries
 #include "Canaconda.h"
 
@@ -30,7 +45,15 @@
 
 // Function prototypes
 void CommandTransmit(const void *data);
+void CommandAcceptanceCode(const void *data);
+void CommandAcceptanceMask(const void *data);
+void SendCommand(const char *command);
+
+// The values last given to the acceptance code and mask commands
+uint32_t acceptanceCode = ACCEPTANCE_CODE_ALL;
+uint32_t acceptanceMask = ACCEPTANCE_MASK_ALL;
 
+#ifdef __XC16__
 // Set processor configuration settings
 #ifdef __dsPIC33FJ128MC802__
 // Use internal RC to start; we then switch to PLL'd iRC.
@@ -53,9 +76,11 @@ _FICD(JTAGEN_OFF & ICS_PGD2);
 #else
 #error No valid processor found!
 #endif
+#endif
 
 int main()
 {
+#ifdef __XC16__
     /// First step is to move over to the FRC w/ PLL clock from the default FRC clock.
     // Set the clock to 79.84MHz.
     PLLFBD = 63; // M = 65
@@ -71,6 +96,7 @@ int main()
 
     // And finally wait for the PLL to lock.
     while (OSCCONbits.LOCK != 1);
+#endif
 
     uint8_t outs[] = {0x00, 0x01, 0x02, 0x03, 0x04, 0x05, 0x06, 0x07, 0x08, 0x09, 0x0A, 0x0B, 0x0C, 0x0D, 0x0E, 0x0F,
                       0x00, 0x10, 0x20, 0x30, 0x40, 0x50, 0x60, 0x70, 0x80, 0x90, 0xA0, 0xB0, 0xC0, 0xD0, 0xE0, 0xF0,
@@ -85,7 +111,7 @@ int main()
     for (i = 0; i < inputs; ++i) {
         uint8_t output = HexToByte(ins[i]);
         if (output != outs[i]) {
-            while (1);
+            FAIL("HexToByte");
         }
     }
 
@@ -121,10 +147,127 @@ int main()
         }
     }
 
+    /// Test the acceptance code and mask commands:
+    commandFunction[COMMAND_FUNCTION_INDEX_ACCEPTANCE_CODE] = CommandAcceptanceCode;
+    commandFunction[COMMAND_FUNCTION_INDEX_ACCEPTANCE_MASK] = CommandAcceptanceMask;
+    SendCommand("M0FC00FC0\r");
+    SendCommand("mE000E000\r");
+    if (acceptanceCode != 0x0FC00FC0 || acceptanceMask != 0xE000E000) {
+        FAIL("M and m commands");
+    }
+    // A value that's too short is rejected, and leaves the filter alone
+    for (i = 0; i < 5; ++i) {
+        ProcessIncomingCommandStream("M1234\r"[i]);
+    }
+    if (ProcessIncomingCommandStream('\r') >= 0 || acceptanceCode != 0x0FC00FC0) {
+        FAIL("Short M command");
+    }
+    // Lower-case hex digits are fine
+    SendCommand("mffffffff\r");
+    if (acceptanceMask != 0xFFFFFFFF) {
+        FAIL("m command with lower-case digits");
+    }
+
+    /// Test AcceptanceFilterMatch():
+    {
+        CanMessage m = {0};
+
+        // Everything gets through the default filter
+        m.frame_type = CAN_FRAME_EXT;
+        m.id = 0x1DEADBEE;
+        if (!AcceptanceFilterMatch(&m, ACCEPTANCE_CODE_ALL, ACCEPTANCE_MASK_ALL)) {
+            FAIL("Default filter");
+        }
+
+        // A filter for PGN 129025 (position, rapid update) from any source and priority,
+        // in both halves: ID.25-13 must be 0x0FC0, and the priority isn't compared.
+        uint32_t code = 0x0FC00FC0;
+        uint32_t mask = 0xE000E000;
+        m.id = 0x09F80103; // Priority 2, PGN 129025, source 3
+        if (!AcceptanceFilterMatch(&m, code, mask)) {
+            FAIL("PGN 129025 filter accepting PGN 129025");
+        }
+        m.id = 0x19F80122; // Priority 6, PGN 129025, source 0x22
+        if (!AcceptanceFilterMatch(&m, code, mask)) {
+            FAIL("PGN 129025 filter accepting another priority and source");
+        }
+        m.id = 0x09F11203; // PGN 127250
+        if (AcceptanceFilterMatch(&m, code, mask)) {
+            FAIL("PGN 129025 filter rejecting PGN 127250");
+        }
+
+        // The second filter matches on its own. It takes standard ID 0x123.
+        code = 0x0FC02460;
+        mask = 0xE000000F;
+        m.frame_type = CAN_FRAME_STD;
+        m.id = 0x123;
+        if (!AcceptanceFilterMatch(&m, code, mask)) {
+            FAIL("Second filter accepting a standard ID");
+        }
+        m.id = 0x124;
+        if (AcceptanceFilterMatch(&m, code, mask)) {
+            FAIL("Second filter rejecting another standard ID");
+        }
+        m.id = 0x123;
+        m.message_type = CAN_MSG_RTR;
+        if (AcceptanceFilterMatch(&m, code, mask)) {
+            FAIL("Second filter rejecting a remote frame");
+        }
+        m.message_type = CAN_MSG_DATA;
+
+        // The first filter takes standard ID 0x123, and compares its first data byte
+        // with the low 4 bits of both filters. Here the second filter, for PGN 129025,
+        // has its low 4 bits compared, so only a first data byte of 0x00 gets through.
+        code = 0x24600FC0;
+        mask = 0x000FE000;
+        m.validBytes = 1;
+        m.payload[0] = 0x00;
+        if (!AcceptanceFilterMatch(&m, code, mask)) {
+            FAIL("First filter accepting a matching data byte");
+        }
+        m.payload[0] = 0x05;
+        if (AcceptanceFilterMatch(&m, code, mask)) {
+            FAIL("First filter comparing the low nibble of the data byte with the second filter");
+        }
+        m.validBytes = 0;
+        if (!AcceptanceFilterMatch(&m, code, mask)) {
+            FAIL("First filter not comparing data in a message without any");
+        }
+    }
+
+#ifdef __XC16__
     while (1);
+#else
+    printf("All tests passed\n");
+    return 0;
+#endif
+}
+
+// Feed a whole command to the command decoder, failing if it isn't accepted
+void SendCommand(const char *command)
+{
+    size_t i;
+    int result = 0;
+    for (i = 0; i < strlen(command); ++i) {
+        result = ProcessIncomingCommandStream(command[i]);
+    }
+    if (result != 1) {
+        FAIL(command);
+    }
 }
 
 void CommandTransmit(const void *data)
 {
     CanMessage *msg = (CanMessage*)data;
+    (void)msg;
+}
+
+void CommandAcceptanceCode(const void *data)
+{
+    acceptanceCode = *(const uint32_t*)data;
+}
+
+void CommandAcceptanceMask(const void *data)
+{
+    acceptanceMask = *(const uint32_t*)data;
 }
@@ -45,17 +45,20 @@ def Iso11783Encode(pgn, src, dest, pri):
 
 	# Note that both the reserved bit and data page bit are left as 0 according to the protocol.
 
-	# The following depends on if it's a PDU1 or PDU2 message. This can be determined
-	# by the destination. 255 implies a global message with an extended PGN as PDU2, otherwise
-	# it's PDU1.
-	# For PDU2
+	# The following depends on if it's a PDU1 or PDU2 message. This is determined by
+	# the PDU format byte, as in Iso11783Decode: below 240 it's PDU1 and the PDU specific
+	# byte holds the destination, otherwise it's PDU2 and the PDU specific byte is part of
+	# the PGN. PDU2 PGNs such as 65280 have a PDU specific byte of 0, so the low byte of
+	# the PGN can't tell them apart.
+	PF = (pgn >> 8) & 0xFF
 
-	if pgn & 0xFF:
-		can_id |= (pgn & 0x7FFFF) << 8
+	# For PDU2
+	if PF > 239:
+		can_id |= (pgn & 0x3FFFF) << 8
 
 	# For PDU1
 	else:
-		can_id |= ((pgn & 0x7FF00) | dest) << 8
+		can_id |= ((pgn & 0x3FF00) | dest) << 8
 
 	return can_id
 
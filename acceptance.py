@@ -0,0 +1,188 @@
+'''
+ * Copyright Bar Smith, Bryant Mairs, Alex Bardales 2015
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses.
+'''
+
+'''
+Works out the CANusb acceptance filter for the messages chosen with '--filter',
+so that the frames nobody asked for never cross the serial link.
+
+The CANusb's 'M' and 'm' commands set the acceptance code and mask of its
+SJA1000 in dual filter mode (see lawicel.acceptanceMatch()). These are two
+filters, each a 16-bit code and mask, and a frame is let through if either
+filter matches it. A filter only sees the top 16 bits of an extended ID
+(ID.28-13), or a standard ID and its RTR bit, so it can't pick out single IDs
+exactly. AcceptanceFilter finds the pair of filters letting through the fewest
+frames that still lets through every frame wanted, and then checks each frame
+that gets through exactly, in software.
+
+A frame is wanted if it has one of the IDs, or PGNs from any source, of the
+chosen messages. Transport protocol frames are wanted too if any chosen message
+is too long for one frame and isn't sent as a fast-packet.
+'''
+
+from lawicel import acceptanceField, ACCEPT_ALL_CODE, ACCEPT_ALL_MASK, STANDARD_FIELD_BITS, EXTENDED_FIELD_BITS, DATA_NIBBLE_BITS
+from messageInfo import CAN_FORMAT_EXTENDED
+from Nmea2000 import Iso11783Decode
+from reassembly import TP_CM, TP_DT
+
+# The bits of one of the two filters
+FILTER_BITS = 0xFFFF
+
+# PGNs with a PDU format (PF) byte below this are PDU1 format, whose low byte is the
+# destination address rather than part of the PGN
+PDU2_START = 240
+
+
+# A set of filter fields, given as the value of the bits that matter and which bits
+# those are: a field 'f' is in it if (f ^ value) & care is 0
+class Cube():
+    def __init__(self, value, care):
+        self.care = care & FILTER_BITS
+        self.value = value & self.care
+
+    # The smallest cube holding both this one and 'other'
+    def merge(self, other):
+        care = self.care & other.care & ~(self.value ^ other.value)
+        return Cube(self.value, care)
+
+    def contains(self, field):
+        return not (field ^ self.value) & self.care
+
+    # How many fields the cube holds
+    def size(self):
+        return 1 << (16 - bin(self.care).count('1'))
+
+
+# The cube of every ID with the given PGN, from any source and at any priority
+def pgnCube(pgn):
+    # Filters see PGN bits 17-5 as ID.25-13. PS, the low byte, is a destination address
+    # rather than part of the PGN for PDU1 PGNs.
+    value = (pgn >> 5) & 0x1FFF
+    care = 0x1FFF if (pgn >> 8) & 0xFF >= PDU2_START else 0x1FF8
+    return Cube(value, care)
+
+
+# Merge cubes, two at a time, into at most 'count' cubes, each time merging the pair
+# whose merged cube is smallest
+def coverCubes(cubes, count):
+    cubes = list(cubes)
+    while len(cubes) > count:
+        best = None
+        for i in range(len(cubes)):
+            for j in range(i + 1, len(cubes)):
+                merged = cubes[i].merge(cubes[j])
+                if best is None or merged.size() < best[0].size():
+                    best = (merged, i, j)
+        merged, i, j = best
+        del cubes[j]
+        cubes[i] = merged
+    return cubes
+
+
+class AcceptanceFilter():
+    def __init__(self, standardIds=(), extendedIds=(), pgns=()):
+        self.standardIds = set(standardIds)
+        self.extendedIds = set(extendedIds)
+        self.pgns = set(pgns)
+        # (id, extended) -> whether that ID is wanted, filled in as IDs are seen
+        self.cache = {}
+
+        # Statistics: frames checked in software, and how many were thrown away
+        self.checked = 0
+        self.rejected = 0
+
+        cubes = [Cube(acceptanceField(id, False), STANDARD_FIELD_BITS) for id in self.standardIds]
+        cubes += [Cube(acceptanceField(id, True), EXTENDED_FIELD_BITS) for id in self.extendedIds]
+        cubes += [pgnCube(pgn) for pgn in self.pgns]
+        if not cubes:
+            self.code, self.mask = ACCEPT_ALL_CODE, ACCEPT_ALL_MASK
+            return
+        cubes = coverCubes(cubes, 2)
+        if len(cubes) == 1:
+            cubes.append(cubes[0])
+        # Filter 1 compares a standard frame's first data byte with the low 4 bits of
+        # both filters (see lawicel.acceptanceMatch()). Standard IDs in filter 2 aren't
+        # affected, so they go there if only one filter has them. Otherwise those bits
+        # of filter 2, which an extended ID or PGN may care about, mustn't be compared.
+        standardFields = [acceptanceField(id, False) for id in self.standardIds]
+        hasStandard = [any(cube.contains(field) for field in standardFields) for cube in cubes]
+        if hasStandard[0] and not hasStandard[1]:
+            cubes.reverse()
+        elif hasStandard[0]:
+            cubes[1] = Cube(cubes[1].value, cubes[1].care & ~DATA_NIBBLE_BITS)
+        # Filter 1 is in the top 16 bits. A mask bit of 1 means the bit isn't compared.
+        self.code = (cubes[0].value << 16) | cubes[1].value
+        self.mask = ((~cubes[0].care & FILTER_BITS) << 16) | (~cubes[1].care & FILTER_BITS)
+
+    # The filter for the messages chosen with '--filter', on the given channel, or None
+    # if no messages were chosen
+    @classmethod
+    def fromMessages(cls, dataBack, channel=None):
+        if not dataBack.args.filter:
+            return None
+        standardIds = set()
+        extendedIds = set()
+        pgns = set()
+        needsTransport = False
+        for name in dataBack.messageInfo_to_fields:
+            messageInfo = dataBack.messages[name]
+            if messageInfo.channel is not None and messageInfo.channel != channel:
+                continue
+            if not dataBack.chosenOnChannel(name, channel):
+                continue
+            if messageInfo.id is not None:
+                if messageInfo.format == CAN_FORMAT_EXTENDED or messageInfo.id > 0x7FF:
+                    extendedIds.add(messageInfo.id)
+                else:
+                    standardIds.add(messageInfo.id)
+            elif messageInfo.pgn:
+                pgns.add(int(messageInfo.pgn))
+            extent = max((field.offset + field.length for field in messageInfo.fields.values()), default=0)
+            if not messageInfo.fastPacket and (messageInfo.size > 8 or extent > 64):
+                needsTransport = True
+        if needsTransport:
+            pgns |= {TP_CM, TP_DT}
+        return cls(standardIds, extendedIds, pgns)
+
+    # The Lawicel commands that program the filter, to send while the channel is closed
+    def commands(self):
+        return b'M%08X\r' % self.code, b'm%08X\r' % self.mask
+
+    def wanted(self, id, extended):
+        key = (id, extended)
+        try:
+            return self.cache[key]
+        except KeyError:
+            pass
+        if extended:
+            isWanted = id in self.extendedIds or Iso11783Decode(id)[0] in self.pgns
+        else:
+            isWanted = id in self.standardIds
+        self.cache[key] = isWanted
+        return isWanted
+
+    # The frames in 'frames' that are wanted, leaving out those the hardware filter
+    # couldn't tell apart from them
+    def check(self, frames):
+        wanted = self.wanted
+        kept = [frame for frame in frames if wanted(frame.id, frame.extended)]
+        self.checked += len(frames)
+        self.rejected += len(frames) - len(kept)
+        return kept
+
+    def __str__(self):
+        return "acceptance code {:08X}, mask {:08X}: {} frames let through, {} thrown away in software".format(
+               self.code, self.mask, self.checked, self.rejected)
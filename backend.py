@@ -21,7 +21,11 @@ This file contains the CanData class, which is implemented as a singleton
 '''
 
 import queue
+import time
+from operator import attrgetter
 import CANaconda
+from messageInfo import DispatchTable
+from multiport import parsePortSpec
 
 # displayList
 from printmessage import ID, PGN, BODY, RAW
@@ -53,6 +57,208 @@ conversionMap = {
     }
 
 
+# What a PipelineQueue does with a new item when it is full:
+#   BLOCK          wait for the consumer to make room, like queue.Queue
+#   DROP_OLDEST    throw away the item that has been waiting longest
+#   DROP_NEWEST    throw away the new item
+#   LATEST_PER_ID  replace the waiting item with the same ID, if there is one, and
+#                  otherwise throw away the oldest item. Under overload the consumer
+#                  still sees every ID, with its newest data.
+BLOCK = 'block'
+DROP_OLDEST = 'drop-oldest'
+DROP_NEWEST = 'drop-newest'
+LATEST_PER_ID = 'latest-per-id'
+QUEUE_POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST, LATEST_PER_ID)
+
+
+# A queue.Queue that can also be filled and drained in bulk. The serial reader
+# pulls many frames per read() call, so taking the queue's lock and notifying the
+# consumer once per batch rather than once per frame keeps the per-frame cost low.
+#
+# With a 'maxsize', 'policy' decides what happens when the queue is full (see above).
+# LATEST_PER_ID needs 'key', a function giving the ID of an item. The most items
+# ever waiting is kept in 'highWater', and the number thrown away in 'dropped'.
+class PipelineQueue(queue.Queue):
+    def __init__(self, maxsize=0, policy=BLOCK, key=None, name=''):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError("Unknown queue policy '{}', choose from {}".format(policy, ", ".join(QUEUE_POLICIES)))
+        if policy == LATEST_PER_ID and key is None:
+            raise ValueError("The {} queue policy needs a key function".format(LATEST_PER_ID))
+        super().__init__(maxsize)
+        self.policy = policy
+        self.key = key
+        self.name = name
+        self.highWater = 0
+        self.dropped = 0
+        # For LATEST_PER_ID, the newest waiting [ID, item] entry for each ID
+        self.latest = {}
+
+    def put(self, item, block=True, timeout=None):
+        self.putMany((item,), block, timeout)
+
+    # Put all the items from 'items' into the queue, in order, with a single
+    # acquisition of the queue's lock. With the BLOCK policy this may wait for room
+    # like put() does, and the items put before a timeout stay in the queue.
+    def putMany(self, items, block=True, timeout=None):
+        with self.not_full:
+            put = 0
+            try:
+                for item in items:
+                    if 0 < self.maxsize <= self._qsize():
+                        if self.policy == BLOCK:
+                            # Let the consumer at what is already here before waiting
+                            self.highWater = self.maxsize
+                            if put:
+                                self.not_empty.notify()
+                            self._waitForRoom(block, timeout)
+                        elif self._makeRoom(item):
+                            self.dropped += 1
+                            continue
+                        else:
+                            self.dropped += 1
+                    self._put(item)
+                    put += 1
+            finally:
+                self.unfinished_tasks += put
+                if self._qsize() > self.highWater:
+                    self.highWater = self._qsize()
+                if put:
+                    self.not_empty.notify()
+
+    # Make room for 'item' in a full queue, following the policy. Returns True if
+    # 'item' has been dealt with and must not be put into the queue.
+    def _makeRoom(self, item):
+        if self.policy == DROP_NEWEST:
+            return True
+        if self.policy == LATEST_PER_ID:
+            entry = self.latest.get(self.key(item))
+            if entry is not None:
+                entry[1] = item
+                return True
+        self._get()
+        self.unfinished_tasks -= 1
+        return False
+
+    # Wait, with the lock held, until there is room in the queue. Raises queue.Full
+    # in the same cases as put().
+    def _waitForRoom(self, block, timeout):
+        if not block:
+            raise queue.Full
+        if not self.not_full.wait_for(lambda: self._qsize() < self.maxsize, timeout):
+            raise queue.Full
+
+    # LATEST_PER_ID keeps [ID, item] entries, so that a waiting item can be replaced
+    def _put(self, item):
+        if self.policy == LATEST_PER_ID:
+            entry = [self.key(item), item]
+            self.latest[entry[0]] = entry
+            self.queue.append(entry)
+        else:
+            self.queue.append(item)
+
+    def _get(self):
+        if self.policy == LATEST_PER_ID:
+            entry = self.queue.popleft()
+            if self.latest.get(entry[0]) is entry:
+                del self.latest[entry[0]]
+            return entry[1]
+        return self.queue.popleft()
+
+    # Remove and return a list of every item that is currently in the queue. Blocks
+    # like get() until at least one item is available.
+    def getMany(self, block=True, timeout=None):
+        with self.not_empty:
+            self._waitForItems(block, timeout)
+            items = []
+            while self._qsize():
+                items.append(self._get())
+            self.not_full.notify_all()
+            return items
+
+    # Wait, with the lock held, until there is something in the queue. Raises
+    # queue.Empty in the same cases as get().
+    def _waitForItems(self, block, timeout):
+        if not block:
+            if not self._qsize():
+                raise queue.Empty
+        elif timeout is None:
+            while not self._qsize():
+                self.not_empty.wait()
+        else:
+            if not self.not_empty.wait_for(self._qsize, timeout):
+                raise queue.Empty
+
+    # A one-line summary of how full the queue is and what it has dropped
+    def __str__(self):
+        return "{}: {} waiting, high-water {}/{}, {} dropped ({})".format(
+               self.name, self.qsize(), self.highWater, self.maxsize or "unbounded", self.dropped, self.policy)
+
+
+# A PipelineQueue that notes when each item was put into it, so the time items spend
+# waiting can be measured. get() and getMany() return just the items as usual, and
+# getManyTimed() returns them along with the time.monotonic() they were put.
+# Items can't be replaced once queued, so the LATEST_PER_ID policy isn't available.
+class TimedPipelineQueue(PipelineQueue):
+    def __init__(self, maxsize=0, policy=BLOCK, name=''):
+        if policy == LATEST_PER_ID:
+            raise ValueError("The {} queue policy can't be used for timed queues".format(LATEST_PER_ID))
+        super().__init__(maxsize, policy, name=name)
+
+    def _put(self, item):
+        self.queue.append((time.monotonic(), item))
+
+    def _get(self):
+        return self.queue.popleft()[1]
+
+    # As getMany(), but returns a list of (time put, item) pairs
+    def getManyTimed(self, block=True, timeout=None):
+        with self.not_empty:
+            self._waitForItems(block, timeout)
+            items = list(self.queue)
+            self.queue.clear()
+            self.not_full.notify_all()
+            return items
+
+
+# Keeps statistics on a stream of latencies, given in seconds. Percentiles come from a
+# histogram with a bucket for each power of two microseconds, so they are upper
+# bounds that are within a factor of two, and adding a latency costs the same however
+# many have been added.
+class LatencyStats():
+    BUCKETS = 32
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        # buckets[n] counts the latencies below 2**n microseconds that are not in buckets[n - 1]
+        self.buckets = [0] * LatencyStats.BUCKETS
+
+    def add(self, latency):
+        self.count += 1
+        self.total += latency
+        if latency > self.max:
+            self.max = latency
+        self.buckets[min(int(latency * 1e6).bit_length(), LatencyStats.BUCKETS - 1)] += 1
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    # Return a time, in seconds, that 'fraction' of the latencies were below
+    def percentile(self, fraction):
+        target = fraction * self.count
+        seen = 0
+        for n, bucketCount in enumerate(self.buckets):
+            seen += bucketCount
+            if seen >= target and seen:
+                return min(2**n / 1e6, self.max)
+        return self.max
+
+    def __str__(self):
+        return "{} samples, mean {:.2f} ms, p50 < {:.2f} ms, p99 < {:.2f} ms, max {:.2f} ms".format(
+               self.count, 1e3 * self.mean(), 1e3 * self.percentile(0.5), 1e3 * self.percentile(0.99), 1e3 * self.max)
+
+
 class CanData():
     def __init__(self, args):
         # Store args from argparse:
@@ -75,14 +281,30 @@ class CanData():
         #The file where loging will takeplace if it is turned on
         self.logfile = None
         #This defines which COM port is used
-        if args.nogui:
+        if args.nogui and not getattr(args, 'replay', None):
             if not bool(args.port):
-                raise Exception("Please specify a port (using --port option)")
+                raise Exception("Please specify a port (using --port option) or a file to replay (using --replay)")
             else:
-                self.comport = args.port[0]
+                self.comport = parsePortSpec(args.port[0], 0)[1]
         else:
             self.comport = None
 
+        # (channel name, port) for every port given with --port. The CLI reads all of
+        # them at once, merging their frames (see multiport.py). The GUI uses the first.
+        self.channels = [parsePortSpec(spec, i) for i, spec in enumerate(getattr(args, 'port', None) or [])]
+        self.multiChannel = bool(args.nogui) and len(self.channels) > 1 and not getattr(args, 'replay', None)
+        if len(set(name for name, port in self.channels)) < len(self.channels):
+            raise Exception("Each port needs a different channel name")
+
+        # The CANPort for each channel, in the same order, once they are opened (CLI only)
+        self.canPorts = []
+
+        # The bridge.Bridge forwarding frames between ports, if '--bridge' was given
+        self.bridge = None
+
+        # The replay.ReplayPort reading frames in place of the ports, if '--replay' was given
+        self.replayPort = None
+
         # All of the current messages applied by the user.
         # Populated with messageInfo objects
         self.messages = {}
@@ -90,15 +312,37 @@ class CanData():
         # threading.Thread objects
         self.serialRxThread = None
         self.serialTxThread = None
+        # The CLI's transmit threads: one for the first port, or one for each when bridging
+        self.serialTxThreads = []
+
+        # The capacity and overload policy of the receive queues. By default they are
+        # unbounded, and the transmit queue always is, so that nothing queued for the
+        # bus is lost.
+        queueSize = getattr(args, 'queue_size', 0)
+        queuePolicy = getattr(args, 'queue_policy', BLOCK)
 
         # Multithreading queue for passing decoded CAN messages
-        self.CANacondaRxMsg_queue = queue.Queue()
+        self.CANacondaRxMsg_queue = PipelineQueue(queueSize, queuePolicy, attrgetter('id', 'type'), 'messages')
 
         # Multithreading queue for receiving messages from the serial port
-        self.CANacondaRx_TranscodeQueue = queue.Queue()
+        self.CANacondaRx_TranscodeQueue = PipelineQueue(queueSize, queuePolicy, attrgetter('id', 'extended'), 'frames')
+
+        # Multithreading queue for transmitting messages tot he bus. The time each message
+        # was queued is kept, to measure how long it takes to reach the serial port.
+        self.CANacondaTxMsg_queue = TimedPipelineQueue(name='transmit')
+
+        # The captureFile.CaptureWriter recording every frame received, if any
+        self.capture = None
+
+        # The CLI's BufferedOutput for writing messages to stdout, once it is created
+        self.output = None
+
+        # The CLI's CanDataTranscoder.MessagePrefilter, if '--filter' chose which messages to decode
+        self.prefilter = None
 
-        # Multithreading queue for transmitting messages tot he bus
-        self.CANacondaTxMsg_queue = queue.Queue()
+        # The reassembly.Reassembler for each channel, made by the transcoder, for
+        # reporting statistics. Frames without a channel are reassembled under None.
+        self.reassemblers = {}
 
         # Storage for the outgoing message in hex, ascii format (for serial):
         self.asciiBucket = '' 
@@ -106,6 +350,15 @@ class CanData():
         # A nested dictionary of 'messageInfo'->'field'->'latest message'
         self.latest_CANacondaMessages = {}
 
+        # The ('messageInfo', 'field') pairs whose latest values have changed since the
+        # filter table last showed them. The transcoder adds to it, and the table takes
+        # them out again.
+        self.changedFields = set()
+
+        # The signalPlot.PlotSignals that the transcoder feeds the GUI's plot from, or
+        # None if numpy or matplotlib aren't installed
+        self.plotSignals = None
+
         ## message stream window:
         # This flag is used so that raw data and XML defined messages don't
         # mix on screen
@@ -128,6 +381,10 @@ class CanData():
         # Dictionary of filter and values to be displayed
         self.messageInfo_to_fields = {}
 
+        # 'messageInfo' -> the channels it was chosen on, for messages given as
+        # 'Name@channel' in '--filter'. Messages not in here are chosen on every channel.
+        self.messageInfo_to_channels = {}
+
         # For display in GUI. Change name
         self.container = {}
 
@@ -140,6 +397,10 @@ class CanData():
         # For matching message PGN to name, as in previous example.
         self.pgn_to_name = {}
 
+        # For finding the messageInfo of a received frame by its ID or PGN.
+        # Rebuilt by xmlImport() each time metadata is loaded.
+        self.dispatchTable = DispatchTable()
+
         # We will use this to give an ID while encoding messages
         self.IDencodeMap = {}
         
@@ -153,7 +414,7 @@ class CanData():
         self.fieldList_CSV = {}
 
         # A dictionary object for counting the frequencies of message
-        # message transmission. GUI only.
+        # message transmission, as frequency.FrequencyTracker objects.
         self.frequencyMap = {}
         self.latest_frequencies = {}
 
@@ -186,6 +447,14 @@ class CanData():
                 self.messages.remove(messageInfo)
                 del messageInfo
 
-    
+    # Whether frames of the messageInfo named 'name' from 'channel' were chosen with '--filter'
+    def chosenOnChannel(self, name, channel):
+        channels = self.messageInfo_to_channels.get(name)
+        return channels is None or channel in channels
+
+    # The pipeline's queues, in the order messages pass through them
+    def queues(self):
+        return [self.CANacondaRx_TranscodeQueue, self.CANacondaRxMsg_queue, self.CANacondaTxMsg_queue]
+
     def __str__(self):
         return str(self.messages)
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+'''
+ * Copyright Bar Smith, Bryant Mairs, Alex Bardales 2015
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses.
+'''
+
+'''
+An offline decoder for long captures, using NumPy.
+
+Rather than decoding one frame at a time like CanDataTranscoder.py, every
+frame in a capture is loaded into flat arrays: the ID, the DLC, the timestamp,
+and the payload read as a little-endian uint64. Frames are grouped by the
+MessageInfo they match. Then each field in MessageInfo.fields is pulled out of
+the whole group at once with array shift, mask, sign-extend and scale
+operations, using the same metadata as the live decoder.
+
+The result is a set of columns for each message: 'index' (the frame's position
+in the capture), 'timestamp', 'id', 'dlc', and one column per field. Frames
+with no metadata are kept in a group called UNKNOWN, with their raw 'extended'
+and 'payload' columns. The columns can be saved to a .npz file, where each
+array is named 'message/column'.
+
+Decoded values match CANacondaMessageParse, with these differences:
+ * Numeric fields are always float64, and the 'NaN' that marks a 65535 value
+   is a real NaN. A field that does not fit in the frame's DLC is also NaN.
+ * Bitfields hold the field's raw bits as a uint64, rather than the string of
+   filtered bits that the live decoder shows. A bitfield that does not fit in
+   the frame is 0. Check the 'dlc' column for those frames.
+ * byValue filters are not applied. Every frame is decoded.
+ * Fast-packet messages are not reassembled, so their frames are left in UNKNOWN.
+
+Captures are read either as the raw bytes received from the CANusb, that is,
+Lawicel frames separated by carriage returns, or as binary captures written
+with CANaconda's --capture option (see captureFile.py). For raw captures the
+timestamp is the CANusb's millisecond timestamp, or NaN if timestamps were not
+turned on. For binary captures it is the time each frame was received, in
+seconds since the epoch.
+
+Usage:
+    python3 batchDecoder.py -m metadata/Nmea2000.xml -o decoded.npz capture.log
+'''
+
+import argparse
+import sys
+
+import numpy as np
+
+from backend import CanData
+from messageInfo import xmlImport
+from lawicel import parseFrame
+from Nmea2000 import Iso11783Decode
+from captureFile import CaptureReader, FLAG_EXTENDED, MAGIC as CAPTURE_MAGIC
+
+# The name of the group holding frames that have no metadata
+UNKNOWN = 'UNKNOWN'
+
+# Separates the message name from the column name in .npz files
+NPZ_SEPARATOR = '/'
+
+# Every payload is padded out to a full 8 bytes so it can be read as a uint64
+PAYLOAD_BITS = 64
+
+# The layout of a captureFile.RECORD
+CAPTURE_RECORD_DTYPE = np.dtype([('time', '<f8'), ('id', '<u4'), ('flags', 'u1'), ('dlc', 'u1'),
+                                 ('channel', 'u1'), ('reserved', 'V1'), ('payload', '<u8')])
+
+
+# Every frame in a capture, as parallel arrays indexed by the frame's position.
+class FrameArrays():
+    def __init__(self, ids, extended, dlcs, payloads, timestamps):
+        self.ids = ids # uint32
+        self.extended = extended # bool
+        self.dlcs = dlcs # uint8
+        self.payloads = payloads # uint64, the payload bytes read little-endian
+        self.timestamps = timestamps # float64, NaN where the frame had no timestamp
+
+    def __len__(self):
+        return len(self.ids)
+
+    # Build the arrays from a list of RawFrames
+    @classmethod
+    def fromFrames(cls, frames):
+        count = len(frames)
+        ids = np.fromiter((frame.id for frame in frames), dtype=np.uint32, count=count)
+        extended = np.fromiter((frame.extended for frame in frames), dtype=np.bool_, count=count)
+        dlcs = np.fromiter((frame.dlc for frame in frames), dtype=np.uint8, count=count)
+        timestamps = np.fromiter((np.nan if frame.timestamp is None else frame.timestamp for frame in frames),
+                                 dtype=np.float64, count=count)
+        packed = b''.join(frame.payload.ljust(8, b'\0') for frame in frames)
+        payloads = np.frombuffer(packed, dtype='<u8').astype(np.uint64)
+        return cls(ids, extended, dlcs, payloads, timestamps)
+
+
+# Read a capture of raw CANusb output and return a FrameArrays. Anything that is not
+# a well-formed frame, such as replies to commands, is skipped.
+def readLawicelCapture(fileName):
+    with open(fileName, 'rb') as f:
+        data = f.read()
+    frames = []
+    for line in data.split(b'\r'):
+        frame = parseFrame(line)
+        if frame is not None:
+            frames.append(frame)
+    return FrameArrays.fromFrames(frames)
+
+
+# Read a binary capture written by captureFile.CaptureWriter and return a FrameArrays.
+# The records are viewed in place through the reader's memory map, and only copied
+# into the separate arrays. The 'timestamps' are the frames' times in seconds since the epoch.
+def readBinaryCapture(fileName):
+    reader = CaptureReader(fileName)
+    records = np.frombuffer(reader.records, dtype=CAPTURE_RECORD_DTYPE)
+    frameArrays = FrameArrays(records['id'].copy(), (records['flags'] & FLAG_EXTENDED) != 0,
+                              records['dlc'].copy(), records['payload'].astype(np.uint64),
+                              records['time'].copy())
+    del records
+    reader.close()
+    return frameArrays
+
+
+# Read a capture in either format, telling them apart by the binary format's magic number
+def readCapture(fileName):
+    with open(fileName, 'rb') as f:
+        magic = f.read(len(CAPTURE_MAGIC))
+    if magic == CAPTURE_MAGIC:
+        return readBinaryCapture(fileName)
+    return readLawicelCapture(fileName)
+
+
+# Decode every frame in 'frameArrays' using the MessageInfos in 'dispatchTable'.
+# Returns a dictionary of message name -> dictionary of column name -> array.
+def decodeFrames(frameArrays, dispatchTable):
+    # Look up the metadata once for each distinct (extended, ID) pair seen, rather
+    # than once per frame.
+    keys = frameArrays.ids.astype(np.uint64) | (frameArrays.extended.astype(np.uint64) << np.uint64(32))
+    uniqueKeys, inverse = np.unique(keys, return_inverse=True)
+    messageInfos = []
+    groupOfName = {}
+    groupOfKey = np.empty(len(uniqueKeys), dtype=np.int64)
+    for i, key in enumerate(uniqueKeys.tolist()):
+        id = key & 0xFFFFFFFF
+        extended = bool(key >> 32)
+        messageInfo = dispatchTable.find(extended, id, Iso11783Decode(id)[0])
+        if messageInfo is None or messageInfo.fastPacket:
+            groupOfKey[i] = -1
+            continue
+        if messageInfo.name not in groupOfName:
+            groupOfName[messageInfo.name] = len(messageInfos)
+            messageInfos.append(messageInfo)
+        groupOfKey[i] = groupOfName[messageInfo.name]
+
+    # Sort the frames by group, keeping capture order within each group
+    frameGroups = groupOfKey[inverse.reshape(-1)]
+    order = np.argsort(frameGroups, kind='stable')
+    sortedGroups = frameGroups[order]
+
+    decoded = {}
+    for group in range(-1, len(messageInfos)):
+        start, end = np.searchsorted(sortedGroups, (group, group + 1))
+        if start == end:
+            continue
+        indices = order[start:end]
+        columns = {
+            'index': indices.astype(np.int64),
+            'timestamp': frameArrays.timestamps[indices],
+            'id': frameArrays.ids[indices],
+            'dlc': frameArrays.dlcs[indices],
+        }
+        payloads = frameArrays.payloads[indices]
+        if group == -1:
+            columns['extended'] = frameArrays.extended[indices]
+            columns['payload'] = payloads
+            decoded[UNKNOWN] = columns
+            continue
+        messageInfo = messageInfos[group]
+        for field in messageInfo.fields.values():
+            columns[field.name] = decodeField(field, payloads, columns['dlc'])
+        decoded[messageInfo.name] = columns
+    return decoded
+
+
+# Decode one field out of an array of payloads. The steps mirror the compiled decoder
+# that CANacondaMessageParse uses (see Field.compileDecoder()), applied to whole arrays.
+def decodeField(field, payloads, dlcs):
+    isBitfield = field.type == 'bitfield'
+    if field.offset + field.length > PAYLOAD_BITS:
+        if isBitfield:
+            return np.zeros(len(payloads), dtype=np.uint64)
+        return np.full(len(payloads), np.nan)
+
+    raw = (payloads >> np.uint64(field.offset)) & np.uint64(field.mask)
+    if field.byteSwap:
+        swapped = np.zeros_like(raw)
+        for i in range(field.byteCount):
+            byte = (raw >> np.uint64(8 * i)) & np.uint64(0xFF)
+            swapped |= byte << np.uint64(8 * (field.byteCount - 1 - i))
+        raw = swapped
+
+    missing = dlcs.astype(np.int64) * 8 < field.offset + field.length
+    if isBitfield:
+        raw[missing] = 0
+        return raw
+
+    if field.signRange:
+        if field.byteCount == 8:
+            values = raw.view(np.int64)
+        else:
+            values = raw.astype(np.int64)
+            values[values >= field.signBit] -= field.signRange
+    else:
+        values = raw
+    noData = values == 65535
+
+    values = values.astype(np.float64)
+    if field.scaling != 1:
+        values *= field.scaling
+    if field.conversion:
+        values += field.conversion[0]
+        values *= field.conversion[1]
+        values += field.conversion[2]
+    values[noData | missing] = np.nan
+    return values
+
+
+# Save the output of decodeFrames() to a .npz file
+def saveNpz(fileName, decoded, compress=False):
+    arrays = {}
+    for messageName, columns in decoded.items():
+        for columnName, column in columns.items():
+            arrays[messageName + NPZ_SEPARATOR + columnName] = column
+    if compress:
+        np.savez_compressed(fileName, **arrays)
+    else:
+        np.savez(fileName, **arrays)
+
+
+# Load a .npz file written by saveNpz() back into the form returned by decodeFrames()
+def loadNpz(fileName):
+    decoded = {}
+    with np.load(fileName) as arrays:
+        for name in arrays.files:
+            messageName, columnName = name.rsplit(NPZ_SEPARATOR, 1)
+            decoded.setdefault(messageName, {})[columnName] = arrays[name]
+    return decoded
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode CANusb captures into columns of field values")
+    parser.add_argument('-m', '--metadata', metavar="File", required=True,
+            help="Specify the messages file")
+    parser.add_argument('-o', '--output', metavar="File", required=True,
+            help="The .npz file to write")
+    parser.add_argument('--compress', action='store_true',
+            help="Compress the .npz file")
+    parser.add_argument('captures', nargs='+', metavar="Capture",
+            help="Files of raw CANusb output, or binary captures from --capture. Several files\
+                    are decoded as one capture, in order.")
+    args = parser.parse_args()
+
+    dataBack = CanData(argparse.Namespace(nogui=False))
+    try:
+        xmlImport(dataBack, args.metadata)
+    except Exception as e:
+        print("ERROR: " + str(e), file=sys.stderr)
+        return 1
+
+    frameArrays = [readCapture(fileName) for fileName in args.captures]
+    if len(frameArrays) == 1:
+        frameArrays = frameArrays[0]
+    else:
+        frameArrays = FrameArrays(*(np.concatenate([getattr(f, name) for f in frameArrays])
+                                    for name in ('ids', 'extended', 'dlcs', 'payloads', 'timestamps')))
+
+    decoded = decodeFrames(frameArrays, dataBack.dispatchTable)
+    saveNpz(args.output, decoded, args.compress)
+    for messageName in sorted(decoded):
+        print("{}: {} frames".format(messageName, len(decoded[messageName]['index'])))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+'''
+ * Copyright Bar Smith, Bryant Mairs, Alex Bardales 2015
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses.
+'''
+
+'''
+Benchmark for the NumPy batch decoder in batchDecoder.py.
+
+Random frames are synthesized for every message in a metadata file. They are
+decoded one at a time with CANacondaMessageParse and all at once with
+batchDecoder.decodeFrames(). The decode rates are reported, and every numeric
+field value is checked to be the same from both decoders. Bitfields are not
+compared, because the two decoders output them differently.
+
+Run from the top-level directory:
+    python3 benchmarks/benchBatchDecode.py [--frames N] [--metadata FILE]
+'''
+
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from backend import CanData
+from messageInfo import xmlImport, CAN_FORMAT_EXTENDED
+from CanMessage import RawFrame
+from Nmea2000 import Iso11783Encode
+from CanDataTranscoder import CANacondaMessageParse
+from batchDecoder import FrameArrays, decodeFrames, UNKNOWN
+
+
+def synthesizeFrames(dataBack, frameCount):
+    rng = random.Random(0)
+    messages = list(dataBack.messages.values())
+    frames = []
+    for i in range(frameCount):
+        messageInfo = rng.choice(messages)
+        if messageInfo.pgn:
+            id = Iso11783Encode(int(messageInfo.pgn), rng.randrange(256), 0, 2)
+        else:
+            id = messageInfo.id
+        if i % 16 == 0:
+            payload = b'\xff' * 8
+        else:
+            payload = rng.getrandbits(64).to_bytes(8, 'little')
+        frames.append(RawFrame(id, messageInfo.format == CAN_FORMAT_EXTENDED, 8, payload, i % 60000))
+    return frames
+
+
+def compare(dataBack, frames, perFrame, decoded):
+    mismatches = 0
+    for name, columns in decoded.items():
+        # Frames the batch decoder leaves undecoded, such as fast-packet fragments,
+        # have nothing to compare
+        if name == UNKNOWN:
+            continue
+        for row, index in enumerate(columns['index'].tolist()):
+            message = perFrame[index]
+            fields = dataBack.messages[message.name].fields
+            for fieldName, value in message.body.items():
+                if isinstance(value, str) and value != 'NaN':
+                    continue # bitfield
+                batchValue = columns[fieldName][row]
+                field = fields[fieldName]
+                if value == 'NaN':
+                    same = math.isnan(batchValue)
+                elif field.offset + field.length > 8 * frames[index].dlc:
+                    # Fields past the end of the frame are NaN in the batch decoder only
+                    same = math.isnan(batchValue)
+                else:
+                    same = float(value) == float(batchValue)
+                if not same:
+                    if not mismatches:
+                        print("MISMATCH {}.{}: {} vs {}".format(message.name, fieldName, value, batchValue))
+                    mismatches += 1
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=500000, help="Frames to decode")
+    parser.add_argument('--metadata', default='metadata/Nmea2000.xml', help="Metadata file to use")
+    benchArgs = parser.parse_args()
+
+    dataBack = CanData(argparse.Namespace(nogui=True, port=['bench']))
+    xmlImport(dataBack, benchArgs.metadata)
+    frames = synthesizeFrames(dataBack, benchArgs.frames)
+
+    start = time.perf_counter()
+    frameArrays = FrameArrays.fromFrames(frames)
+    loadTime = time.perf_counter() - start
+
+    start = time.perf_counter()
+    decoded = decodeFrames(frameArrays, dataBack.dispatchTable)
+    batchTime = time.perf_counter() - start
+
+    start = time.perf_counter()
+    perFrame = [CANacondaMessageParse(frame, dataBack) for frame in frames]
+    perFrameTime = time.perf_counter() - start
+
+    print("{} frames, {} messages".format(len(frames), len(decoded)))
+    print("per-frame decode   {:>12.0f} frames/s".format(len(frames) / perFrameTime))
+    print("batch decode       {:>12.0f} frames/s  ({:.0f}x)".format(len(frames) / batchTime, perFrameTime / batchTime))
+    print("RawFrame -> arrays {:>12.0f} frames/s".format(len(frames) / loadTime))
+    mismatches = compare(dataBack, frames, perFrame, decoded)
+    print("values identical" if not mismatches else "{} MISMATCHES".format(mismatches))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+'''
+ * Copyright Bar Smith, Bryant Mairs, Alex Bardales 2015
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses.
+'''
+
+'''
+Benchmark of '--bridge', using two canusbEmulator.py buses.
+
+The first emulator sends sequence-numbered frames, and the second is quiet.
+'CANaconda.py --nogui --bridge' forwards from one to the other, and the frames
+the second emulator is sent are counted and timed from when the first emulator
+sent them. Any extra CANaconda arguments, such as '--bridge-rate 500' or
+'-m metadata/Nmea2000.xml', are passed through.
+
+Run from the top-level directory:
+    python3 benchmarks/benchBridge.py [--rate N] [--seconds N] [-- CANaconda arguments]
+'''
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from canusbEmulator import CanUsbEmulator, decodeSequenceFrame, latencyMicros
+from benchEndToEnd import cpuSeconds, percentile, IDLE_TIMEOUT
+
+TOP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Seconds of frames left out of the latency figures, while the ports are opened
+WARMUP = 3
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rate', type=float, default=1000, help="Frames per second sent on the first bus")
+    parser.add_argument('--seconds', type=float, default=8, help="How long to send for")
+    parser.add_argument('extra', nargs=argparse.REMAINDER, help="Arguments for CANaconda, after '--'")
+    benchArgs = parser.parse_args()
+    extra = benchArgs.extra[1:] if benchArgs.extra[:1] == ['--'] else benchArgs.extra
+
+    count = int(benchArgs.rate * benchArgs.seconds)
+    source = CanUsbEmulator(rate=benchArgs.rate, count=count)
+    destination = CanUsbEmulator(rate=0)
+    source.start()
+    destination.start()
+    process = subprocess.Popen([sys.executable, 'CANaconda.py', '--nogui', '--bridge',
+                                '-p', 'a=' + source.portName, 'b=' + destination.portName] + extra,
+                               cwd=TOP_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    start = time.time()
+    lastCount = 0
+    lastChange = start
+    try:
+        while True:
+            time.sleep(0.1)
+            now = time.time()
+            if len(destination.transmitted) != lastCount:
+                lastCount = len(destination.transmitted)
+                lastChange = now
+            if lastCount >= count or (source.finished() and now - lastChange > IDLE_TIMEOUT):
+                break
+        cpu = cpuSeconds(process.pid)
+        elapsed = time.time() - start
+    finally:
+        process.kill()
+        process.wait()
+        source.close()
+        destination.close()
+
+    latencies = []
+    sequences = set()
+    for arrived, frame in destination.transmitted:
+        sequence, sentMicros = decodeSequenceFrame(frame.payload)
+        sequences.add(sequence)
+        if sequence >= benchArgs.rate * WARMUP:
+            latencies.append(latencyMicros(sentMicros, arrived))
+    latencies.sort()
+    print("sent {}, forwarded {}, not forwarded {}, source overruns {}".format(
+          count, len(sequences), count - len(sequences), source.overruns))
+    print("bus to bus latency p50 {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms, {:.1f}% CPU".format(
+          percentile(latencies, 0.5) / 1000, percentile(latencies, 0.99) / 1000,
+          percentile(latencies, 1.0) / 1000, 100 * cpu / elapsed))
+
+
+if __name__ == '__main__':
+    main()
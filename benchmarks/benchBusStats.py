@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+'''
+ * Copyright Bar Smith, Bryant Mairs, Alex Bardales 2015
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses.
+'''
+
+'''
+Benchmark of the per-ID bus statistics that every port keeps (see busStats.py).
+
+Synthesizes frames from a number of IDs with a mix of DLCs, counts them in
+batches like the serial reader does, and then times an update() over all the
+IDs. The time per frame is compared with the frames per second a fully loaded
+bus can carry at each bit rate.
+
+Run from the top-level directory:
+    python3 benchmarks/benchBusStats.py [--frames N] [--ids N]
+'''
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from busStats import BusStats, FRAME_BITS, BAUD_RATES
+from CanMessage import RawFrame
+from messageInfo import DispatchTable
+
+# Frames counted at a time, as a busy serial reader hands them over
+BATCH = 64
+
+
+class FakeDataBack():
+    def __init__(self):
+        self.dispatchTable = DispatchTable()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=500000, help="Frames to count")
+    parser.add_argument('--ids', type=int, default=200, help="Different IDs among them")
+    benchArgs = parser.parse_args()
+
+    rng = random.Random(0)
+    ids = [(0x18000000 | rng.randrange(0x1000000), True) if i % 2 else (rng.randrange(0x800), False)
+           for i in range(benchArgs.ids)]
+    frames = []
+    for i in range(benchArgs.frames):
+        id, extended = rng.choice(ids)
+        dlc = rng.choice((8, 8, 8, 3, 0))
+        frames.append(RawFrame(id, extended, dlc, bytes(dlc)))
+    batches = [frames[i:i + BATCH] for i in range(0, len(frames), BATCH)]
+
+    busStats = BusStats(FakeDataBack())
+    start = time.perf_counter()
+    for batch in batches:
+        busStats.add(batch)
+    perFrame = (time.perf_counter() - start) / len(frames)
+
+    start = time.perf_counter()
+    busStats.update('1M')
+    updateTime = time.perf_counter() - start
+
+    print("add: {:.3f} us per frame, update over {} IDs: {:.2f} ms".format(
+          1e6 * perFrame, len(busStats.ids), 1000 * updateTime))
+    # The fastest a bus can deliver frames is with the shortest frames back to back
+    shortest = FRAME_BITS[False][0][0]
+    for baud in ('125k', '250k', '500k', '1M'):
+        framesPerSecond = BAUD_RATES[baud] / shortest
+        print("{:>5} bus: at most {:.0f} frames/s, {:.2f}% of one core".format(
+              baud, framesPerSecond, 100 * framesPerSecond * perFrame))
+
+
+if __name__ == '__main__':
+    main()
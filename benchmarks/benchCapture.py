@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+'''
+ * Copyright Bar Smith, Bryant Mairs, Alex Bardales 2015
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses.
+'''
+
+'''
+Benchmark for the binary capture format in captureFile.py.
+
+A synthetic hour-long capture is written both as a binary capture and as the
+text the CLI prints with '--time', one frame per line. Then the same questions
+are answered from each: the frames in a one-second window, and every frame
+with one PGN. The text file has to be scanned from the start, while the binary
+capture is looked up through its index. The file sizes, the time taken to write
+and to query each, and whether the answers match, are reported.
+
+Run from the top-level directory:
+    python3 benchmarks/benchCapture.py [--frames N]
+'''
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from CanMessage import RawFrame
+from Nmea2000 import Iso11783Encode, Iso11783Decode
+from captureFile import CaptureWriter, CaptureReader
+from lawicel import parseFrame
+
+# Some of the PGNs on a typical boat's network, with their sources
+PGNS = [(127250, 1), (127251, 1), (128259, 2), (128267, 2), (129025, 3), (129026, 3),
+        (130306, 4), (130310, 5), (130311, 5), (126992, 3)]
+TARGET_PGN = 128267
+DURATION = 3600.0
+
+
+def synthesizeFrames(count):
+    rng = random.Random(0)
+    ids = [Iso11783Encode(pgn, src, 0, 3) for pgn, src in PGNS]
+    start = 1400000000.0
+    return [RawFrame(ids[rng.randrange(len(ids))], True, 8, rng.randbytes(8), None, start + DURATION * i / count)
+            for i in range(count)]
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def writeText(fileName, frames):
+    with open(fileName, 'w') as f:
+        for batch in range(0, len(frames), 1000):
+            f.write(''.join("{:.3f} {}\n".format(frame.time, frame) for frame in frames[batch:batch + 1000]))
+
+
+def writeBinary(fileName, frames):
+    writer = CaptureWriter(fileName)
+    for batch in range(0, len(frames), 1000):
+        writer.write(frames[batch:batch + 1000])
+    writer.close()
+
+
+def scanText(fileName, keep):
+    result = []
+    with open(fileName) as f:
+        for line in f:
+            stamp, text = line.split(' ')
+            frame = parseFrame(text.rstrip('\n').encode())
+            frame.time = float(stamp)
+            if keep(frame):
+                result.append(frame)
+    return result
+
+
+def key(frames):
+    return [(round(frame.time, 3), frame.id, frame.payload) for frame in frames]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=1000000, help="Frames in the capture")
+    benchArgs = parser.parse_args()
+
+    frames = synthesizeFrames(benchArgs.frames)
+    windowStart = frames[len(frames) // 2].time
+    windowEnd = windowStart + 1.0
+
+    with tempfile.TemporaryDirectory() as directory:
+        textFile = os.path.join(directory, 'capture.txt')
+        binaryFile = os.path.join(directory, 'capture.cap')
+        _, textWrite = timed(lambda: writeText(textFile, frames))
+        _, binaryWrite = timed(lambda: writeBinary(binaryFile, frames))
+        print("{} frames: text {:.1f} MB written in {:.2f} s, binary {:.1f} MB written in {:.2f} s".format(
+              len(frames), os.path.getsize(textFile) / 1e6, textWrite, os.path.getsize(binaryFile) / 1e6, binaryWrite))
+
+        textWindow, textWindowTime = timed(lambda: scanText(textFile, lambda f: windowStart <= f.time < windowEnd))
+        textPgn, textPgnTime = timed(lambda: scanText(textFile, lambda f: Iso11783Decode(f.id)[0] == TARGET_PGN))
+
+        def queryBinary(query):
+            reader = CaptureReader(binaryFile)
+            result = list(query(reader))
+            reader.close()
+            return result
+        binaryWindow, binaryWindowTime = timed(lambda: queryBinary(lambda r: r.framesBetween(windowStart, windowEnd)))
+        binaryPgn, binaryPgnTime = timed(lambda: queryBinary(lambda r: r.framesForPgn(TARGET_PGN)))
+
+        print("one second window: {} frames, text scan {:.3f} s, binary {:.5f} s".format(
+              len(binaryWindow), textWindowTime, binaryWindowTime))
+        print("PGN {}:      {} frames, text scan {:.3f} s, binary {:.3f} s".format(
+              TARGET_PGN, len(binaryPgn), textPgnTime, binaryPgnTime))
+        if key(textWindow) != key(binaryWindow) or key(textPgn) != key(binaryPgn):
+            print("WARNING: results differ")
+        else:
+            print("results identical")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+'''
+ * Copyright Bar Smith, Bryant Mairs, Alex Bardales 2015
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses.
+'''
+
+'''
+Benchmark for decoding message fields.
+
+For each metadata file, random frames are generated for every message in it
+and decoded twice. The first pass uses the bit string decoder that
+CANacondaMessageParse used before compiled decoders: ParseBodyBits, then
+getByteSubArray and payloadSwitch for each field. The second pass uses
+CANacondaMessageParse itself. Every decoded value is compared between the two,
+and any difference is reported. The run is repeated with unit conversion
+turned on for every field that supports it.
+
+Run from the top-level directory:
+    python3 benchmarks/benchDecode.py [--frames N] [metadata files...]
+'''
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from CANaconda import parserInit
+from backend import CanData, conversionMap
+from messageInfo import xmlImport, CAN_FORMAT_EXTENDED, ACTIVE
+from CanMessage import CanMessage, RawFrame
+from Nmea2000 import Iso11783Decode, Iso11783Encode
+from CanDataTranscoder import (CANacondaMessageParse, ParseBodyBits, getBodyFieldData,
+                               bitfieldFilterPayloadByValue, filterPayloadByValue)
+
+DEFAULT_FILES = ['metadata/Nmea2000.xml', 'metadata/SeaSlug.xml']
+
+
+# The decoder as it was before Field.compileDecoder(), including the unit conversion
+# that looked its coefficients up in conversionMap for every value.
+def legacyConvertUnits(payloadData, dataFilter):
+    try:
+        payloadData += float(conversionMap[dataFilter.units][dataFilter.unitsConversion][1])
+        payloadData *= float(conversionMap[dataFilter.units][dataFilter.unitsConversion][0])
+        payloadData += float(conversionMap[dataFilter.units][dataFilter.unitsConversion][2])
+    except KeyError:
+        pass
+    return payloadData
+
+
+def legacyScaleFilterConvert(dataFilter, payloadData):
+    if payloadData == 65535:
+        return 'NaN'
+    if dataFilter.scaling != 1:
+        payloadData *= dataFilter.scaling
+    if dataFilter.unitsConversion:
+        payloadData = legacyConvertUnits(payloadData, dataFilter)
+    if dataFilter.byValue[ACTIVE]:
+        payloadData = filterPayloadByValue(payloadData, dataFilter)
+    return payloadData
+
+
+def legacyParse(frame, dataBack):
+    newCanMessage = CanMessage()
+    newCanMessage.id = frame.id
+    newCanMessage.payload = frame.payload
+    newCanMessage.payloadBitstring = ParseBodyBits(frame.payload)
+    pgn = Iso11783Decode(frame.id)[0]
+    newCanMessage.pgn = pgn
+    currentMessageInfo = dataBack.dispatchTable.find(frame.extended, frame.id, pgn)
+    newCanMessage.name = currentMessageInfo.name
+    for fieldName in currentMessageInfo.fields:
+        dataFilter = currentMessageInfo.fields[fieldName]
+        payloadData = getBodyFieldData(dataFilter, newCanMessage)
+        if dataFilter.type == 'bitfield':
+            newCanMessage.body[dataFilter.name] = bitfieldFilterPayloadByValue(payloadData, dataFilter)
+        else:
+            newCanMessage.body[dataFilter.name] = legacyScaleFilterConvert(dataFilter, payloadData)
+    return newCanMessage
+
+
+def synthesizeFrames(dataBack, frameCount):
+    rng = random.Random(0)
+    messages = list(dataBack.messages.values())
+    frames = []
+    for i in range(frameCount):
+        messageInfo = rng.choice(messages)
+        if messageInfo.pgn:
+            id = Iso11783Encode(int(messageInfo.pgn), rng.randrange(256), 0, 2)
+        else:
+            id = messageInfo.id
+        size = messageInfo.size or 8
+        # Every so often send the N2K 'no data' pattern, and now and then a short frame
+        if i % 16 == 0:
+            payload = b'\xff' * size
+        elif i % 97 == 0:
+            payload = bytes(rng.randrange(256) for x in range(rng.randrange(size + 1)))
+        else:
+            payload = bytes(rng.randrange(256) for x in range(size))
+        frames.append(RawFrame(id, messageInfo.format == CAN_FORMAT_EXTENDED, len(payload), payload))
+    return frames
+
+
+def run(parse, frames, dataBack):
+    start = time.perf_counter()
+    messages = [parse(frame, dataBack) for frame in frames]
+    return time.perf_counter() - start, messages
+
+
+def compare(legacyMessages, compiledMessages):
+    mismatches = 0
+    for legacy, compiled in zip(legacyMessages, compiledMessages):
+        # repr() of a float round-trips exactly, so equal reprs mean equal bits
+        if repr(list(legacy.body.items())) != repr(list(compiled.body.items())):
+            if not mismatches:
+                print("  MISMATCH {}: {} vs {}".format(legacy.name, legacy.body, compiled.body))
+            mismatches += 1
+    return mismatches
+
+
+def benchmarkFile(fileName, frameCount):
+    parser = argparse.ArgumentParser()
+    parserInit(parser)
+    dataBack = CanData(parser.parse_args(['--nogui', '-p', 'bench', '-m', fileName]))
+    xmlImport(dataBack, fileName)
+    frames = synthesizeFrames(dataBack, frameCount)
+
+    for conversion in (False, True):
+        if conversion:
+            for messageInfo in dataBack.messages.values():
+                for field in messageInfo.fields.values():
+                    if field.units in conversionMap:
+                        targets = [x for x in conversionMap[field.units] if x != field.units]
+                        field.unitsConversion = targets[0]
+        legacyTime, legacyMessages = run(legacyParse, frames, dataBack)
+        compiledTime, compiledMessages = run(CANacondaMessageParse, frames, dataBack)
+        mismatches = compare(legacyMessages, compiledMessages)
+        print("{:<24} {:<14} {:>10.0f} {:>10.0f} {:>7.1f}x   {}".format(
+              os.path.basename(fileName), "converted" if conversion else "base units",
+              len(frames) / legacyTime, len(frames) / compiledTime, legacyTime / compiledTime,
+              "identical" if not mismatches else "{} MISMATCHES".format(mismatches)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=50000, help="Frames to decode per file")
+    parser.add_argument('files', nargs='*', default=DEFAULT_FILES, help="Metadata files to benchmark")
+    benchArgs = parser.parse_args()
+
+    print("{:<24} {:<14} {:>10} {:>10} {:>8}".format("metadata", "units", "bits frm/s", "compiled", "speedup"))
+    for fileName in benchArgs.files:
+        benchmarkFile(fileName, benchArgs.frames)
+
+
+if __name__ == '__main__':
+    main()
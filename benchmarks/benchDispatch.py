@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+'''
+ * Copyright Bar Smith, Bryant Mairs, Alex Bardales 2015
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses.
+'''
+
+'''
+Benchmark for finding the MessageInfo of a received frame.
+
+Synthesizes metadata with 10 to 5000 messages, half identified by PGN and half
+by ID. Then it looks up a stream of frames (a quarter of them unknown) using
+both the old linear scan over dataBack.messages and messageInfo.DispatchTable.
+
+Run from the top-level directory:
+    python3 benchmarks/benchDispatch.py [--frames N] [--sizes 10,100,1000,5000]
+'''
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from messageInfo import MessageInfo, DispatchTable, CAN_FORMAT_STANDARD, CAN_FORMAT_EXTENDED
+from CanMessage import RawFrame
+from Nmea2000 import Iso11783Decode, Iso11783Encode
+
+
+def synthesizeMetadata(size):
+    messages = {}
+    for i in range(size):
+        messageInfo = MessageInfo()
+        messageInfo.name = "Message {}".format(i)
+        if i % 2:
+            # PDU2 PGNs, from the proprietary range upwards
+            messageInfo.pgn = str(0x1F000 + i)
+            messageInfo.format = CAN_FORMAT_EXTENDED
+        else:
+            messageInfo.id = 0x100 + i
+            messageInfo.format = CAN_FORMAT_STANDARD if messageInfo.id <= 0x7FF else CAN_FORMAT_EXTENDED
+        messages[messageInfo.name] = messageInfo
+    return messages
+
+
+def synthesizeFrames(messages, frameCount):
+    rng = random.Random(0)
+    known = list(messages.values())
+    frames = []
+    for i in range(frameCount):
+        if i % 4 == 3:
+            frames.append(RawFrame(0x18EA0000 | rng.randrange(0x10000), True, 8, bytes(8)))
+            continue
+        messageInfo = rng.choice(known)
+        if messageInfo.pgn:
+            id = Iso11783Encode(int(messageInfo.pgn), rng.randrange(256), 0, rng.randrange(8))
+        else:
+            id = messageInfo.id
+        frames.append(RawFrame(id, messageInfo.format == CAN_FORMAT_EXTENDED, 8, bytes(8)))
+    return frames
+
+
+# The lookup that CANacondaMessageParse did before the dispatch table: scan every
+# message comparing against the PGN string and ID, then look the name up again.
+def legacyLookup(messages, id_to_name, pgn_to_name, frames):
+    found = 0
+    for frame in frames:
+        pgn = Iso11783Decode(frame.id)[0]
+        name = ''
+        for key in messages.keys():
+            if messages[key].pgn == str(pgn) or messages[key].id == frame.id:
+                name = messages[key].name
+                break
+        if not name:
+            continue
+        try:
+            messageInfo = messages[id_to_name[frame.id]]
+        except KeyError:
+            messageInfo = messages[pgn_to_name[str(pgn)]]
+        found += 1
+    return found
+
+
+def dispatchLookup(dispatchTable, frames):
+    found = 0
+    for frame in frames:
+        pgn = Iso11783Decode(frame.id)[0]
+        if dispatchTable.find(frame.extended, frame.id, pgn) is not None:
+            found += 1
+    return found
+
+
+def timeIt(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=20000, help="Frames to look up per metadata size")
+    parser.add_argument('--sizes', default='10,100,1000,5000', help="Comma-separated metadata sizes")
+    benchArgs = parser.parse_args()
+
+    print("{:>8} {:>16} {:>16} {:>10}".format("messages", "linear (us/frm)", "indexed (us/frm)", "speedup"))
+    for size in [int(x) for x in benchArgs.sizes.split(',')]:
+        messages = synthesizeMetadata(size)
+        id_to_name = {m.id: m.name for m in messages.values() if m.id is not None}
+        pgn_to_name = {m.pgn: m.name for m in messages.values()}
+        frames = synthesizeFrames(messages, benchArgs.frames)
+
+        buildTime, dispatchTable = timeIt(DispatchTable, messages)
+        legacyTime, legacyFound = timeIt(legacyLookup, messages, id_to_name, pgn_to_name, frames)
+        indexedTime, indexedFound = timeIt(dispatchLookup, dispatchTable, frames)
+        if legacyFound != indexedFound:
+            print("WARNING: lookups disagree ({} vs {} found)".format(legacyFound, indexedFound))
+        print("{:>8d} {:>16.2f} {:>16.2f} {:>9.0f}x   (table built in {:.1f} ms)".format(
+              size, 1e6 * legacyTime / len(frames), 1e6 * indexedTime / len(frames),
+              legacyTime / indexedTime, 1e3 * buildTime))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+'''
+ * Copyright Bar Smith, Bryant Mairs, Alex Bardales 2015
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses.
+'''
+
+'''
+End-to-end benchmark of the command-line program, using canusbEmulator.py in
+place of a CANusb.
+
+For each rate, the emulator sends 'seconds' worth of sequence-numbered frames,
+and 'CANaconda.py --nogui' is run against it in a subprocess. Its raw output is
+read back to count the frames that were dropped and to measure the latency from
+the emulator sending a frame to CANaconda printing it. The CPU time used by the
+CANaconda process is taken from /proc, so this only runs on Linux.
+
+Run from the top-level directory:
+    python3 benchmarks/benchEndToEnd.py [--rates 1000,4000,8000] [--seconds N]
+'''
+
+import argparse
+import os
+import re
+import select
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from canusbEmulator import CanUsbEmulator, decodeSequenceFrame, latencyMicros
+
+TOP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Matches the body of a raw message printed by CANaconda, e.g. 'Body: 0x[01,00,00,00,AB,CD,EF,01]'
+BODY_REGEX = re.compile(r"Body: 0x\[([0-9A-F,]*)\]")
+
+# How long to wait for output once the emulator has sent everything
+IDLE_TIMEOUT = 2.0
+
+
+# User and system CPU seconds used so far by process 'pid'
+def cpuSeconds(pid):
+    with open('/proc/{}/stat'.format(pid)) as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def runRate(rate, seconds):
+    count = int(rate * seconds)
+    emulator = CanUsbEmulator(rate=rate, count=count)
+    emulator.start()
+    process = subprocess.Popen([sys.executable, 'CANaconda.py', '--nogui', '-p', emulator.portName],
+                               cwd=TOP_DIR, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    seen = set()
+    latencies = []
+    pending = b''
+    lastOutput = time.time()
+    try:
+        while True:
+            readable, _, _ = select.select([process.stdout], [], [], 0.1)
+            now = time.time()
+            if readable:
+                data = os.read(process.stdout.fileno(), 65536)
+                if not data:
+                    break
+                lastOutput = now
+                lines = (pending + data).split(b'\n')
+                pending = lines.pop()
+                for line in lines:
+                    match = BODY_REGEX.search(line.decode('ascii', 'replace'))
+                    if not match or not match.group(1):
+                        continue
+                    payload = bytes(int(x, 16) for x in match.group(1).split(','))
+                    sequence, sentMicros = decodeSequenceFrame(payload)
+                    seen.add(sequence)
+                    latencies.append(latencyMicros(sentMicros, now))
+            if len(seen) >= count or (emulator.finished() and now - lastOutput > IDLE_TIMEOUT):
+                break
+        cpu = cpuSeconds(process.pid)
+    finally:
+        process.kill()
+        process.wait()
+        emulator.close()
+
+    latencies.sort()
+    print("{:>8.0f} {:>8d} {:>8d} {:>8d} {:>10.2f} {:>10.2f} {:>10.2f} {:>7.1f}%".format(
+          rate, count, count - len(seen), emulator.overruns,
+          percentile(latencies, 0.5) / 1000, percentile(latencies, 0.99) / 1000,
+          percentile(latencies, 1.0) / 1000, 100 * cpu / seconds))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rates', default='500,1900,4000,8000', help="Comma-separated frame rates to test")
+    parser.add_argument('--seconds', type=float, default=5, help="How long to send at each rate")
+    benchArgs = parser.parse_args()
+
+    print("{:>8} {:>8} {:>8} {:>8} {:>10} {:>10} {:>10} {:>8}".format(
+          "frames/s", "sent", "dropped", "overruns", "p50 (ms)", "p99 (ms)", "max (ms)", "CPU"))
+    for rate in [float(x) for x in benchArgs.rates.split(',')]:
+        runRate(rate, benchArgs.seconds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+'''
+ * Copyright Bar Smith, Bryant Mairs, Alex Bardales 2015
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses.
+'''
+
+'''
+End-to-end benchmark of reading several buses at once, using one
+canusbEmulator.py per bus.
+
+Each emulator sends sequence-numbered frames with its own ID, and
+'CANaconda.py --nogui --time' is run with all of their ports. Its output is
+read back to count each bus's dropped frames, to check that the merged stream
+is in time order, and to measure the latency from an emulator sending a frame
+to CANaconda printing it. The CPU time is taken from /proc, so this only runs
+on Linux.
+
+Run from the top-level directory:
+    python3 benchmarks/benchMultiPort.py [--buses N] [--rate N] [--seconds N] [--warmup N]
+'''
+
+import argparse
+import os
+import re
+import select
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from canusbEmulator import CanUsbEmulator, SEQUENCE_ID, decodeSequenceFrame, latencyMicros
+from benchEndToEnd import cpuSeconds, percentile, IDLE_TIMEOUT
+
+TOP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Matches a raw message printed by CANaconda with --time from one of several buses, e.g.
+# '1425000000.123 [bus1] Head: 0x18FF0002 (PGN: 65280), Body: 0x[01,00,00,00,AB,CD,EF,01]'
+LINE_REGEX = re.compile(r"([0-9.]+) \[(\w+)\] Head: .*Body: 0x\[([0-9A-F,]*)\]")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--buses', type=int, default=2, help="Number of buses to read")
+    parser.add_argument('--rate', type=float, default=1000, help="Frames per second on each bus")
+    parser.add_argument('--seconds', type=float, default=5, help="How long to send for")
+    parser.add_argument('--warmup', type=float, default=3,
+                        help="Seconds of frames to leave out of the latency figures, while the ports are opened")
+    benchArgs = parser.parse_args()
+    if benchArgs.buses < 2:
+        parser.error("--buses must be at least 2, since a single bus isn't merged")
+
+    count = int(benchArgs.rate * benchArgs.seconds)
+    warmupFrames = int(benchArgs.rate * benchArgs.warmup)
+    emulators = {}
+    for n in range(benchArgs.buses):
+        emulators['bus{}'.format(n)] = CanUsbEmulator(rate=benchArgs.rate, count=count, id=SEQUENCE_ID + n)
+    for emulator in emulators.values():
+        emulator.start()
+    ports = ["{}={}".format(name, emulator.portName) for name, emulator in emulators.items()]
+    process = subprocess.Popen([sys.executable, 'CANaconda.py', '--nogui', '--time', '-p'] + ports,
+                               cwd=TOP_DIR, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    seen = {name: set() for name in emulators}
+    latencies = []
+    inversions = 0
+    lastTime = 0.0
+    pending = b''
+    lastOutput = time.time()
+    start = time.time()
+    try:
+        while True:
+            readable, _, _ = select.select([process.stdout], [], [], 0.1)
+            now = time.time()
+            if readable:
+                data = os.read(process.stdout.fileno(), 65536)
+                if not data:
+                    break
+                lastOutput = now
+                lines = (pending + data).split(b'\n')
+                pending = lines.pop()
+                for line in lines:
+                    match = LINE_REGEX.match(line.decode('ascii', 'replace'))
+                    if not match or not match.group(3):
+                        continue
+                    frameTime = float(match.group(1))
+                    if frameTime < lastTime:
+                        inversions += 1
+                    lastTime = frameTime
+                    payload = bytes(int(x, 16) for x in match.group(3).split(','))
+                    sequence, sentMicros = decodeSequenceFrame(payload)
+                    seen[match.group(2)].add(sequence)
+                    if sequence >= warmupFrames:
+                        latencies.append(latencyMicros(sentMicros, now))
+            finished = all(emulator.finished() for emulator in emulators.values())
+            if all(len(s) >= count for s in seen.values()) or (finished and now - lastOutput > IDLE_TIMEOUT):
+                break
+        cpu = cpuSeconds(process.pid)
+        elapsed = time.time() - start
+    finally:
+        process.kill()
+        process.wait()
+        for emulator in emulators.values():
+            emulator.close()
+
+    latencies.sort()
+    for name, emulator in emulators.items():
+        print("{}: sent {}, dropped {}, overruns {}".format(name, count, count - len(seen[name]), emulator.overruns))
+    print("time order inversions: {}".format(inversions))
+    print("latency p50 {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms, {:.1f}% CPU".format(
+          percentile(latencies, 0.5) / 1000, percentile(latencies, 0.99) / 1000,
+          percentile(latencies, 1.0) / 1000, 100 * cpu / elapsed))
+
+
+if __name__ == '__main__':
+    main()
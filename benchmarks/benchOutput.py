@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+'''
+ * Copyright Bar Smith, Bryant Mairs, Alex Bardales 2015
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses.
+'''
+
+'''
+Benchmark for writing the CLI's output, comparing the old print() and flush() for
+every message with printmessage.BufferedOutput in its line and throughput modes.
+
+CSV-style lines are written in batches, as the transcoder hands them over, both
+to a file and to a pipe read by another process. The rate, the CPU used and the
+number of write calls are reported, and the output is checked to be identical.
+
+Run from the top-level directory:
+    python3 benchmarks/benchOutput.py [--lines N] [--batch N]
+'''
+
+import argparse
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from printmessage import BufferedOutput, LINE_MODE, THROUGHPUT_MODE
+
+
+# Counts the write() calls made to the stream it wraps
+class CountingStream():
+    def __init__(self, stream):
+        self.stream = stream
+        self.writes = 0
+
+    def write(self, data):
+        self.writes += 1
+        return self.stream.write(data)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def makeLines(count):
+    return ["{:.3f},{},{:.2f},,{}".format(1400000000 + i / 1000, i % 360, i * 0.01, i % 7) for i in range(count)]
+
+
+def writeLegacy(stream, batches):
+    for batch in batches:
+        for line in batch:
+            print(line, file=stream)
+            stream.flush()
+
+
+def writeBuffered(stream, batches, mode):
+    output = BufferedOutput(stream, mode)
+    for batch in batches:
+        for line in batch:
+            output.write(line)
+        output.batchDone()
+    output.flush()
+
+
+def run(name, writer, batches, target):
+    # The pipe's reader copies it into a file, so what was written can be checked
+    capture = tempfile.TemporaryFile('w+')
+    if target == 'file':
+        f = capture
+        reader = None
+    else:
+        reader = subprocess.Popen(['cat'], stdin=subprocess.PIPE, stdout=capture)
+        f = io.TextIOWrapper(reader.stdin)
+    stream = CountingStream(f)
+    lines = sum(len(batch) for batch in batches)
+
+    start = time.perf_counter()
+    cpuStart = time.process_time()
+    writer(stream, batches)
+    cpu = time.process_time() - cpuStart
+    elapsed = time.perf_counter() - start
+
+    if reader:
+        f.close()
+        reader.wait()
+    capture.seek(0)
+    written = capture.read()
+    capture.close()
+    print("{:<20} {:>5} {:>10.0f} lines/s {:>8.2f} us CPU/line {:>9} writes".format(
+          name, target, lines / elapsed, 1e6 * cpu / lines, stream.writes))
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=200000, help="Lines to write")
+    parser.add_argument('--batch', type=int, default=32, help="Lines handed over at a time")
+    benchArgs = parser.parse_args()
+
+    lines = makeLines(benchArgs.lines)
+    batches = [lines[i:i + benchArgs.batch] for i in range(0, len(lines), benchArgs.batch)]
+    expected = ''.join(line + '\n' for line in lines)
+    for target in ('file', 'pipe'):
+        outputs = [run("print + flush", writeLegacy, batches, target),
+                   run("buffered line", lambda s, b: writeBuffered(s, b, LINE_MODE), batches, target),
+                   run("buffered throughput", lambda s, b: writeBuffered(s, b, THROUGHPUT_MODE), batches, target)]
+        if any(output != expected for output in outputs):
+            print("WARNING: output differs")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+'''
+ * Copyright Bar Smith, Bryant Mairs, Alex Bardales 2015
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses.
+'''
+
+'''
+Benchmark of the GUI's live plot (see signalPlot.py).
+
+Plots a number of signals arriving at the same rate, each in a message of its
+own. A window's worth of samples is added through PlotSignals.add() in batches,
+as the transcoder does, and then frames are drawn into a Plot tab on an
+offscreen display. Reports the cost of adding a sample, which the transcoder
+pays, and of drawing a frame, which the GUI thread pays PLOT_FPS times a second.
+
+Run from the top-level directory:
+    python3 benchmarks/benchPlot.py [--signals N] [--rate HZ] [--frames N]
+'''
+
+import argparse
+import math
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5 import QtWidgets
+
+from CanMessage import CanMessage
+import signalPlot
+
+# Messages decoded at a time, as a busy transcoder hands them over
+BATCH = 64
+
+
+class FakeDataBack():
+    def __init__(self):
+        self.plotSignals = signalPlot.PlotSignals()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--signals', type=int, default=12, help="Signals to plot")
+    parser.add_argument('--rate', type=float, default=100, help="Samples per second of each signal")
+    parser.add_argument('--frames', type=int, default=100, help="Frames to draw")
+    benchArgs = parser.parse_args()
+
+    app = QtWidgets.QApplication(sys.argv)
+    dataBack = FakeDataBack()
+    for signal in range(benchArgs.signals):
+        dataBack.plotSignals.setPlotted("Message {}".format(signal), "Value", True)
+
+    # A window's worth of messages, ending now, with a different wave in each signal
+    now = time.time()
+    count = int(signalPlot.PLOT_WINDOW * benchArgs.rate)
+    messages = []
+    for i in range(count):
+        when = now - signalPlot.PLOT_WINDOW + i / benchArgs.rate
+        for signal in range(benchArgs.signals):
+            message = CanMessage()
+            message.name = "Message {}".format(signal)
+            message.time = when
+            message.body['Value'] = signal + math.sin(when * (signal + 1))
+            messages.append(message)
+
+    start = time.perf_counter()
+    for i in range(0, len(messages), BATCH):
+        dataBack.plotSignals.add(messages[i:i + BATCH])
+    perSample = (time.perf_counter() - start) / len(messages)
+
+    plot = signalPlot.SignalPlot()
+    plot.setup(dataBack, None)
+    plot.plotTimer.stop()
+    plot.resize(1000, 600)
+    plot.show()
+    app.processEvents()
+    plot.updatePlot()
+    app.processEvents()
+
+    fullDraws = [0]
+    plot.canvas.mpl_connect('draw_event', lambda event: fullDraws.__setitem__(0, fullDraws[0] + 1))
+    start = time.perf_counter()
+    for frame in range(benchArgs.frames):
+        plot.updatePlot()
+        app.processEvents()
+    perFrame = (time.perf_counter() - start) / benchArgs.frames
+
+    samplesPerSecond = benchArgs.signals * benchArgs.rate
+    print("add: {:.2f} us per sample, {:.2f}% of one core for {} signals at {:.0f} Hz".format(
+          1e6 * perSample, 100 * perSample * samplesPerSecond, benchArgs.signals, benchArgs.rate))
+    print("frame: {:.1f} ms, {:.1f}% of one core at {} frames/s, {} full redraws in {} frames".format(
+          1000 * perFrame, 100 * perFrame * signalPlot.PLOT_FPS, signalPlot.PLOT_FPS,
+          fullDraws[0], benchArgs.frames))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+'''
+ * Copyright Bar Smith, Bryant Mairs, Alex Bardales 2015
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses.
+'''
+
+'''
+Benchmark for the multi-frame message reassembly in reassembly.py.
+
+Two streams are synthesized and passed through Reassembler in batches, as the
+transcoder does.
+
+In the fast-packet stream, several sources send GNSS Position Data messages at
+the same time, with their frames interleaved, mixed with ordinary single-frame
+messages. A few frames are left out to check that the broken messages are
+dropped and counted.
+
+In the transport protocol stream, nodes send a mix of BAM broadcasts and RTS/CTS
+transfers to each other, with their packets interleaved. Some transfers resend
+a packet after a CTS, and some are aborted or stop part way through.
+
+Every reassembled payload is checked, and the rate is reported along with the
+CPU% that a fully loaded 250k bus would cost.
+
+Run from the top-level directory:
+    python3 benchmarks/benchReassembly.py [--messages N] [--sources N] [--batch N]
+'''
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from CanMessage import RawFrame
+from Nmea2000 import Iso11783Encode
+from reassembly import Reassembler, TP_CM, TP_DT, TP_RTS, TP_CTS, TP_BAM, TP_ABORT, GLOBAL_ADDRESS
+
+# Frames/sec on a 250k bus fully loaded with 8-byte extended frames
+BUS_FPS_250K = 1900
+
+GNSS_POSITION_DATA = 129029
+GNSS_SIZE = 43
+SYSTEM_TIME = 126992
+
+# Leave out one frame in this many
+DROP_EVERY = 500
+
+# A PGN that is usually sent with the transport protocol
+COMPONENT_IDENTIFICATION = 65249
+
+# Abort one transfer in this many, and resend a packet in one in this many
+ABORT_EVERY = 50
+RESEND_EVERY = 10
+
+
+# Split a payload into fast-packet frames
+def fastPacketFrames(id, sequence, payload):
+    frames = [RawFrame(id, True, 8, bytes([sequence << 5, len(payload)]) + payload[:6].ljust(6, b'\xff'))]
+    for counter, start in enumerate(range(6, len(payload), 7), 1):
+        frames.append(RawFrame(id, True, 8, bytes([(sequence << 5) | counter]) + payload[start:start + 7].ljust(7, b'\xff')))
+    return frames
+
+
+# Returns the interleaved frames, and the payloads that should come out of them. Messages
+# finish in a different order to the one they were started in, so the payloads are unordered.
+def synthesizeStream(messageCount, sourceCount):
+    rng = random.Random(0)
+    pending = {} # source -> frames not yet sent for its current message
+    sequences = [0] * sourceCount
+    frames = []
+    expected = []
+    sent = 0
+    dropped = 0
+    while sent < messageCount or pending:
+        # Occasionally a single-frame message from another node
+        if rng.random() < 0.2:
+            frames.append(RawFrame(Iso11783Encode(SYSTEM_TIME, 200, 0, 3), True, 8, bytes(8)))
+        source = rng.randrange(sourceCount)
+        if source not in pending:
+            if sent >= messageCount:
+                source = next(iter(pending))
+            else:
+                payload = bytes(rng.randrange(256) for i in range(GNSS_SIZE))
+                messageFrames = fastPacketFrames(Iso11783Encode(GNSS_POSITION_DATA, source, 0, 3), sequences[source], payload)
+                sequences[source] = (sequences[source] + 1) % 8
+                sent += 1
+                if sent % DROP_EVERY == 0:
+                    del messageFrames[rng.randrange(len(messageFrames))]
+                    dropped += 1
+                else:
+                    expected.append(payload)
+                pending[source] = messageFrames
+        frames.append(pending[source].pop(0))
+        if not pending[source]:
+            del pending[source]
+    return frames, expected, dropped
+
+
+def tpControl(control, pgn, src, dest, *data):
+    body = bytes(data).ljust(4, b'\xff') + pgn.to_bytes(3, 'little')
+    return RawFrame(Iso11783Encode(TP_CM, src, dest, 7), True, 8, bytes([control]) + body)
+
+
+# Returns the frames of one transport protocol transfer, which are sent in order, and
+# the payload if the transfer should complete. 'dest' is GLOBAL_ADDRESS for a BAM.
+def transportFrames(rng, index, src, dest, payload):
+    packets = (len(payload) + 6) // 7
+    size = len(payload).to_bytes(2, 'little')
+    data = [RawFrame(Iso11783Encode(TP_DT, src, dest, 7), True, 8,
+                     bytes([n + 1]) + payload[7 * n:7 * n + 7].ljust(7, b'\xff')) for n in range(packets)]
+    if dest == GLOBAL_ADDRESS:
+        frames = [tpControl(TP_BAM, COMPONENT_IDENTIFICATION, src, dest, size[0], size[1], packets)] + data
+    else:
+        frames = [tpControl(TP_RTS, COMPONENT_IDENTIFICATION, src, dest, size[0], size[1], packets, 16),
+                  tpControl(TP_CTS, COMPONENT_IDENTIFICATION, dest, src, packets, 1)] + data
+        if index % RESEND_EVERY == 0:
+            # The receiver asks for a packet again, and it is sent again
+            resend = rng.randrange(packets)
+            frames += [tpControl(TP_CTS, COMPONENT_IDENTIFICATION, dest, src, 1, resend + 1), data[resend]]
+    if index % ABORT_EVERY == 0:
+        # A BAM can't be aborted, the sender just stops. Otherwise the receiver aborts.
+        frames = frames[:rng.randrange(1, len(frames))]
+        if dest != GLOBAL_ADDRESS:
+            frames.append(tpControl(TP_ABORT, COMPONENT_IDENTIFICATION, dest, src, 1))
+        return frames, None
+    return frames, payload
+
+
+# As synthesizeStream(), for transport protocol transfers. Each source sends one
+# transfer at a time, alternating between BAM and RTS/CTS to node 0x80.
+def synthesizeTransportStream(transferCount, sourceCount):
+    rng = random.Random(1)
+    pending = {}
+    frames = []
+    expected = []
+    sent = 0
+    while sent < transferCount or pending:
+        source = rng.randrange(sourceCount)
+        if source not in pending:
+            if sent >= transferCount:
+                source = next(iter(pending))
+            else:
+                payload = bytes(rng.randrange(256) for i in range(rng.randrange(9, 200)))
+                dest = GLOBAL_ADDRESS if sent % 2 else 0x80
+                transferFrames, result = transportFrames(rng, sent + 1, source, dest, payload)
+                if result is not None:
+                    expected.append(result)
+                pending[source] = transferFrames
+                sent += 1
+        frames.append(pending[source].pop(0))
+        if not pending[source]:
+            del pending[source]
+    return frames, expected
+
+
+def run(name, frames, expected, fastPacketPgns, batch):
+    reassembler = Reassembler()
+    output = []
+    cpuStart = time.process_time()
+    for start in range(0, len(frames), batch):
+        output.extend(reassembler.process(frames[start:start + batch], fastPacketPgns))
+    cpu = time.process_time() - cpuStart
+
+    reassembled = [frame.payload for frame in output if frame.dlc > 8]
+    singles = sum(1 for frame in output if frame.dlc <= 8)
+    cpuPerFrame = cpu / len(frames)
+    print("{}: {} frames in, {} messages out ({} reassembled, {} single-frame)".format(
+          name, len(frames), len(output), len(reassembled), singles))
+    print("    {:.0f} frames/s, {:.2f} us CPU/frame, {:.2f}% CPU at {} frames/s".format(
+          len(frames) / cpu, cpuPerFrame * 1e6, 100 * cpuPerFrame * BUS_FPS_250K, BUS_FPS_250K))
+    if sorted(reassembled) != sorted(expected):
+        print("    WARNING: reassembled payloads do not match what was sent")
+    else:
+        print("    payloads identical")
+    return reassembler
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=50000, help="Fast-packet messages to send")
+    parser.add_argument('--sources', type=int, default=6, help="Sources sending at the same time")
+    parser.add_argument('--batch', type=int, default=32, help="Frames handed to the assembler at a time")
+    benchArgs = parser.parse_args()
+
+    frames, expected, dropped = synthesizeStream(benchArgs.messages, benchArgs.sources)
+    fastPackets = run("fast-packet", frames, expected, {GNSS_POSITION_DATA}, benchArgs.batch).fastPackets
+    print("    completed {}, timed out {}, dropped fragments {} ({} messages had a frame left out)".format(
+          fastPackets.completed, fastPackets.timedOut, fastPackets.droppedFragments, dropped))
+
+    frames, expected = synthesizeTransportStream(benchArgs.messages // 5, benchArgs.sources)
+    transport = run("transport protocol", frames, expected, set(), benchArgs.batch).transport
+    print("    completed {}, aborted {}, timed out {}, rejected {}, dropped fragments {}".format(
+          transport.completed, transport.aborted, transport.timedOut, transport.rejected, transport.droppedFragments))
+
+
+if __name__ == '__main__':
+    main()
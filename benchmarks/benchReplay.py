@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+'''
+ * Copyright Bar Smith, Bryant Mairs, Alex Bardales 2015
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses.
+'''
+
+'''
+Benchmark of the whole command-line program, fed from a recording with
+'--replay FILE --replay-speed 0' so that it runs as fast as it can.
+
+A binary capture of NMEA 2000 traffic is synthesized, then 'CANaconda.py --nogui'
+is run over it with each kind of output (raw, decoded with metadata, decoded
+with '--filter' choosing one field of one message, and CSV) in each output
+mode. The frames per second, from the program's own report, and the CPU time
+used are shown.
+
+Run from the top-level directory:
+    python3 benchmarks/benchReplay.py [--frames N]
+'''
+
+import argparse
+import os
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from CanMessage import RawFrame
+from Nmea2000 import Iso11783Encode
+from captureFile import CaptureWriter
+
+TOP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+METADATA = os.path.join('metadata', 'Nmea2000.xml')
+
+# Single-frame messages described in METADATA, with their sources
+PGNS = [(127245, 1), (128267, 2), (130306, 4), (129026, 3), (126992, 3), (65280, 9)]
+
+RUNS = [
+    ("raw", []),
+    ("decoded", ['-m', METADATA]),
+    ("filtered", ['-m', METADATA, '--filter', 'Wind Data{Wind speed}']),
+    ("csv", ['-m', METADATA, '--filter', 'Wind Data,Water Depth', '--csv', '--time']),
+]
+OUTPUT_MODES = ['line', 'throughput']
+
+REPORT_REGEX = re.compile(r"Replayed (\d+) frames in ([0-9.]+) s")
+
+
+def writeCapture(fileName, count):
+    rng = random.Random(0)
+    ids = [Iso11783Encode(pgn, src, 0, 3) for pgn, src in PGNS]
+    writer = CaptureWriter(fileName)
+    for start in range(0, count, 1000):
+        writer.write([RawFrame(ids[rng.randrange(len(ids))], True, 8, rng.randbytes(8), None, 1400000000 + i / 2000)
+                      for i in range(start, min(start + 1000, count))])
+    writer.close()
+
+
+def run(captureFile, name, args, outputMode):
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    process = subprocess.run([sys.executable, 'CANaconda.py', '--nogui', '--replay', captureFile,
+                              '--replay-speed', '0', '--output-mode', outputMode] + args,
+                             cwd=TOP_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    match = REPORT_REGEX.search(process.stderr.decode())
+    if not match:
+        print("{:<8} {:<10} failed: {}".format(name, outputMode, process.stderr.decode().strip()))
+        return
+    frames, seconds = int(match.group(1)), float(match.group(2))
+    print("{:<8} {:<10} {:>10.0f} {:>10.2f}".format(name, outputMode, frames / seconds, 1e6 * cpu / frames))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=200000, help="Frames in the recording")
+    benchArgs = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        captureFile = os.path.join(directory, 'replay.cap')
+        writeCapture(captureFile, benchArgs.frames)
+        print("{:<8} {:<10} {:>10} {:>10}".format("output", "mode", "frames/s", "us CPU/frame"))
+        for name, args in RUNS:
+            for outputMode in OUTPUT_MODES:
+                run(captureFile, name, args, outputMode)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+'''
+ * Copyright Bar Smith, Bryant Mairs, Alex Bardales 2015
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses.
+'''
+
+'''
+Benchmark for the serial reader in canport.py.
+
+A recorded CANusb byte stream is played back through a fake serial port, once
+through the old read-one-character-at-a-time loop and once through
+CANPort.readFrames(). For each we report frames/sec and the CPU time spent per
+frame, along with the CPU% that a fully loaded bus at the chosen baud would cost.
+
+If no recording is given, a stream of NMEA 2000-like frames is synthesized. Use
+--save to keep it for later runs.
+
+Run from the top-level directory:
+    python3 benchmarks/benchSerialReader.py [--input FILE] [--frames N] [--bus-fps N]
+'''
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import serial
+
+from CANaconda import parserInit
+from backend import CanData
+from canport import CANPort, CR
+
+# Frames/sec on a 250k bus fully loaded with 8-byte extended frames
+BUS_FPS_250K = 1900
+
+# The frame regex that canport.py used before the fixed-position parser in lawicel.py
+LEGACY_REGEX = re.compile(r"\s*(?:t([0-9a-fA-F]{3})|T([0-9a-fA-F]{8}))(\d)((?:[0-9a-fA-F][0-9a-fA-F]){0,8})((?:[0-9a-fA-F][0-9a-fA-F]){2})?")
+
+# How many bytes the fake port has waiting after each read. A real CANusb
+# delivers data in USB packets of up to 64 bytes.
+USB_PACKET = 64
+
+
+# A stand-in for serial.Serial that plays back a byte stream.
+class ReplaySerial():
+    def __init__(self, stream):
+        self.stream = stream
+        self.pos = 0
+
+    @property
+    def in_waiting(self):
+        return min(USB_PACKET, len(self.stream) - self.pos)
+
+    def read(self, size=1):
+        if self.pos >= len(self.stream):
+            raise serial.serialutil.SerialException("end of recording")
+        data = self.stream[self.pos:self.pos + size]
+        self.pos += size
+        return data
+
+
+def synthesizeStream(frameCount):
+    rng = random.Random(0)
+    frames = []
+    for i in range(frameCount):
+        id = (rng.randrange(8) << 26) | (rng.choice((127245, 128259, 129025, 130306)) << 8) | rng.randrange(256)
+        frames.append("T{:08X}8{:016X}".format(id, rng.getrandbits(64)).encode('ascii'))
+    return CR.join(frames) + CR
+
+
+# The reader that canport.py used before chunked reads: one read() per character,
+# growing a bytes object, and a regex match once a carriage return is seen.
+def legacyGetMatchObject(canPort, serialCAN):
+    character = None
+    rawmsg = b""
+    while character != (CR or '\r'):
+        try:
+            character = serialCAN.read()
+        except serial.serialutil.SerialException:
+            return None
+        rawmsg += bytes(character)
+    rawmsg = rawmsg.decode('utf-8')
+    return LEGACY_REGEX.match(rawmsg)
+
+
+def runLegacy(canPort, stream):
+    serialCAN = ReplaySerial(stream)
+    count = 0
+    while True:
+        matchedMsg = legacyGetMatchObject(canPort, serialCAN)
+        if matchedMsg is None:
+            return count
+        count += 1
+
+
+def runChunked(canPort, stream):
+    serialCAN = ReplaySerial(stream)
+    count = 0
+    while True:
+        frames = canPort.readFrames(serialCAN)
+        if frames is None:
+            return count
+        count += len(frames)
+
+
+def measure(name, function, canPort, stream, busFps):
+    wallStart = time.perf_counter()
+    cpuStart = time.process_time()
+    count = function(canPort, stream)
+    cpu = time.process_time() - cpuStart
+    wall = time.perf_counter() - wallStart
+    cpuPerFrame = cpu / count
+    print("{:<10} {:>8d} frames  {:>10.0f} frames/s  {:>7.2f} us CPU/frame  {:>6.1f}% CPU at {} frames/s".format(
+          name, count, count / wall, cpuPerFrame * 1e6, 100 * cpuPerFrame * busFps, busFps))
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input', metavar='FILE', help="Recorded CANusb byte stream to play back")
+    parser.add_argument('--save', metavar='FILE', help="Save the synthesized stream to FILE")
+    parser.add_argument('--frames', type=int, default=200000, help="Frames to synthesize")
+    parser.add_argument('--bus-fps', type=int, default=BUS_FPS_250K, help="Bus load used for the CPU%% column")
+    benchArgs = parser.parse_args()
+
+    if benchArgs.input:
+        with open(benchArgs.input, 'rb') as f:
+            stream = f.read()
+    else:
+        stream = synthesizeStream(benchArgs.frames)
+        if benchArgs.save:
+            with open(benchArgs.save, 'wb') as f:
+                f.write(stream)
+
+    canacondaParser = argparse.ArgumentParser()
+    parserInit(canacondaParser)
+    dataBack = CanData(canacondaParser.parse_args(['--nogui', '-p', 'replay']))
+    canPort = CANPort(dataBack)
+
+    print("Playing back {} bytes".format(len(stream)))
+    legacyCount = measure("per-byte", runLegacy, canPort, stream, benchArgs.bus_fps)
+    chunkedCount = measure("chunked", runChunked, canPort, stream, benchArgs.bus_fps)
+    if legacyCount != chunkedCount:
+        print("WARNING: readers disagree on the frame count ({} vs {})".format(legacyCount, chunkedCount))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+'''
+ * Copyright Bar Smith, Bryant Mairs, Alex Bardales 2015
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses.
+'''
+
+'''
+Benchmark for transmitting, using canusbEmulator.py in place of a CANusb.
+
+The emulated bus is quiet: nothing is received. Frames are queued for
+transmission at a steady rate, and the time from queueing each one to the
+emulator receiving it is measured. This is done first with the old transmit
+path, where the receive thread only wrote queued frames after a read() returned,
+and then with the transmit thread running CANPort.sendMessages(). Both the time
+taken for frames to arrive and the CPU used by the process are reported.
+
+Run from the top-level directory:
+    python3 benchmarks/benchTransmit.py [--frames N] [--rate N]
+'''
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from CANaconda import parserInit
+from backend import CanData, LatencyStats
+from canport import CANPort
+from canusbEmulator import CanUsbEmulator
+
+# Transmitted frames have this ID, and their payload is their index
+TX_ID = 0x7FF
+
+
+# The receive loop as it was before the transmit thread: queued frames were only
+# written once serialParse() returned, which needs data to arrive or read() to time out.
+def legacyLoop(canPort, serialCAN):
+    txQueue = canPort.dataBack.CANacondaTxMsg_queue
+    while canPort.live:
+        canPort.serialParse(serialCAN)
+        while txQueue.qsize() > 0:
+            msg = txQueue.get()
+            serialCAN.write(bytes(msg, 'UTF-8'))
+
+
+def run(name, useThread, frameCount, rate):
+    emulator = CanUsbEmulator(rate=0)
+    emulator.start()
+    parser = argparse.ArgumentParser()
+    parserInit(parser)
+    dataBack = CanData(parser.parse_args(['--nogui', '-p', emulator.portName]))
+    canPort = CANPort(dataBack)
+    serialCAN = canPort.pyserialInit()
+
+    threads = []
+    if useThread:
+        threads.append(threading.Thread(target=canPort.getMessages, args=(serialCAN,)))
+        threads.append(threading.Thread(target=canPort.sendMessages, args=(serialCAN,)))
+    else:
+        threads.append(threading.Thread(target=legacyLoop, args=(canPort, serialCAN)))
+    for thread in threads:
+        thread.start()
+
+    cpuStart = time.process_time()
+    queuedAt = []
+    start = time.time()
+    for i in range(frameCount):
+        delay = start + i / rate - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        queuedAt.append(time.time())
+        dataBack.CANacondaTxMsg_queue.put("t{:03X}8{:016X}\r".format(TX_ID, i))
+
+    # Wait for the frames to reach the emulator, or give up once the old path has had
+    # plenty of time to send them
+    deadline = time.time() + 2 * CANPort.TIMEOUT
+    while len(emulator.transmitted) < frameCount and time.time() < deadline:
+        time.sleep(0.05)
+    cpu = time.process_time() - cpuStart
+    elapsed = time.time() - start
+
+    canPort.live = False
+    for thread in threads:
+        thread.join()
+    serialCAN.close()
+    emulator.close()
+
+    latency = LatencyStats()
+    for arrived, frame in emulator.transmitted:
+        latency.add(arrived - queuedAt[int.from_bytes(frame.payload, 'big')])
+    print("{:<12} {}/{} frames arrived, {:.1f}% CPU".format(name, latency.count, frameCount, 100 * cpu / elapsed))
+    print("             queue to emulator: {}".format(latency))
+    if useThread:
+        print("             queue to write():  {} ({} frames in {} writes)".format(
+              canPort.txLatency, canPort.txMessages, canPort.txWrites))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=100, help="Frames to transmit")
+    parser.add_argument('--rate', type=float, default=50, help="Frames queued per second")
+    benchArgs = parser.parse_args()
+
+    run("old loop", False, benchArgs.frames, benchArgs.rate)
+    run("tx thread", True, benchArgs.frames, benchArgs.rate)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+'''
+ * Copyright Bar Smith, Bryant Mairs, Alex Bardales 2015
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses.
+'''
+
+'''
+Forwards frames between two buses, for the '--bridge' option.
+
+A bridge joins either two ports, forwarding in both directions, or a recording
+given with '--replay' and a port, forwarding the recording onto the bus. Each
+direction is a BridgeDirection. Its source's reader thread calls forward() with
+every batch of frames read, and the frames that pass go straight into the
+destination port's transmit queue, still as Lawicel frames. Nothing is decoded
+on the way.
+
+For each ID, the rules decide once whether its frames are forwarded and with
+what ID, and the answer is cached:
+  * '--bridge-allow' forwards only the IDs and PGNs listed
+  * '--bridge-deny' never forwards the IDs and PGNs listed
+  * '--bridge-rewrite OLD:NEW' forwards frames with ID OLD as ID NEW. An OLD of up to
+    3 hex digits is a standard ID, and a longer one an extended ID
+'--bridge-rate' then limits each direction to a number of frames per second,
+dropping the rest.
+
+Frames are only handed on to the transcoder if they are being monitored, which
+means the metadata given with '-m' has a message for them (limited to the
+messages chosen with '--filter', if any). Without '-m' nothing is decoded.
+'''
+
+import time
+
+from backend import TimedPipelineQueue, LATEST_PER_ID, DROP_OLDEST
+from Nmea2000 import Iso11783Decode
+from reassembly import TP_CM, TP_DT
+
+# Marks a PGN, rather than an ID, in the allow and deny lists, as in 'pgn:129029'
+PGN_PREFIX = 'pgn:'
+
+# The name of the source when bridging a recording onto a port
+REPLAY_SOURCE = 'replay'
+
+# A rate limit lets through this many seconds' worth of frames at once
+RATE_BURST = 0.1
+
+# How long to wait, at the end of a recording, for its frames to be written out
+BRIDGE_DRAIN_TIMEOUT = 5.0
+
+
+# Parse a comma-separated list of IDs in hex and PGNs in decimal, e.g.
+# '1F2,18FF0001,pgn:129029', into a set of IDs and a set of PGNs
+def parseIdList(text):
+    ids = set()
+    pgns = set()
+    for item in text.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            if item.lower().startswith(PGN_PREFIX):
+                pgns.add(int(item[len(PGN_PREFIX):]))
+            else:
+                ids.add(int(item, 16))
+        except ValueError:
+            raise ValueError("'{}' is neither a hex ID nor a PGN like {}129029".format(item, PGN_PREFIX))
+    return ids, pgns
+
+
+# Parse an ID rewrite given as 'OLD:NEW', both in hex, into ((OLD, extended), NEW).
+# As in Lawicel frames, an OLD of up to 3 digits is a standard ID and a longer one is
+# extended, so '100:101' rewrites standard frames and '00000100:00000101' extended
+# ones. Frames keep their format, so NEW has to fit in an ID of the same size.
+def parseRewrite(text):
+    try:
+        old, new = text.split(':')
+        oldId, newId = int(old, 16), int(new, 16)
+    except ValueError:
+        raise ValueError("'{}' is not an ID rewrite like 18FF0001:18FF0002".format(text))
+    extended = len(old.strip()) > 3 or oldId > 0x7FF
+    limit = 0x1FFFFFFF if extended else 0x7FF
+    if not 0 <= oldId <= limit or not 0 <= newId <= limit:
+        raise ValueError("'{}' rewrites a {} ID, so both IDs must be from 0 to {:X}".format(
+                         text, "extended" if extended else "standard", limit))
+    return (oldId, extended), newId
+
+
+# Limits a stream to 'rate' frames per second, letting short bursts through
+class TokenBucket():
+    def __init__(self, rate):
+        self.rate = rate
+        self.capacity = max(1.0, rate * RATE_BURST)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+
+    # Return how many of 'count' frames may be sent now
+    def take(self, count):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        allowed = min(count, int(self.tokens))
+        self.tokens -= allowed
+        return allowed
+
+
+# Decides which frames are forwarded, and with what ID
+class BridgeRules():
+    def __init__(self, allow=None, deny=None, rewrites=()):
+        self.allowIds, self.allowPgns = parseIdList(allow) if allow else (None, None)
+        self.denyIds, self.denyPgns = parseIdList(deny) if deny else (set(), set())
+        # (id, extended) -> the ID to forward as
+        self.rewrites = dict(parseRewrite(rewrite) for rewrite in rewrites)
+        # (id, extended) -> the ID to forward as, or None to not forward
+        self.cache = {}
+
+    def forwardId(self, id, extended):
+        key = (id, extended)
+        try:
+            return self.cache[key]
+        except KeyError:
+            pass
+        pgn = Iso11783Decode(id)[0] if extended else None
+        if id in self.denyIds or pgn in self.denyPgns:
+            newId = None
+        elif self.allowIds is not None and id not in self.allowIds and pgn not in self.allowPgns:
+            newId = None
+        else:
+            newId = self.rewrites.get(key, id)
+        self.cache[key] = newId
+        return newId
+
+
+# Forwarding from one source to one destination port. 'queue' is the destination's
+# transmit queue.
+class BridgeDirection():
+    def __init__(self, bridge, source, destination, rate, queue):
+        self.bridge = bridge
+        self.source = source
+        self.destination = destination
+        self.queue = queue
+        self.limiter = TokenBucket(rate) if rate else None
+        # The destination CANPort, once it is open
+        self.port = None
+
+        # Statistics
+        self.received = 0
+        self.forwarded = 0
+        self.filtered = 0
+        self.rateDropped = 0
+
+    @property
+    def name(self):
+        return "{} -> {}".format(self.source, self.destination)
+
+    # Forward what should be from a batch of frames read from the source. Returns the
+    # frames that are being monitored, for the transcoder.
+    def forward(self, frames):
+        forwardId = self.bridge.rules.forwardId
+        out = []
+        for frame in frames:
+            id = forwardId(frame.id, frame.extended)
+            if id is None:
+                continue
+            if frame.extended:
+                out.append("T{:08X}{:d}{}\r".format(id, frame.dlc, frame.payload.hex().upper()))
+            else:
+                out.append("t{:03X}{:d}{}\r".format(id, frame.dlc, frame.payload.hex().upper()))
+        self.received += len(frames)
+        self.filtered += len(frames) - len(out)
+        if self.limiter and out:
+            allowed = self.limiter.take(len(out))
+            self.rateDropped += len(out) - allowed
+            del out[allowed:]
+        if out:
+            self.queue.putMany(out)
+            self.forwarded += len(out)
+        return self.bridge.monitored(frames)
+
+    # How many forwarded frames have not been written to the destination yet
+    def unwritten(self):
+        if self.port is None:
+            return 0
+        return self.forwarded - self.queue.dropped - self.port.txMessages
+
+    def __str__(self):
+        report = "{}: {} received, {} forwarded, {} filtered, {} over the rate limit, {} dropped by the queue".format(
+                 self.name, self.received, self.forwarded, self.filtered, self.rateDropped, self.queue.dropped)
+        if self.port:
+            # Frames are queued as soon as they are read, so this is close to the whole
+            # time from reading a frame to writing it out
+            report += "\n    read to write: {}".format(self.port.txLatency)
+        return report
+
+
+# Every direction of a bridge, set up from the command line arguments
+class Bridge():
+    def __init__(self, dataBack):
+        self.dataBack = dataBack
+        args = dataBack.args
+        channels = [name for name, port in dataBack.channels]
+        if args.replay:
+            if len(channels) != 1:
+                raise Exception("Bridge a recording onto exactly one port")
+            endpoints = [(REPLAY_SOURCE, channels[0])]
+        elif len(channels) == 2:
+            endpoints = [(channels[0], channels[1]), (channels[1], channels[0])]
+        else:
+            raise Exception("A bridge needs two ports, or one port and a recording to --replay")
+
+        rates = args.bridge_rate or [0]
+        if len(rates) == 1:
+            rates = rates * len(endpoints)
+        elif len(rates) != len(endpoints):
+            raise Exception("Give either one --bridge-rate for both directions, or one for each")
+
+        self.rules = BridgeRules(args.bridge_allow, args.bridge_deny, args.bridge_rewrite or ())
+
+        # Forwarded frames wait in a queue like the receive queues, except that frames
+        # can't be replaced once queued
+        policy = args.queue_policy if args.queue_policy != LATEST_PER_ID else DROP_OLDEST
+        self.directions = []
+        for (source, destination), rate in zip(endpoints, rates):
+            queue = TimedPipelineQueue(args.queue_size, policy, name="bridge to " + destination)
+            self.directions.append(BridgeDirection(self, source, destination, rate, queue))
+
+        # (id, extended, channel) -> whether frames with that ID are being monitored
+        self.monitoredIds = {}
+
+    # Connect a port, or a ReplayPort, to the directions it is the source or the
+    # destination of
+    def attach(self, port, name):
+        for direction in self.directions:
+            if direction.source == name:
+                port.bridge = direction
+            if direction.destination == name:
+                port.txQueue = direction.queue
+                direction.port = port
+
+    # The frames in 'frames' whose messages are being monitored. Transport protocol
+    # frames are kept whenever anything is, since they may carry a monitored message.
+    def monitored(self, frames):
+        dataBack = self.dataBack
+        if not dataBack.messageInfo_to_fields:
+            return []
+        monitoredIds = self.monitoredIds
+        kept = []
+        for frame in frames:
+            key = (frame.id, frame.extended, frame.channel)
+            isMonitored = monitoredIds.get(key)
+            if isMonitored is None:
+                pgn = Iso11783Decode(frame.id)[0] if frame.extended else None
+                messageInfo = dataBack.dispatchTable.find(frame.extended, frame.id, pgn, frame.channel)
+                isMonitored = monitoredIds[key] = pgn in (TP_CM, TP_DT) or (
+                    messageInfo is not None and messageInfo.name in dataBack.messageInfo_to_fields and
+                    dataBack.chosenOnChannel(messageInfo.name, frame.channel))
+            if isMonitored:
+                kept.append(frame)
+        return kept
+
+    # Wait for everything that has been forwarded to be written out
+    def drain(self, timeout):
+        deadline = time.monotonic() + timeout
+        while any(direction.unwritten() for direction in self.directions) and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def __str__(self):
+        return "\n".join(str(direction) for direction in self.directions)
@@ -0,0 +1,216 @@
+'''
+ * Copyright Bar Smith, Bryant Mairs, Alex Bardales 2015
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses.
+'''
+
+'''
+Statistics for each ID seen on a bus, and how much of the bus they use.
+
+Every CANPort has a BusStats, and every frame it reads is counted in it, by ID
+and data length (DLC). That is one dictionary lookup and one addition per
+frame, so it is always on. Everything else is worked out from the counts when
+update() is called, about once a second, by '--stats' or the GUI's 'Bus load'
+tab: the frames and bits per second of each ID and of the whole bus, the share
+of the bus's bit rate they take up, and which IDs have no metadata. Only frames
+that get through the CANusb's acceptance filter are read, so while '--filter'
+programs it the figures are marked as filtered rather than the whole bus's.
+
+The bits a frame takes on the wire depend on its format and DLC, and on the
+stuff bits the transmitter adds after five equal bits in a row. Those depend
+on the contents of the frame, so they are estimated: random bits need a stuff
+bit about once every 30 bits, and at worst every 4 bits (after the first 5)
+carry one. The load is shown for both.
+'''
+
+import time
+
+from Nmea2000 import Iso11783Decode
+
+# The largest DLC of a classic CAN frame
+MAX_DLC = 8
+
+# Bits in a data frame besides its data, when nothing is stuffed: start of frame,
+# arbitration and control fields, CRC and delimiter, ACK slot and delimiter, end of
+# frame, and the intermission before the next frame can start
+STANDARD_OVERHEAD = 47
+EXTENDED_OVERHEAD = 67
+
+# Bits from the start of frame to the end of the CRC, besides the data. These are
+# the bits that stuff bits are added among.
+STANDARD_STUFFED = 34
+EXTENDED_STUFFED = 54
+
+# Random bits need a stuff bit, on average, after this many bits
+EXPECTED_STUFF_INTERVAL = 30
+
+# The bit rate of each '--canbaud' setting
+BAUD_RATES = {'10k': 10000, '20k': 20000, '50k': 50000, '100k': 100000, '125k': 125000,
+              '250k': 250000, '500k': 500000, '800k': 800000, '1M': 1000000}
+
+
+# The bits a data frame takes on the wire, as (expected, worst case) counts
+def frameBits(extended, dlc):
+    if extended:
+        plain = EXTENDED_OVERHEAD + 8 * dlc
+        stuffed = EXTENDED_STUFFED + 8 * dlc
+    else:
+        plain = STANDARD_OVERHEAD + 8 * dlc
+        stuffed = STANDARD_STUFFED + 8 * dlc
+    return plain + stuffed / EXPECTED_STUFF_INTERVAL, plain + (stuffed - 1) // 4
+
+
+# frameBits() for every format and DLC: FRAME_BITS[extended][dlc]
+FRAME_BITS = {extended: [frameBits(extended, dlc) for dlc in range(MAX_DLC + 1)]
+              for extended in (False, True)}
+
+
+# What update() found for one ID
+class IdStats():
+    def __init__(self, id, extended, dlcCounts):
+        self.id = id
+        self.extended = extended
+        # How many frames there have been with each DLC
+        self.dlcCounts = dlcCounts
+        self.frames = sum(dlcCounts)
+        # The name of the message in the metadata, or None if there isn't one
+        self.name = None
+        # Rates since the last update()
+        self.framesPerSecond = 0.0
+        self.bitsPerSecond = 0.0
+        self.worstBitsPerSecond = 0.0
+
+    # The ID as it is written in Lawicel frames
+    def idString(self):
+        return "{:08X}".format(self.id) if self.extended else "{:03X}".format(self.id)
+
+    # The DLCs seen, most common first, like '8 (90%), 3 (10%)'
+    def dlcString(self):
+        counts = sorted(((count, dlc) for dlc, count in enumerate(self.dlcCounts) if count), reverse=True)
+        return ", ".join("{} ({:.0f}%)".format(dlc, 100 * count / self.frames) for count, dlc in counts)
+
+
+class BusStats():
+    def __init__(self, dataBack, channel=None):
+        self.dataBack = dataBack
+        self.channel = channel
+        # Set when the CANusb's acceptance filter is programmed, so that only some of
+        # the bus's frames are counted
+        self.filtered = False
+        # (id, extended) -> how many frames there have been with each DLC. The reader
+        # thread adds to these, and update() reads them.
+        self.counts = {}
+
+        # What the last update() found
+        self.ids = []
+        self.framesPerSecond = 0.0
+        self.bitsPerSecond = 0.0
+        self.worstBitsPerSecond = 0.0
+        self.bitRate = None
+        self.unknownIds = 0
+        self.unknownFrames = 0
+        # The counts, and when they were taken, at the last update()
+        self.lastCounts = {}
+        self.lastTime = time.monotonic()
+
+    # Count a batch of frames read from the bus
+    def add(self, frames):
+        counts = self.counts
+        for frame in frames:
+            key = (frame.id, frame.extended)
+            dlcCounts = counts.get(key)
+            if dlcCounts is None:
+                dlcCounts = counts[key] = [0] * (MAX_DLC + 1)
+            dlcCounts[frame.dlc] += 1
+
+    # Work out the rates since the last update(), for a bus running at 'canBaud'
+    # (such as '250k', or '' if it isn't known yet)
+    def update(self, canBaud):
+        now = time.monotonic()
+        elapsed = now - self.lastTime
+        dispatchTable = self.dataBack.dispatchTable
+        lastCounts = self.lastCounts
+        # The reader thread may add IDs meanwhile, so a copy is taken
+        counts = {key: list(dlcCounts) for key, dlcCounts in list(self.counts.items())}
+
+        ids = []
+        totals = [0.0, 0.0, 0.0]
+        unknownIds = 0
+        unknownFrames = 0
+        for (id, extended), dlcCounts in counts.items():
+            stats = IdStats(id, extended, dlcCounts)
+            previous = lastCounts.get((id, extended))
+            if elapsed > 0:
+                bitsByDlc = FRAME_BITS[extended]
+                frames = expected = worst = 0
+                for dlc, count in enumerate(dlcCounts):
+                    if previous:
+                        count -= previous[dlc]
+                    if count:
+                        frames += count
+                        expected += count * bitsByDlc[dlc][0]
+                        worst += count * bitsByDlc[dlc][1]
+                stats.framesPerSecond = frames / elapsed
+                stats.bitsPerSecond = expected / elapsed
+                stats.worstBitsPerSecond = worst / elapsed
+                totals[0] += stats.framesPerSecond
+                totals[1] += stats.bitsPerSecond
+                totals[2] += stats.worstBitsPerSecond
+            pgn = Iso11783Decode(id)[0] if extended else None
+            messageInfo = dispatchTable.find(extended, id, pgn, self.channel)
+            if messageInfo is None:
+                unknownIds += 1
+                unknownFrames += stats.frames
+            else:
+                stats.name = messageInfo.name
+            ids.append(stats)
+
+        ids.sort(key=lambda stats: stats.bitsPerSecond, reverse=True)
+        self.ids = ids
+        self.framesPerSecond, self.bitsPerSecond, self.worstBitsPerSecond = totals
+        self.bitRate = BAUD_RATES.get(canBaud)
+        self.unknownIds = unknownIds
+        self.unknownFrames = unknownFrames
+        self.lastCounts = counts
+        self.lastTime = now
+
+    # The share of the bus's bit rate that 'bitsPerSecond' takes up, in percent, or
+    # None if the bit rate isn't known
+    def load(self, bitsPerSecond):
+        if not self.bitRate:
+            return None
+        return 100 * bitsPerSecond / self.bitRate
+
+    # One line about the whole bus, as of the last update()
+    def summary(self):
+        text = "{:.0f} frames/s, {:.1f} kbit/s".format(self.framesPerSecond, self.bitsPerSecond / 1000)
+        if self.bitRate:
+            text += ", load {:.1f}% (worst case {:.1f}%) of {:.0f} kbit/s".format(
+                    self.load(self.bitsPerSecond), self.load(self.worstBitsPerSecond), self.bitRate / 1000)
+        text += ", {} IDs, {} without metadata ({} frames)".format(
+                len(self.ids), self.unknownIds, self.unknownFrames)
+        if self.filtered:
+            text += " [filtered: only frames let through the acceptance filter are counted]"
+        return text
+
+    # A line for each ID, busiest first, as of the last update()
+    def idLines(self):
+        lines = []
+        for stats in self.ids:
+            line = "{:>8}: {:.1f} frames/s, {:.1f} kbit/s".format(
+                   stats.idString(), stats.framesPerSecond, stats.bitsPerSecond / 1000)
+            if self.bitRate:
+                line += " ({:.1f}%)".format(self.load(stats.bitsPerSecond))
+            lines.append(line + ", DLC {}, {}".format(stats.dlcString(), stats.name or "no metadata"))
+        return lines
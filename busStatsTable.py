@@ -0,0 +1,73 @@
+'''
+ * Copyright Bar Smith, Bryant Mairs, Alex Bardales 2015
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses.
+'''
+
+# The BusStatsTable class gets instantiated in canaconda_GUI.py
+# It shows the load on the bus, and a row for each ID seen on it with its
+# share of that load (see busStats.py). The table is rebuilt by updateTable(),
+# which is called once a second by a timer.
+
+from PyQt5 import QtCore, QtWidgets
+
+# Columns:
+ID, MESSAGE, FRAMES, KBITS, LOAD, DLC = range(6)
+
+
+class BusStatsTable(QtWidgets.QWidget):
+
+    def setup(self, dataBack, parent):
+        super(BusStatsTable, self).__init__()
+        self.dataBack = dataBack
+        self.parent = parent
+
+        self.summaryLabel = QtWidgets.QLabel("Not connected")
+        self.tableWidget = QtWidgets.QTableWidget()
+        self.tableWidget.setObjectName("busStatsTableWidget")
+        # Hide row numbers:
+        self.tableWidget.verticalHeader().setVisible(False)
+        self.tableWidget.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        headerList = ['ID', 'Message', 'Frames/s', 'kbit/s', 'Load', 'DLC']
+        self.tableWidget.setColumnCount(len(headerList))
+        self.tableWidget.setHorizontalHeaderLabels(headerList)
+        self.tableWidget.horizontalHeader().setStretchLastSection(True)
+
+        vbox = QtWidgets.QVBoxLayout()
+        vbox.addWidget(self.summaryLabel)
+        vbox.addWidget(self.tableWidget)
+        self.setLayout(vbox)
+
+    # Bring the table up to date with the port's statistics, busiest ID first
+    def updateTable(self):
+        canPort = getattr(self.dataBack, 'canPort', None)
+        if canPort is None or not self.dataBack.alreadyStreaming:
+            return
+        busStats = canPort.busStats
+        busStats.update(canPort.canBaudRate)
+        self.summaryLabel.setText(busStats.summary())
+
+        self.tableWidget.setRowCount(len(busStats.ids))
+        for row, stats in enumerate(busStats.ids):
+            load = busStats.load(stats.bitsPerSecond)
+            values = [stats.idString(), stats.name or "no metadata",
+                      "{:.1f}".format(stats.framesPerSecond), "{:.1f}".format(stats.bitsPerSecond / 1000),
+                      "{:.1f}%".format(load) if load is not None else "", stats.dlcString()]
+            for column, value in enumerate(values):
+                item = self.tableWidget.item(row, column)
+                if item is None:
+                    item = QtWidgets.QTableWidgetItem()
+                    self.tableWidget.setItem(row, column, item)
+                item.setText(value)
+        self.tableWidget.resizeColumnsToContents()
@@ -28,6 +28,7 @@ from PyQt5.QtGui import QCursor
 from PyQt5.QtCore import pyqtSignal
 from PyQt5.QtCore import pyqtRemoveInputHook as pyqtrm
 
+import queue
 import threading
 import time
 import os
@@ -37,6 +38,8 @@ from serial.tools.list_ports import comports
 
 import filtersTreeWidget
 import filterTable
+import busStatsTable
+from messageStreamModel import MessageStreamModel, StreamRecord
 from backend import *
 from CanDataTranscoder import generateMessage
 import canport
@@ -45,7 +48,13 @@ import outMessageTableWidget
 import printmessage
 import transmitGrid
 from arbitraryTransmit import ArbitraryTransmitWidget
-from messageInfo import xmlImport, CAN_FORMAT_EXTENDED
+from messageInfo import xmlImport, DispatchTable, CAN_FORMAT_EXTENDED
+
+# The 'Plot' tab needs numpy and matplotlib, which are optional
+try:
+    import signalPlot
+except ImportError:
+    signalPlot = None
 
 # displayList
 from printmessage import ID, PGN, BODY, RAW
@@ -53,6 +62,12 @@ from printmessage import ID, PGN, BODY, RAW
 # Message stream enum
 DECODED, RAW_HEX, CSV = range(3)
 
+# How many times a second the message stream is brought up to date
+STREAM_REFRESH_HZ = 30
+
+# How many times a second the latest values in the messages table are brought up to date
+TABLE_REFRESH_HZ = 10
+
 
 class Ui_CANaconda_GUI(QtCore.QObject):
     startHourGlass = pyqtSignal()
@@ -84,6 +99,10 @@ class Ui_CANaconda_GUI(QtCore.QObject):
         self.mainWindow.menuChoose_port.setTitle("Choose Port")
         self.mainWindow.menuAction.addAction(self.mainWindow.menuChoose_port.menuAction())
 
+        # The fields ticked in the messages table for plotting, fed by the transcoder
+        if signalPlot is not None:
+            self.dataBack.plotSignals = signalPlot.PlotSignals()
+
         # Here we set up one of the tabs
         self.mainWindow.filterTable = filterTable.FilterTable()
         self.mainWindow.filterTable.setup(self.dataBack, self)
@@ -98,6 +117,19 @@ class Ui_CANaconda_GUI(QtCore.QObject):
         self.mainWindow.filtersTreeWidget.setup(self.mainWindow, self.dataBack, self)
         self.mainWindow.tabWidget.addTab(self.mainWindow.filtersTreeWidget, "View Meta Data")
 
+        # And a tab showing the load each ID puts on the bus
+        self.mainWindow.busStatsTable = busStatsTable.BusStatsTable()
+        self.mainWindow.busStatsTable.setup(self.dataBack, self)
+        self.mainWindow.busStatsTable.setObjectName("busStatsTable")
+        self.mainWindow.tabWidget.addTab(self.mainWindow.busStatsTable, "Bus load")
+
+        # And one plotting the fields ticked in the messages table
+        if signalPlot is not None:
+            self.mainWindow.signalPlot = signalPlot.SignalPlot()
+            self.mainWindow.signalPlot.setup(self.dataBack, self)
+            self.mainWindow.signalPlot.setObjectName("signalPlot")
+            self.mainWindow.tabWidget.addTab(self.mainWindow.signalPlot, "Plot")
+
         # Now set up the transmit grid
         self.mainWindow.transmitGrid = transmitGrid.TransmitGridWidget()
         # Sending 'self' as an explicit parameter to retain reference to UI_CANaconda_GUI, otherwise
@@ -122,6 +154,19 @@ class Ui_CANaconda_GUI(QtCore.QObject):
         if self.dataBack.args.port != None:
             self.comportSelect()
 
+        # The message stream keeps a fixed number of messages, and builds the text of
+        # each only when it is scrolled into view
+        self.messageStreamModel = MessageStreamModel(self.formatMessage)
+        messagesView = self.mainWindow.messagesView
+        messagesView.setModel(self.messageStreamModel)
+        messagesView.horizontalHeader().hide()
+        messagesView.horizontalHeader().setStretchLastSection(True)
+        messagesView.verticalHeader().hide()
+        messagesView.verticalHeader().setSectionResizeMode(QtWidgets.QHeaderView.Fixed)
+        messagesView.verticalHeader().setDefaultSectionSize(messagesView.fontMetrics().height() + 2)
+        messagesView.setShowGrid(False)
+        messagesView.setWordWrap(False)
+
         # start connecting signals and slots
         # Load metadata filter on menu item click
         self.mainWindow.actionLoad_Filters_From_File.triggered.connect(self.loadFilter)
@@ -131,6 +176,7 @@ class Ui_CANaconda_GUI(QtCore.QObject):
 
         # Change display type in message stream based on combo box index
         self.mainWindow.displayCombo.currentIndexChanged.connect(self.setOutput)
+        self.mainWindow.displayCombo.currentIndexChanged.connect(self.messageStreamModel.reformat)
 
         # Update logging button text based on combo box index
         self.mainWindow.displayCombo.currentIndexChanged.connect(self.updateButtonLoggingText)
@@ -139,7 +185,39 @@ class Ui_CANaconda_GUI(QtCore.QObject):
         self.mainWindow.menuAction.aboutToShow.connect(self.setChoose_port_Actions)
 
         # Clear the message stream window on button push
-        self.mainWindow.buttonClearMessageStream.clicked.connect(self.clearTextBrowser)
+        self.mainWindow.buttonClearMessageStream.clicked.connect(self.clearMessageStream)
+
+        # Show how full the pipeline's queues are in the status bar
+        self.mainWindow.queueStatsLabel = QtWidgets.QLabel()
+        self.mainWindow.statusBar.addPermanentWidget(self.mainWindow.queueStatsLabel)
+        self.queueStatsTimer = QtCore.QTimer()
+        self.queueStatsTimer.timeout.connect(self.updateQueueStats)
+        self.queueStatsTimer.start(1000)
+
+        # Show how many messages a second are decoded, and how many make it into the
+        # message stream
+        self.mainWindow.streamRateLabel = QtWidgets.QLabel()
+        self.mainWindow.statusBar.addPermanentWidget(self.mainWindow.streamRateLabel)
+        self.messagesRendered = 0
+        self.lastStreamCounts = (0, 0, time.monotonic())
+        self.queueStatsTimer.timeout.connect(self.updateStreamRate)
+
+        # Messages are added to the message stream in one block, a few times a second,
+        # rather than one at a time as they are decoded
+        self.streamTimer = QtCore.QTimer()
+        self.streamTimer.timeout.connect(self.updateMessageStream)
+        self.streamTimer.start(1000 // STREAM_REFRESH_HZ)
+
+        # The values in the messages table are updated the same way, but only those
+        # that have changed
+        self.tableTimer = QtCore.QTimer()
+        self.tableTimer.timeout.connect(self.mainWindow.filterTable.updateValueInTable)
+        self.tableTimer.start(1000 // TABLE_REFRESH_HZ)
+
+        # Refresh the bus load tab
+        self.busStatsTimer = QtCore.QTimer()
+        self.busStatsTimer.timeout.connect(self.mainWindow.busStatsTable.updateTable)
+        self.busStatsTimer.start(1000)
         
 
     # Enable the two buttons that allow user to transmit messages
@@ -168,21 +246,57 @@ class Ui_CANaconda_GUI(QtCore.QObject):
 
     def updateMessageStream(self):
         """
-        Update the message stream. Connected to the 'parsedMsgPut' signal.
+        Update the message stream with every message decoded since the last update.
+        Called STREAM_REFRESH_HZ times a second by 'streamTimer'.
         """
-        outmsg = self.getMessage(self.dataBack.CANacondaRxMsg_queue)
-        if outmsg is not None:
-            self.mainWindow.messagesTextBrowser.append("%s" % outmsg)
-            self.outmsgSignal.emit()
-
+        try:
+            messages = self.dataBack.CANacondaRxMsg_queue.getMany(block=False)
+        except queue.Empty:
+            return
+        records = [StreamRecord(message) for message in messages if printmessage.guiShown(self.dataBack, message)]
+        if not records:
+            return
+        # While logging, the messages are written out as they come in
+        if self.dataBack.logflag:
+            self.file.write("".join(self.formatMessage(record) + "\n" for record in records))
+        # Keep showing the newest messages. If the user has scrolled up, keep showing
+        # the same ones, following them up as the oldest are dropped.
+        scrollBar = self.mainWindow.messagesView.verticalScrollBar()
+        atBottom = scrollBar.value() == scrollBar.maximum()
+        shifted = self.messageStreamModel.append(records)
+        if atBottom:
+            self.mainWindow.messagesView.scrollToBottom()
+        elif shifted:
+            scrollBar.setValue(scrollBar.value() - shifted)
+        self.messagesRendered += len(records)
+        self.outmsgSignal.emit()
+
+    def updateStreamRate(self):
+        """
+        Update the status bar readout of messages decoded and shown per second.
+        """
+        parsed = self.dataBack.canTranscoderGUI.messagesParsed
+        lastParsed, lastRendered, lastTime = self.lastStreamCounts
+        now = time.monotonic()
+        elapsed = now - lastTime
+        self.mainWindow.streamRateLabel.setText("{:.0f} messages/s received, {:.0f} shown".format(
+            (parsed - lastParsed) / elapsed, (self.messagesRendered - lastRendered) / elapsed))
+        self.lastStreamCounts = (parsed, self.messagesRendered, now)
+
+    def updateQueueStats(self):
+        """
+        Update the status bar readout of each queue's fill level, high-water mark and drops.
+        """
+        text = "   ".join("{}: {}/{} (max {}), {} dropped".format(q.name, q.qsize(), q.maxsize or "-", q.highWater, q.dropped)
+                           for q in self.dataBack.queues())
+        self.mainWindow.queueStatsLabel.setText(text)
 
-    def getMessage(self, CANacondaRxMsg_queue):
+    def formatMessage(self, CANacondaMessage):
         """
         Called by updateMessageStream. 'messageInfoFlag' is set to True when the metadata is loaded.
         GUI_rawFlag is set to False when program initalizes, but is set to True only when user
         selects the 'Raw' display option from the combo-box.
         """
-        CANacondaMessage = CANacondaRxMsg_queue.get()
         # Switch statement depending on current UI settings
         if self.dataBack.messageInfoFlag is False or self.dataBack.GUI_rawFlag:
             return printmessage.noGuiParse(self.dataBack, CANacondaMessage)
@@ -208,24 +322,27 @@ class Ui_CANaconda_GUI(QtCore.QObject):
         # Now it is okay to set the baud
         self.dataBack.canPort.changeCanUSBbaud(self.serialCAN, baudrate)
         
-        # Now that the CanUSB baud has changed, we can start a new serial
-        # thread using the CANPort class.
+        # Now that the CanUSB baud has changed, we can start new serial
+        # threads using the CANPort class.
         self.serialRxThread = threading.Thread(target=self.dataBack.canPort.getMessages, args=(self.serialCAN,))
         self.serialRxThread.daemon = True
+        self.serialTxThread = threading.Thread(target=self.dataBack.canPort.sendMessages, args=(self.serialCAN,))
+        self.serialTxThread.daemon = True
 
-        # Set the canPort.live flag back to True, otherwise the thread 
-        # will return immediately after starting it.
+        # Set the canPort.live flag back to True, otherwise the threads
+        # will return immediately after starting them.
         self.dataBack.canPort.live = True
 
-        # Now start the thread
+        # Now start the threads
         self.serialRxThread.start()
+        self.serialTxThread.start()
         self.removeHourGlass()
 
     # Set the comport after user has selected from comports menu. Before returning, open serial connection
     # in pyserialHandler().
     def comportSelect(self):
         if self.dataBack.args.port != None:
-            self.dataBack.comport = self.dataBack.args.port[0]
+            self.dataBack.comport = self.dataBack.channels[0][1]
         else:
             self.dataBack.comport = self.sender().text()
         self.dataBack.comportsFlag = True
@@ -257,7 +374,7 @@ class Ui_CANaconda_GUI(QtCore.QObject):
         # Use this timer as a watchdog for when a node on the bus is shut off.
         # Without it, frequency column won't go back to zero.
         self.freqTimer = QtCore.QTimer()
-        self.freqTimer.timeout.connect(self.mainWindow.filterTable.updateValueInTable)
+        self.freqTimer.timeout.connect(self.mainWindow.filterTable.updateRates)
         self.freqTimer.start(1000)
 
     # begin receiving messages and push to CANacondaRxMsg_queue
@@ -267,10 +384,7 @@ class Ui_CANaconda_GUI(QtCore.QObject):
 
         # The serialCAN thread was initialized without error
         if type(self.serialCAN) != int:
-            self.dataBack.canTranscoderGUI.parsedMsgPut.connect(self.updateMessageStream)
-            self.dataBack.canTranscoderGUI.parsedMsgPut.connect(
-                                               self.mainWindow.filterTable.updateValueInTable)
-            self.dataBack.canTranscoderGUI.newMessageUp.connect(self.mainWindow.filterTable.populateTable)
+            self.dataBack.canTranscoderGUI.newMessageUp.connect(self.mainWindow.filterTable.addNewMessages)
             self.removeHourGlass()
             self.setStreamingFlag()
             return True
@@ -306,11 +420,11 @@ class Ui_CANaconda_GUI(QtCore.QObject):
         self.serialRxThread.daemon = True
         self.serialRxThread.name = 'serialRxThread'
         self.serialRxThread.start()
-#        self.serialTxThread = threading.Thread(target=self.dataBack.canPort.sendMessages, 
-#                                                args=(self.serialCAN,))
-#        self.serialTxThread.daemon = True
-#        self.serialTxThread.name = 'serialTxThread'
-#        self.serialTxThread.start()
+        self.serialTxThread = threading.Thread(target=self.dataBack.canPort.sendMessages, 
+                                                args=(self.serialCAN,))
+        self.serialTxThread.daemon = True
+        self.serialTxThread.name = 'serialTxThread'
+        self.serialTxThread.start()
         self.transcoderThread = threading.Thread(target=self.dataBack.canTranscoderGUI.CanTranscoderRun)
         self.transcoderThread.daemon = True
         self.transcoderThread.name = 'transcoderThread'
@@ -336,6 +450,9 @@ class Ui_CANaconda_GUI(QtCore.QObject):
         # A map from message PGN to its name
         self.dataBack.pgn_to_name = {}
 
+        # The lookup table for received frames
+        self.dataBack.dispatchTable = DispatchTable()
+
 
     # Load metadata after user has selected that option from the menu
     def loadFilter(self):
@@ -444,22 +561,16 @@ class Ui_CANaconda_GUI(QtCore.QObject):
     # This is done by determining which message/field pair the user has selected in the
     # filterTable widget.
     def update_messageInfo_to_fields(self):
-        self.dataBack.messageInfo_to_fields = {}
-        # Iterate through all the rows in the table
-        for row in range(0,self.mainWindow.filterTable.tableWidget.rowCount()):
-            # If the checkbox has been checked, store the name and field associated with row
-            if self.mainWindow.filterTable.tableWidget.item(
-                    row, filterTable.CHECKBOX).checkState() == QtCore.Qt.Checked:
-                name = self.mainWindow.filterTable.tableWidget.item(
-                                                row, filterTable.MESSAGE).text()
-                field = self.mainWindow.filterTable.tableWidget.item(
-                                                row, filterTable.FIELD).text()
-                # Update dataBack accordingly
-                if name in self.dataBack.messageInfo_to_fields:
-                    self.dataBack.messageInfo_to_fields[name].append(field)
-                else:
-                    self.dataBack.messageInfo_to_fields[name] = []
-                    self.dataBack.messageInfo_to_fields[name].append(field)
+        messageInfo_to_fields = {}
+        # Go through the checked rows of the table, in the order they are listed
+        for name, field in self.mainWindow.filterTable.checkedFields():
+            # Update dataBack accordingly
+            if name in messageInfo_to_fields:
+                messageInfo_to_fields[name].append(field)
+            else:
+                messageInfo_to_fields[name] = []
+                messageInfo_to_fields[name].append(field)
+        self.dataBack.messageInfo_to_fields = messageInfo_to_fields
 
     # For creating the printmessage.
     # recall: DECODED, RAW_HEX, CSV = range(3)
@@ -505,8 +616,8 @@ class Ui_CANaconda_GUI(QtCore.QObject):
                 self.dataBack.fieldIndices[field] = i
                 i += 1
 
-    def clearTextBrowser(self):
-        self.mainWindow.messagesTextBrowser.clear()
+    def clearMessageStream(self):
+        self.messageStreamModel.clear()
 
 
     # This function handles the logging functionality. When the "start logging as..." 
@@ -516,7 +627,6 @@ class Ui_CANaconda_GUI(QtCore.QObject):
     def saveToFile(self):
         if self.dataBack.logflag:
             self.mainWindow.loggingButton.setText("Start logging as " + self.mainWindow.displayCombo.currentText()) 
-            self.file.write(self.mainWindow.messagesTextBrowser.toPlainText())
             self.file.close()
             # Revert label back to original text
             self.mainWindow.loggingStatusLabel.setText("<font color = grey><i>not recording</i><font>")
@@ -538,7 +648,7 @@ class Ui_CANaconda_GUI(QtCore.QObject):
 
             # OK to log. Clear text browser, disable the display combo box, and open a file
             # for writing.
-            self.clearTextBrowser()
+            self.clearMessageStream()
             self.mainWindow.displayCombo.setDisabled(True)
             self.mainWindow.filterTable.disableItemsForLogging()
             self.file = open(self.mainWindow.loggingFileName.text(), 'w')
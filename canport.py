@@ -19,17 +19,22 @@ This file includes the code for the CanPort class, which is run from the
 recieveMessage_helper function from canpython.py
 
 The CanPort deals with the serial data from the CAN to USB node.
-Once a message has been received, a regex match object is created and
-the serial data is discarded.
+Serial data is read in chunks and split into frames on the carriage return.
+Each complete frame is parsed into a RawFrame record, and the frames from
+one read are pushed to the transcode queue together. Any partial frame at the
+end of a chunk is kept until the rest of it arrives.
+
+Transmitting is done by its own thread running sendMessages(), which sleeps
+until there is something in the transmit queue, so frames go out at once
+whether or not anything is being received.
 
 
 '''
 
 # Standard libraries
-import re
 import time
 import sys
-from queue import Queue
+from queue import Queue, Empty
 
 # Other libraries
 import serial
@@ -38,8 +43,10 @@ import serial
 # User libraries
 from CanMessage import *
 from printmessage import *
-from backend import conversionMap
+from backend import conversionMap, LatencyStats
 from Nmea2000 import Iso11783Decode
+from lawicel import parseFrame, DeviceClock, TIMESTAMPS_ON
+from busStats import BusStats
 
 # Constants
 from messageInfo import CAN_FORMAT_EXTENDED
@@ -80,15 +87,42 @@ class CANPort():
     # Set the timeout (in seconds) for connecting to the CANusb hardware.
     TIMEOUT = 5
 
-    def __init__(self, dataBack):
+    # How often (in seconds) the transmit thread wakes up to check if it should stop
+    TX_POLL = 0.5
+
+    def __init__(self, dataBack, comport=None, channel='0'):
         self.dataBack = dataBack
         self.CANacondaRx_TranscodeQueue = dataBack.CANacondaRx_TranscodeQueue
-        self.comport = dataBack.comport
+        self.comport = comport if comport is not None else dataBack.comport
+        # The name this port's frames are tagged with, to tell buses apart
+        self.channel = channel
+        # Receive statistics: frames parsed, and bytes read from the serial port
+        self.framesRead = 0
+        self.bytesRead = 0
         self.args = dataBack.args
         # This flag should prevent executing Parsing code unless it is True
         self.live = False
         # A string that indicates the current baudrate
         self.canBaudRate = ''
+        # Serial data that has been read but does not yet make up a complete frame.
+        # Reused for the lifetime of the port rather than rebuilt for every message.
+        self.rxBuffer = bytearray()
+        # If the user asked for the CANusb's own timestamps, this turns them into times
+        self.deviceClock = DeviceClock() if self.args.timestamps else None
+        # Transmit statistics: the time from a message being queued to being written to
+        # the serial port, and how many messages and write() calls there have been.
+        self.txLatency = LatencyStats()
+        self.txMessages = 0
+        self.txWrites = 0
+        # The queue of messages to transmit. A bridge gives each port its own.
+        self.txQueue = dataBack.CANacondaTxMsg_queue
+        # The bridge.BridgeDirection this port's frames are forwarded by, if bridging
+        self.bridge = None
+        # The acceptance.AcceptanceFilter programmed into the CANusb, if any. Frames that
+        # get through it are checked again exactly before they are decoded.
+        self.acceptance = None
+        # Frame counts for each ID read, for the bus load report
+        self.busStats = BusStats(dataBack, channel)
 
     def pyserialInit(self, baudrate=57600, canbaud=BAUDMAP['250k']):
         #opens a serial connection called serialCAN on COM? at 57600 Baud
@@ -98,10 +132,6 @@ class CANPort():
         except:
             return CANPort.ERROR_NO_CONNECT
         else:
-            # compiles a regular expression to parse both the short
-            # and long form messages as defined in the CAN-USB manual
-            self.regex = re.compile(r"\s*(?:t([0-9a-fA-F]{3})|T([0-9a-fA-F]{8}))(\d)((?:[0-9a-fA-F][0-9a-fA-F]){0,8})((?:[0-9a-fA-F][0-9a-fA-F]){2})?")
-            
             # If the port is open already, close it first. Do this by writing the character 'C'
             # followed by the carriage return. The hardware will return either a carriage
             # return (13) or a bell (7) (At least that's what the docs for this device say)
@@ -182,6 +212,20 @@ class CANPort():
             if time.time() - start - 5 > CANPort.TIMEOUT:
                 return CANPort.ERROR_NO_DATA
 
+        # Turn on the millisecond timestamps if they were asked for. This has to be done
+        # before the CAN channel is opened. The reply is read so that it isn't mistaken
+        # for the start of a frame.
+        if self.deviceClock:
+            serialCAN.write(TIMESTAMPS_ON)
+            serialCAN.read()
+
+        # Likewise program the acceptance filter, so that the CANusb only sends the
+        # frames that are wanted
+        if self.acceptance:
+            for command in self.acceptance.commands():
+                serialCAN.write(command)
+                serialCAN.read()
+
         # Fall through to SUCCESS
         return CANPort.SUCCESS
 
@@ -210,50 +254,87 @@ class CANPort():
             if self.live:
                 # serialParse blocks thread
                 self.serialParse(serialCAN)
-                
-                while self.dataBack.CANacondaTxMsg_queue.qsize() > 0:
-                    msg = self.dataBack.CANacondaTxMsg_queue.get()
-                    serialCAN.write(bytes(msg, 'UTF-8'))
 
-    # parse the serial string, create the CanMessage object, and print it.
+    # Read whatever frames are available and push them to the transcoder.
     def serialParse(self, serialCAN):
-        # Sit and wait for all the bytes for an entire CAN message from the serial port.
-        matchedmsg = self.getMatchObject(serialCAN)
-
-        # Push the match object to this queue for parsing from within CanDataTranscoder.py
-        if matchedmsg:
-            self.dataBack.CANacondaRx_TranscodeQueue.put(matchedmsg)
-
-    # Build up a message character by character from the serial stream, and then wrap it
-    # in a regex match object.
-    def getMatchObject(self, serialCAN):
-        character = None
-        rawmsg = b""
-        # Reads in characters from the serial stream until
-        # a carriage return is encountered
-        while character != (CR or '\r'):
-            # Wrap the read() call in a try/except to catch possible serial port errors since we 
-            # never check the state of the serial port after initial opening.
+        # Sit and wait for at least one complete CAN message from the serial port.
+        frames = self.readFrames(serialCAN)
+
+        # Throw away the frames the acceptance filter couldn't keep out
+        if frames and self.acceptance:
+            frames = self.acceptance.check(frames)
+
+        # When bridging, forward the frames first, and only keep those being monitored
+        if frames and self.bridge:
+            frames = self.bridge.forward(frames)
+
+        # Push the frames to this queue for parsing from within CanDataTranscoder.py
+        if frames:
+            self.dataBack.CANacondaRx_TranscodeQueue.putMany(frames)
+
+    # Read a chunk from the serial stream and return a list of RawFrame objects, one
+    # for each complete frame in it. read() blocks until at least one byte is available
+    # (or the port times out), then everything else that is waiting is taken in the same
+    # call. If a capture file is being recorded, the frames are written to it here.
+    # Returns None if the serial port errored out.
+    def readFrames(self, serialCAN):
+        # Wrap the read() call in a try/except to catch possible serial port errors since we
+        # never check the state of the serial port after initial opening.
+        try:
+            chunk = serialCAN.read(serialCAN.in_waiting or 1)
+        except serial.serialutil.SerialException:
+            return None
+        rxBuffer = self.rxBuffer
+        rxBuffer += chunk
+        self.bytesRead += len(chunk)
+
+        # Only the data up to the last carriage return is complete. Everything after
+        # it stays in the buffer until the next read.
+        end = rxBuffer.rfind(CR)
+        if end < 0:
+            return []
+        lines = rxBuffer[:end].split(CR)
+        del rxBuffer[:end + 1]
+
+        # Every frame in the chunk arrived by the time it was read, so the host time is
+        # taken once. With device timestamps on, each frame's own time is worked out from them.
+        now = time.time()
+        channel = self.channel
+        frames = []
+        for line in lines:
+            frame = parseFrame(line)
+            if frame:
+                frame.time = now
+                frame.channel = channel
+                frames.append(frame)
+        self.framesRead += len(frames)
+        self.busStats.add(frames)
+        if self.deviceClock:
+            self.deviceClock.setTimes(frames, now)
+        if self.dataBack.capture and frames:
+            self.dataBack.capture.write(frames)
+        return frames
+
+    # The transmit thread's target. Blocks until messages are queued for transmission,
+    # then writes everything that is waiting to the serial port with a single write().
+    # Like getMessages(), this returns once 'live' is set to False.
+    def sendMessages(self, serialCAN):
+        txQueue = self.txQueue
+        while self.live:
             try:
-                character = serialCAN.read()
+                messages = txQueue.getManyTimed(timeout=CANPort.TX_POLL)
+            except Empty:
+                continue
+            data = b''.join(bytes(msg, 'UTF-8') for queuedTime, msg in messages)
+            try:
+                serialCAN.write(data)
             except serial.serialutil.SerialException:
-                return None
-            # appends the newly read character to
-            # the message being built
-            rawmsg += bytes(character)
-        rawmsg = rawmsg.decode('utf-8')
-        matchedMsg = self.regex.match(rawmsg)
-        return matchedMsg
-
-    # Not is use at the moment because of massive resource usage.
-    def sendMessages(self, serialCAN):
-        while True:
-            if not self.live:
-                return
-            if self.live:
-                while self.dataBack.CANacondaTxMsg_queue.qsize() > 0:
-                    msg = self.dataBack.CANacondaTxMsg_queue.get()
-                    serialCAN.write(bytes(msg, 'UTF-8'))
+                continue
+            now = time.monotonic()
+            for queuedTime, msg in messages:
+                self.txLatency.add(now - queuedTime)
+            self.txMessages += len(messages)
+            self.txWrites += 1
 
     def getCanBaud(self):
         return self.canBaudrate
@@ -261,9 +342,9 @@ class CANPort():
 
 class CANPortCLI(CANPort):
 
-    def __init__(self, dataBack):
+    def __init__(self, dataBack, comport=None, channel='0'):
         """Initialization only requires initializing the parent class, which really does all the work."""
-        super(CANPortCLI, self).__init__(dataBack)
+        super(CANPortCLI, self).__init__(dataBack, comport, channel)
 
 
 try:
@@ -279,20 +360,10 @@ try:
             QObject.__init__(self)
 
         def serialParse(self, serialCAN):
-            matchedmsg = self.getMatchObject(serialCAN)
-            newCanMessage = CanMessage()
-            if matchedmsg: 
-                self.dataBack.CANacondaRx_TranscodeQueue.put(matchedmsg)
+            frames = self.readFrames(serialCAN)
+            if frames:
+                self.dataBack.CANacondaRx_TranscodeQueue.putMany(frames)
                 self.parsedMsgPut.emit()
-
-                # If not present already, add the message's messageInfo
-                # and field name to the dataBack.messagesSeenSoFar dict,
-                # and emit a signal for redrawing the messages table
-                if newCanMessage.name not in self.dataBack.messagesSeenSoFar and newCanMessage.name is not '':
-                    self.dataBack.messagesSeenSoFar[newCanMessage.name] = []
-                    for field in newCanMessage.body:
-                        self.dataBack.messagesSeenSoFar[newCanMessage.name].append(field)
-                    self.newMessageUp.emit()
 except ImportError:
     pass
 
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+'''
+ * Copyright Bar Smith, Bryant Mairs, Alex Bardales 2015
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses.
+'''
+
+'''
+A stand-in for the CANusb (Lawicel) device, for running CANaconda without any
+hardware. It opens a pseudo-terminal, prints the name of its port (something
+like /dev/pts/5), and behaves like a CANusb on it. Linux and other Unix systems only.
+
+The commands CANaconda uses are answered as the real device does:
+    C       close the CAN channel
+    S0-S8   set the bit rate (channel closed only)
+    O       open the CAN channel
+    Z0/Z1   turn the millisecond timestamp off or on (channel closed only)
+    M/m     set the acceptance code and mask (channel closed only)
+    V, N, F version, serial number and status flags
+    t/T     transmit a frame (channel open only)
+Each command is answered with a carriage return, or a bell if it failed.
+Transmitted frames are kept in 'transmitted', with the time they arrived.
+
+While the channel is open, frames are sent at 'rate' frames per second, which
+may be well beyond what a real 1M bus can carry. By default every frame is an
+extended frame whose payload holds a 32-bit sequence number and the time it was
+sent, in microseconds modulo 2**32, both little-endian. decodeSequenceFrame()
+reads these back, so a test reading CANaconda's output can count dropped frames
+and measure latency. A list of RawFrames, such as a capture, can be played back
+instead. If the reader does not keep up, frames that would not fit in the
+device's buffer are dropped and counted in 'overruns', as on the real device.
+Frames that the acceptance filter set with M and m doesn't let through are not
+sent, and are counted in 'filtered'.
+
+As a script, the emulator runs until it is stopped or 'count' frames are sent:
+    python3 canusbEmulator.py --rate 2000
+    python3 CANaconda.py --nogui -p /dev/pts/5
+'''
+
+import argparse
+import os
+import pty
+import select
+import sys
+import threading
+import time
+import tty
+
+from CanMessage import RawFrame
+from lawicel import parseFrame, acceptanceMatch, TIMESTAMP_ROLLOVER, ACCEPT_ALL_CODE, ACCEPT_ALL_MASK
+
+CR = b'\r'
+BELL = b'\x07'
+
+# The default ID for generated frames: priority 6, proprietary PGN 65280, source 0x01
+SEQUENCE_ID = 0x18FF0001
+
+# How much sent data can be waiting for the reader before frames are dropped. A real
+# CANusb has far less, but the pty buffers some data too.
+OUTPUT_LIMIT = 64 * 1024
+
+VERSION_REPLY = b'V1011\r'
+SERIAL_REPLY = b'NEMUL\r'
+STATUS_REPLY = b'F00\r'
+
+
+# Returns (sequence number, time sent in microseconds modulo 2**32) from a generated payload
+def decodeSequenceFrame(payload):
+    return int.from_bytes(payload[0:4], 'little'), int.from_bytes(payload[4:8], 'little')
+
+
+# Microseconds between 'sentMicros' from decodeSequenceFrame() and 'now', a time.time()
+def latencyMicros(sentMicros, now):
+    return (int(now * 1e6) - sentMicros) & 0xFFFFFFFF
+
+
+class CanUsbEmulator():
+    def __init__(self, rate=1000, frames=None, count=None, id=SEQUENCE_ID, extended=True):
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+        self.portName = os.ttyname(self.slave)
+
+        self.rate = rate # Frames per second sent while the channel is open
+        self.frames = frames # RawFrames to play back, in a loop. None to generate sequence frames.
+        self.count = count # Stop sending after this many frames, or None to carry on
+        self.id = id
+        self.extended = extended
+
+        # Device state
+        self.channelOpen = False
+        self.bitrate = None
+        self.timestamps = False
+        self.acceptanceCode = ACCEPT_ALL_CODE
+        self.acceptanceMask = ACCEPT_ALL_MASK
+        self.startTime = time.monotonic()
+
+        # Statistics, and everything the emulator has been sent
+        self.sent = 0
+        self.overruns = 0
+        self.filtered = 0 # Frames kept back by the acceptance filter
+        self.commands = []
+        self.transmitted = [] # (time.time() when received, RawFrame)
+
+        self.running = False
+        self.thread = None
+        self.output = bytearray()
+        self.rxBuffer = bytearray()
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def close(self):
+        self.stop()
+        os.close(self.master)
+        os.close(self.slave)
+
+    # True once 'count' frames have been sent
+    def finished(self):
+        return self.count is not None and self.sent >= self.count
+
+    def run(self):
+        sentThisOpen = 0
+        openTime = 0
+        while self.running:
+            # Poll quickly while streaming, so frames go out smoothly
+            readable, _, _ = select.select([self.master], [], [], 0.001 if self.channelOpen else 0.05)
+            if readable:
+                try:
+                    self.rxBuffer += os.read(self.master, 4096)
+                except OSError:
+                    pass
+                end = self.rxBuffer.rfind(CR)
+                if end >= 0:
+                    for line in self.rxBuffer[:end].split(CR):
+                        wasOpen = self.channelOpen
+                        self.command(bytes(line))
+                        if self.channelOpen and not wasOpen:
+                            openTime = time.monotonic()
+                            sentThisOpen = 0
+                    del self.rxBuffer[:end + 1]
+
+            if self.channelOpen and self.rate and not self.finished():
+                due = int((time.monotonic() - openTime) * self.rate) - sentThisOpen
+                if self.count is not None:
+                    due = min(due, self.count - self.sent)
+                if due > 0:
+                    self.sendFrames(due)
+                    sentThisOpen += due
+            self.flush()
+
+    # Handle one command from the host, without its carriage return
+    def command(self, line):
+        if not line:
+            return
+        self.commands.append(line)
+        kind = line[:1]
+        if kind in b'tT':
+            frame = parseFrame(line)
+            if not self.channelOpen or frame is None:
+                self.reply(BELL)
+                return
+            self.transmitted.append((time.time(), frame))
+            self.reply(b'Z\r' if kind == b'T' else b'z\r')
+        elif kind == b'C':
+            self.reply(CR if self.channelOpen else BELL)
+            self.channelOpen = False
+        elif kind == b'O':
+            if self.channelOpen or self.bitrate is None:
+                self.reply(BELL)
+            else:
+                self.channelOpen = True
+                self.reply(CR)
+        elif kind == b'S' and len(line) == 2 and b'0' <= line[1:] <= b'8' and not self.channelOpen:
+            self.bitrate = int(line[1:])
+            self.reply(CR)
+        elif kind == b'Z' and line[1:] in (b'0', b'1') and not self.channelOpen:
+            self.timestamps = line[1:] == b'1'
+            self.reply(CR)
+        elif kind in b'Mm' and len(line) == 9 and not self.channelOpen:
+            try:
+                value = int(line[1:], 16)
+            except ValueError:
+                self.reply(BELL)
+                return
+            if kind == b'M':
+                self.acceptanceCode = value
+            else:
+                self.acceptanceMask = value
+            self.reply(CR)
+        elif line == b'V':
+            self.reply(VERSION_REPLY)
+        elif line == b'N':
+            self.reply(SERIAL_REPLY)
+        elif line == b'F':
+            self.reply(STATUS_REPLY)
+        else:
+            self.reply(BELL)
+
+    def reply(self, data):
+        self.output += data
+
+    # Queue 'count' frames for sending, dropping any that don't fit in the output buffer
+    def sendFrames(self, count):
+        now = time.time()
+        stamp = b''
+        if self.timestamps:
+            stamp = b'%04X' % (int((time.monotonic() - self.startTime) * 1000) % TIMESTAMP_ROLLOVER)
+        for i in range(count):
+            if self.frames:
+                frame = self.frames[self.sent % len(self.frames)]
+            else:
+                payload = self.sent.to_bytes(4, 'little') + (int(now * 1e6) & 0xFFFFFFFF).to_bytes(4, 'little')
+                frame = RawFrame(self.id, self.extended, 8, payload)
+            self.sent += 1
+            if not acceptanceMatch(frame.id, frame.extended, self.acceptanceCode, self.acceptanceMask, frame.payload):
+                self.filtered += 1
+                continue
+            if len(self.output) >= OUTPUT_LIMIT:
+                self.overruns += 1
+                continue
+            self.output += str(frame).encode('ascii') + stamp + CR
+
+    # Write as much of the waiting output as the reader has room for
+    def flush(self):
+        if not self.output:
+            return
+        try:
+            written = os.write(self.master, self.output)
+        except BlockingIOError:
+            return
+        except OSError:
+            # The other end of the pty has not been opened yet, or has been closed
+            return
+        del self.output[:written]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Emulate a CANusb device on a pseudo-terminal")
+    parser.add_argument('--rate', type=float, default=1000,
+            help="Frames per second to send while the channel is open")
+    parser.add_argument('--count', type=int,
+            help="Stop after sending this many frames")
+    parser.add_argument('--id', default=hex(SEQUENCE_ID),
+            help="ID of the generated frames, in hex")
+    parser.add_argument('--standard', action='store_true',
+            help="Generate standard (11-bit) frames instead of extended ones")
+    parser.add_argument('--capture', metavar="File",
+            help="Play back the frames in a file of raw CANusb output instead of generating them")
+    args = parser.parse_args()
+
+    frames = None
+    if args.capture:
+        with open(args.capture, 'rb') as f:
+            frames = [frame for frame in map(parseFrame, f.read().split(CR)) if frame is not None]
+
+    emulator = CanUsbEmulator(args.rate, frames, args.count, int(args.id, 16), not args.standard)
+    print(emulator.portName)
+    sys.stdout.flush()
+    emulator.start()
+    try:
+        while not emulator.finished():
+            time.sleep(0.1)
+        # Give the reader a moment to take the last frames
+        time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    emulator.stop()
+    print("Sent {} frames, {} dropped by overruns, {} frames transmitted to the bus".format(
+          emulator.sent, emulator.overruns, len(emulator.transmitted)), file=sys.stderr)
+    emulator.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+'''
+ * Copyright Bar Smith, Bryant Mairs, Alex Bardales 2015
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses.
+'''
+
+'''
+A compact binary format for recording every frame received, and an indexed
+reader for it.
+
+A capture file is a HEADER followed by one fixed-size RECORD per frame, in the
+order the frames were read, all little-endian:
+
+    HEADER (192 bytes)
+        magic           8s      b'CANACAP1'
+        version         H       CAPTURE_VERSION
+        record size     H       RECORD.size
+        (reserved)      4x
+        start time      d       seconds since the epoch when the capture began
+        metadata hash   32s     SHA-256 of the metadata file in use, or zeros
+        (reserved)      8x
+        channels        128s    the channel names, UTF-8, each followed by a NUL
+
+    RECORD (24 bytes)
+        time            d       RawFrame.time, seconds since the epoch
+        id              I
+        flags           B       FLAG_EXTENDED for 29-bit IDs
+        dlc             B
+        channel         B       the position of RawFrame.channel among the
+                                header's channel names, or NO_CHANNEL
+        (reserved)      x
+        payload         8s      zero padded
+
+When several buses are read at once, each port's reader thread writes its own
+frames. The writer puts them into time order with a multiport.FrameMerger
+before they go to the file, so the records are always in time order. Channel
+names the header doesn't have yet are added to it as they are first seen.
+
+Alongside it, '<file>.idx' holds an index: the time of every INDEX_BLOCK'th
+record, for seeking to a time, and the list of record numbers for each ID. The
+writer saves the index when it is closed. If the index is missing, or doesn't
+cover the whole file because the capture was cut short, the reader rebuilds it.
+
+CaptureReader memory-maps the file, so only the records that are asked for are
+ever read from disk, however big the capture is.
+
+Usage:
+    python3 CANaconda.py --nogui -p /dev/ttyUSB0 --capture run1.cap
+    python3 captureFile.py run1.cap --pgn 129029 --start 1425000000 --end 1425000060
+'''
+
+import argparse
+import bisect
+import hashlib
+import heapq
+import mmap
+import struct
+import sys
+import threading
+import time
+from array import array
+
+from CanMessage import RawFrame
+from Nmea2000 import Iso11783Decode
+from multiport import FrameMerger
+
+MAGIC = b'CANACAP1'
+CAPTURE_VERSION = 2
+# The room in the header for channel names
+CHANNEL_NAMES_SIZE = 128
+HEADER = struct.Struct('<8sHH4xd32s8x{}s'.format(CHANNEL_NAMES_SIZE))
+RECORD = struct.Struct('<dIBBBx8s')
+
+# Record flags
+FLAG_EXTENDED = 0x01
+
+# The channel number of frames that have no channel, or whose name didn't fit in
+# the header
+NO_CHANNEL = 0xFF
+
+# Separates the channel names in the header
+CHANNEL_END = b'\0'
+
+# The index keeps the time of one record in every INDEX_BLOCK
+INDEX_BLOCK = 1024
+INDEX_SUFFIX = '.idx'
+INDEX_MAGIC = b'CANAIDX1'
+INDEX_HEADER = struct.Struct('<8sQII') # magic, records covered, time entries, IDs
+INDEX_ID = struct.Struct('<IBxxxI') # id, flags, record count
+
+NO_HASH = bytes(32)
+
+
+# The SHA-256 of a metadata file, to store in a capture's header
+def metadataHash(fileName):
+    if fileName is None:
+        return NO_HASH
+    with open(fileName, 'rb') as f:
+        return hashlib.sha256(f.read()).digest()
+
+
+# Where to find records by time and by ID. 'times' is the time of every
+# INDEX_BLOCK'th record, and 'ids' maps (id, extended) to an array of record numbers.
+class CaptureIndex():
+    def __init__(self):
+        self.records = 0
+        self.times = array('d')
+        self.ids = {}
+
+    def add(self, frameTime, id, extended):
+        if self.records % INDEX_BLOCK == 0:
+            self.times.append(frameTime)
+        records = self.ids.get((id, extended))
+        if records is None:
+            records = self.ids[(id, extended)] = array('I')
+        records.append(self.records)
+        self.records += 1
+
+    def save(self, fileName):
+        with open(fileName, 'wb') as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, self.records, len(self.times), len(self.ids)))
+            f.write(self.times.tobytes())
+            for (id, extended), records in self.ids.items():
+                f.write(INDEX_ID.pack(id, FLAG_EXTENDED if extended else 0, len(records)))
+                f.write(records.tobytes())
+
+    # Returns the index in 'fileName', or None if there isn't a usable one
+    @classmethod
+    def load(cls, fileName):
+        try:
+            with open(fileName, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        if len(data) < INDEX_HEADER.size:
+            return None
+        magic, records, timeCount, idCount = INDEX_HEADER.unpack_from(data)
+        if magic != INDEX_MAGIC:
+            return None
+        index = cls()
+        index.records = records
+        position = INDEX_HEADER.size
+        index.times.frombytes(data[position:position + 8 * timeCount])
+        position += 8 * timeCount
+        for i in range(idCount):
+            id, flags, count = INDEX_ID.unpack_from(data, position)
+            position += INDEX_ID.size
+            recordList = array('I')
+            recordList.frombytes(data[position:position + 4 * count])
+            position += 4 * count
+            index.ids[(id, bool(flags & FLAG_EXTENDED))] = recordList
+        return index
+
+
+# Records RawFrames to a capture file. Frames are written as they are given to
+# write(), and the index is saved by close().
+#
+# 'channels' are the names of the buses being read. With more than one, write() may
+# be called from each bus's reader thread, so it takes a lock, and frames are held
+# for a moment to merge them into time order (see multiport.py).
+class CaptureWriter():
+    def __init__(self, fileName, metadataFile=None, startTime=None, channels=()):
+        self.fileName = fileName
+        self.startTime = time.time() if startTime is None else startTime
+        self.metadataHash = metadataHash(metadataFile)
+        self.lock = threading.Lock()
+        self.merger = FrameMerger(channels) if len(channels) > 1 else None
+        # Channel name -> its number in the records
+        self.channelNumbers = {}
+        self.channelNames = b''
+        self.file = open(fileName, 'wb')
+        for channel in channels:
+            self.channelNumber(channel)
+        self.file.write(self.header())
+        self.index = CaptureIndex()
+
+    def header(self):
+        return HEADER.pack(MAGIC, CAPTURE_VERSION, RECORD.size, self.startTime, self.metadataHash, self.channelNames)
+
+    # The number recorded for 'channel', adding it to the header if it is new
+    def channelNumber(self, channel):
+        try:
+            return self.channelNumbers[channel]
+        except KeyError:
+            pass
+        number = NO_CHANNEL
+        if channel is not None:
+            name = str(channel).encode('utf-8')
+            names = self.channelNames + name + CHANNEL_END
+            count = self.channelNames.count(CHANNEL_END)
+            if name and CHANNEL_END not in name and len(names) <= CHANNEL_NAMES_SIZE and count < NO_CHANNEL:
+                number = count
+                self.channelNames = names
+                if self.file.tell():
+                    # Rewrite the header with the new name, and carry on at the end
+                    self.file.seek(0)
+                    self.file.write(self.header())
+                    self.file.seek(0, 2)
+        self.channelNumbers[channel] = number
+        return number
+
+    # Append a list of RawFrames. Only single frames can be recorded, not the
+    # messages reassembled from them.
+    def write(self, frames):
+        with self.lock:
+            if self.merger is not None:
+                self.merger.add(frames)
+                frames = self.merger.release(time.time())
+            self.writeRecords(frames)
+
+    def writeRecords(self, frames):
+        if not frames:
+            return
+        pack = RECORD.pack
+        add = self.index.add
+        channelNumbers = self.channelNumbers
+        records = []
+        for frame in frames:
+            if frame.dlc > 8:
+                raise ValueError("Only frames of up to 8 bytes can be captured")
+            frameTime = frame.time if frame.time is not None else time.time()
+            channel = channelNumbers.get(frame.channel)
+            if channel is None:
+                channel = self.channelNumber(frame.channel)
+            records.append(pack(frameTime, frame.id, FLAG_EXTENDED if frame.extended else 0, frame.dlc,
+                                channel, frame.payload))
+            add(frameTime, frame.id, frame.extended)
+        self.file.write(b''.join(records))
+        # Keep what has been captured on disk in case the program is killed
+        self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file.closed:
+                return
+            # Write out the frames still being held for merging
+            if self.merger is not None:
+                self.writeRecords(self.merger.release(float('inf')))
+            self.file.close()
+            self.index.save(self.fileName + INDEX_SUFFIX)
+
+
+# Reads a capture file through a memory map. Records are numbered from 0.
+class CaptureReader():
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.file = open(fileName, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.version = struct.unpack_from('<8sH', self.map)
+        if magic != MAGIC:
+            raise ValueError("{} is not a CANaconda capture file".format(fileName))
+        if self.version != CAPTURE_VERSION or len(self.map) < HEADER.size:
+            raise ValueError("{} is a version {} capture, which this version of CANaconda can't read".format(
+                             fileName, self.version))
+        magic, self.version, recordSize, self.startTime, self.metadataHash, channelNames = HEADER.unpack_from(self.map)
+        if recordSize != RECORD.size:
+            raise ValueError("{} has {} byte records, which this version of CANaconda can't read".format(
+                             fileName, recordSize))
+        # The channel name of each channel number, with None for NO_CHANNEL
+        channelNames = channelNames.rstrip(CHANNEL_END)
+        self.channels = [name.decode('utf-8') for name in channelNames.split(CHANNEL_END)] if channelNames else []
+        self.channelOf = self.channels + [None] * (NO_CHANNEL + 1 - len(self.channels))
+        # A capture that was cut short may end part way through a record
+        self.recordCount = (len(self.map) - HEADER.size) // RECORD.size
+        self.records = memoryview(self.map)[HEADER.size:HEADER.size + self.recordCount * RECORD.size]
+        self._index = None
+
+    def __len__(self):
+        return self.recordCount
+
+    def close(self):
+        self.records.release()
+        self.map.close()
+        self.file.close()
+
+    # The index, loaded from the sidecar file or rebuilt if that doesn't cover every record
+    @property
+    def index(self):
+        if self._index is None:
+            index = CaptureIndex.load(self.fileName + INDEX_SUFFIX)
+            if index is None or index.records != self.recordCount:
+                index = self.buildIndex()
+            self._index = index
+        return self._index
+
+    # Build the index by reading every record, and save it for next time if possible
+    def buildIndex(self):
+        index = CaptureIndex()
+        for frameTime, id, flags, dlc, channel, payload in RECORD.iter_unpack(self.records):
+            index.add(frameTime, id, bool(flags & FLAG_EXTENDED))
+        try:
+            index.save(self.fileName + INDEX_SUFFIX)
+        except OSError:
+            pass
+        return index
+
+    def frame(self, n):
+        frameTime, id, flags, dlc, channel, payload = RECORD.unpack_from(self.records, n * RECORD.size)
+        return RawFrame(id, bool(flags & FLAG_EXTENDED), dlc, payload[:dlc], None, frameTime, self.channelOf[channel])
+
+    # Every frame from record 'start' up to, but not including, record 'stop'
+    def frames(self, start=0, stop=None):
+        stop = self.recordCount if stop is None else min(stop, self.recordCount)
+        channelOf = self.channelOf
+        for frameTime, id, flags, dlc, channel, payload in RECORD.iter_unpack(self.records[start * RECORD.size:stop * RECORD.size]):
+            yield RawFrame(id, bool(flags & FLAG_EXTENDED), dlc, payload[:dlc], None, frameTime, channelOf[channel])
+
+    # The number of the first record at or after 'when'. Records are in time order,
+    # so this relies on the host clock not stepping backwards.
+    def recordAt(self, when):
+        block = max(bisect.bisect_right(self.index.times, when) - 1, 0)
+        n = block * INDEX_BLOCK
+        stop = min(n + INDEX_BLOCK, self.recordCount)
+        while n < stop and RECORD.unpack_from(self.records, n * RECORD.size)[0] < when:
+            n += 1
+        return n
+
+    # The frames received from time 'start' up to time 'end', in seconds since the epoch.
+    # Either can be None for the beginning or end of the capture.
+    def framesBetween(self, start=None, end=None):
+        first = 0 if start is None else self.recordAt(start)
+        stop = self.recordCount if end is None else self.recordAt(end)
+        return self.frames(first, stop)
+
+    # The record numbers of every frame with the given ID
+    def recordsForId(self, id, extended=True):
+        return self.index.ids.get((id, extended), array('I'))
+
+    # The record numbers of every frame with the given PGN, from any source, in order
+    def recordsForPgn(self, pgn):
+        lists = [records for (id, extended), records in self.index.ids.items()
+                 if extended and Iso11783Decode(id)[0] == pgn]
+        return heapq.merge(*lists)
+
+    def framesForId(self, id, extended=True):
+        return (self.frame(n) for n in self.recordsForId(id, extended))
+
+    def framesForPgn(self, pgn):
+        return (self.frame(n) for n in self.recordsForPgn(pgn))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the frames in a CANaconda capture file")
+    parser.add_argument('capture', help="The capture file")
+    parser.add_argument('--start', type=float, help="Only frames from this time on, in seconds since the epoch")
+    parser.add_argument('--end', type=float, help="Only frames before this time, in seconds since the epoch")
+    parser.add_argument('--pgn', type=int, help="Only frames with this PGN")
+    parser.add_argument('--id', help="Only frames with this ID, in hex")
+    parser.add_argument('--standard', action='store_true', help="The ID given with --id is a standard (11-bit) ID")
+    parser.add_argument('--summary', action='store_true', help="Only describe the capture")
+    args = parser.parse_args()
+
+    reader = CaptureReader(args.capture)
+    if args.summary:
+        print("{} frames, {} IDs, started {}".format(len(reader), len(reader.index.ids), time.ctime(reader.startTime)))
+        if reader.metadataHash != NO_HASH:
+            print("Metadata SHA-256", reader.metadataHash.hex())
+        return
+
+    if args.pgn is not None or args.id is not None:
+        if args.pgn is not None:
+            records = reader.recordsForPgn(args.pgn)
+        else:
+            records = reader.recordsForId(int(args.id, 16), not args.standard)
+        frames = (reader.frame(n) for n in records)
+        frames = (frame for frame in frames if (args.start is None or frame.time >= args.start) and
+                                                (args.end is None or frame.time < args.end))
+    else:
+        frames = reader.framesBetween(args.start, args.end)
+
+    try:
+        for frame in frames:
+            print("{:.3f} {}".format(frame.time, frame))
+    except BrokenPipeError:
+        # Piped into something like head, which has stopped reading
+        sys.stderr.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -16,11 +16,15 @@
 '''
 
 # The FilterTable class gets instantiated in ui_mainwindow.py
-# This table gets populated each time a new message is seen for the first time
+# Rows get added to this table each time a new message is seen for the first time
 # on the bus.
 # Changing units and filtering by value is done here.
+#
+# The rows are kept in a FilterTableModel, in the order they were added, and shown
+# sorted through a QSortFilterProxyModel. A new message only inserts its own rows,
+# so the table takes the same time to grow however many rows it already has.
 
-from PyQt5 import QtCore, QtWidgets
+from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtWidgets import QHeaderView
 import pdb
 import backend
@@ -28,7 +32,11 @@ from PyQt5.QtCore import pyqtRemoveInputHook as pyqtrm
 import time
 
 # Columns:
-CHECKBOX, MESSAGE, FIELD, VALUE, FILTER, UNITS, RATE = range(7)
+CHECKBOX, PLOT, MESSAGE, FIELD, VALUE, FILTER, UNITS, RATE = range(8)
+
+# Roles for the data the proxy model sorts by, and for the units a field can be shown in
+SORT_ROLE = QtCore.Qt.UserRole
+UNITS_ROLE = QtCore.Qt.UserRole + 1
 
 from messageInfo import ACTIVE, EQUAL, LT, GT, ZERO
 
@@ -40,6 +48,228 @@ MapStringUnits =  dict(zip(unitStringMap.values(), unitStringMap.keys()))
 # Comparison operators
 CMP = ('=', '<', '>')
 
+HEADERS = ['', 'Plot', 'Message', 'Field', 'Latest value', 'Filter', 'Units', 'Rate']
+
+CHECKBOX_TOOLTIP = "<font color=black>Check box to display message</font>"
+PLOT_TOOLTIP = "<font color=black>Check box to plot field in the 'Plot' tab</font>"
+FILTER_TOOLTIP = "<font color=black>Enter comma-separated values to match, with =, &lt;, or &gt;. Example: \'<4,>9,=5.5\' Use a null character to stop active filtering.</font>"
+
+
+# One row of the table, for one field of a message seen on the bus
+class FilterRow():
+    def __init__(self, messageInfoName, fieldName, sortKey):
+        self.messageInfoName = messageInfoName
+        self.fieldName = fieldName
+        # Orders the rows by message name, and the fields of a message by offset
+        self.sortKey = sortKey
+        self.checked = False
+        # Whether the field is shown in the 'Plot' tab, and whether it can be
+        self.plotted = False
+        self.plottable = False
+        self.value = ''
+        self.filter = ''
+        self.filterActive = False
+        self.units = ''
+        # The units the field can be converted to, if there are any
+        self.unitChoices = None
+        self.rate = ''
+
+
+class FilterTableModel(QtCore.QAbstractTableModel):
+    checkedChanged = QtCore.pyqtSignal()      # A row's checkbox was changed
+    plottedChanged = QtCore.pyqtSignal(int)    # A row's 'Plot' checkbox was changed
+    filterEdited = QtCore.pyqtSignal(int, str)  # The user entered a filter in a row
+    unitsChanged = QtCore.pyqtSignal(int)      # The user chose new units in a row
+
+    def __init__(self):
+        super(FilterTableModel, self).__init__()
+        self.rows = []
+        # a map from (filter,field) to row, and from filter to its rows
+        self.tableMap = {}
+        self.messageRows = {}
+        # While logging, the checkboxes and filters can't be changed
+        self.locked = False
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.rows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(HEADERS)
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole and orientation == QtCore.Qt.Horizontal:
+            return HEADERS[section]
+        return None
+
+    def flags(self, index):
+        column = index.column()
+        if column == CHECKBOX:
+            flags = QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsUserCheckable
+        elif column == PLOT:
+            if self.rows[index.row()].plottable:
+                return QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsUserCheckable
+            return QtCore.Qt.ItemIsSelectable
+        elif column == FILTER:
+            flags = QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsEditable
+        elif column == UNITS and self.rows[index.row()].unitChoices:
+            return QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsEditable
+        else:
+            return QtCore.Qt.ItemIsEnabled
+        if self.locked:
+            return flags
+        return flags | QtCore.Qt.ItemIsEnabled
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = self.rows[index.row()]
+        column = index.column()
+        # The proxy model asks for this most, when it sorts new rows in
+        if role == SORT_ROLE and column == MESSAGE:
+            return row.sortKey
+        if role == QtCore.Qt.DisplayRole or role == QtCore.Qt.EditRole:
+            if column == MESSAGE:
+                return row.messageInfoName
+            if column == FIELD:
+                return row.fieldName
+            if column == VALUE:
+                return row.value
+            if column == FILTER:
+                return row.filter
+            if column == UNITS:
+                return row.units
+            if column == RATE:
+                return row.rate
+        elif role == SORT_ROLE:
+            if column == CHECKBOX:
+                return int(row.checked)
+            if column == PLOT:
+                return int(row.plotted)
+            return self.data(index)
+        elif role == QtCore.Qt.CheckStateRole:
+            if column == CHECKBOX:
+                return QtCore.Qt.Checked if row.checked else QtCore.Qt.Unchecked
+            if column == PLOT:
+                return QtCore.Qt.Checked if row.plotted else QtCore.Qt.Unchecked
+        elif role == QtCore.Qt.TextAlignmentRole:
+            if column == VALUE:
+                return int(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
+        elif role == QtCore.Qt.BackgroundRole:
+            if column == FILTER and row.filterActive:
+                return QtGui.QColor(QtCore.Qt.cyan)
+        elif role == QtCore.Qt.ToolTipRole:
+            if column == CHECKBOX:
+                return CHECKBOX_TOOLTIP
+            if column == PLOT:
+                return PLOT_TOOLTIP
+            if column == FILTER:
+                return FILTER_TOOLTIP
+        elif role == UNITS_ROLE:
+            return row.unitChoices
+        return None
+
+    # Changes made by the user. The checkbox is changed here, and the filter and the
+    # units are handed to the FilterTable, which changes the metadata.
+    def setData(self, index, value, role=QtCore.Qt.EditRole):
+        if not index.isValid():
+            return False
+        row = index.row()
+        column = index.column()
+        if column == CHECKBOX and role == QtCore.Qt.CheckStateRole:
+            self.rows[row].checked = value == QtCore.Qt.Checked
+            self.dataChanged.emit(index, index)
+            self.checkedChanged.emit()
+            return True
+        if column == PLOT and role == QtCore.Qt.CheckStateRole:
+            self.rows[row].plotted = value == QtCore.Qt.Checked
+            self.dataChanged.emit(index, index)
+            self.plottedChanged.emit(row)
+            return True
+        if column == FILTER and role == QtCore.Qt.EditRole:
+            self.rows[row].filter = value
+            self.dataChanged.emit(index, index)
+            self.filterEdited.emit(row, value)
+            return True
+        if column == UNITS and role == QtCore.Qt.EditRole:
+            self.rows[row].units = value
+            self.dataChanged.emit(index, index)
+            self.unitsChanged.emit(row)
+            return True
+        return False
+
+    # Add FilterRows to the end of the table
+    def addRows(self, rows):
+        if not rows:
+            return
+        first = len(self.rows)
+        self.beginInsertRows(QtCore.QModelIndex(), first, first + len(rows) - 1)
+        for i, row in enumerate(rows, first):
+            self.rows.append(row)
+            self.tableMap[(row.messageInfoName, row.fieldName)] = i
+            self.messageRows.setdefault(row.messageInfoName, []).append(i)
+        self.endInsertRows()
+
+    def clear(self):
+        self.beginResetModel()
+        self.rows = []
+        self.tableMap = {}
+        self.messageRows = {}
+        self.endResetModel()
+
+    def setValue(self, row, value):
+        if self.rows[row].value != value:
+            self.rows[row].value = value
+            index = self.index(row, VALUE)
+            self.dataChanged.emit(index, index)
+
+    def setRate(self, row, rate):
+        self.rows[row].rate = rate
+        index = self.index(row, RATE)
+        self.dataChanged.emit(index, index)
+
+    def setFilter(self, row, text, active):
+        self.rows[row].filter = text
+        self.rows[row].filterActive = active
+        index = self.index(row, FILTER)
+        self.dataChanged.emit(index, index)
+
+    def setLocked(self, locked):
+        self.locked = locked
+        if self.rows:
+            self.dataChanged.emit(self.index(0, CHECKBOX), self.index(len(self.rows) - 1, FILTER))
+
+    # The (filter, field) pairs whose checkboxes are checked, in the order they are
+    # listed when sorted by message
+    def checkedFields(self):
+        rows = sorted((row for row in self.rows if row.checked), key=lambda row: row.sortKey)
+        return [(row.messageInfoName, row.fieldName) for row in rows]
+
+
+# Lets the units of a field be changed with a drop-down menu in the 'Units' column
+class UnitsDelegate(QtWidgets.QStyledItemDelegate):
+    def createEditor(self, parent, option, index):
+        editor = QtWidgets.QComboBox(parent)
+        editor.addItems(index.data(UNITS_ROLE))
+        editor.activated.connect(self.commitAndClose)
+        return editor
+
+    def setEditorData(self, editor, index):
+        editor.setCurrentText(index.data())
+        editor.showPopup()
+
+    def setModelData(self, editor, model, index):
+        if editor.currentText() != index.data():
+            model.setData(index, editor.currentText())
+
+    def commitAndClose(self):
+        editor = self.sender()
+        self.commitData.emit(editor)
+        self.closeEditor.emit(editor, QtWidgets.QAbstractItemDelegate.NoHint)
+
 
 class FilterTable(QtWidgets.QWidget):
     comboChanged = QtCore.pyqtSignal(int)
@@ -49,13 +279,38 @@ class FilterTable(QtWidgets.QWidget):
         self.dataBack = dataBack
         self.parent = parent
         self.singleshot = singleshot
+        # The rate shown for each filter
+        self.shownRates = {}
 
         tableLabel = QtWidgets.QLabel("Messages seen so far:")
-        self.tableWidget = QtWidgets.QTableWidget()
-        self.tableWidget.setObjectName("tablewidget")
+        self.model = FilterTableModel()
+        self.model.checkedChanged.connect(self.parent.update_messageInfo_to_fields)
+        self.model.checkedChanged.connect(self.parent.csvOutputSet)
+        self.model.filterEdited.connect(self.filterByValue)
+        self.model.unitsChanged.connect(self.changeUnits)
+        self.model.plottedChanged.connect(self.changePlotted)
+        # Sorted by message and then by field offset to start with. The user can sort
+        # by any column by clicking on its header.
+        self.proxyModel = QtCore.QSortFilterProxyModel()
+        self.proxyModel.setSourceModel(self.model)
+        self.proxyModel.setSortRole(SORT_ROLE)
+        self.tableView = QtWidgets.QTableView()
+        self.tableView.setObjectName("tableview")
+        self.tableView.setModel(self.proxyModel)
+        self.tableView.setItemDelegateForColumn(UNITS, UnitsDelegate(self.tableView))
+        self.tableView.setSortingEnabled(True)
+        self.tableView.sortByColumn(MESSAGE, QtCore.Qt.AscendingOrder)
         # Hide row numbers:
-        self.tableWidget.verticalHeader().setVisible(False)
-        tableLabel.setBuddy(self.tableWidget)
+        self.tableView.verticalHeader().setVisible(False)
+        # Rows all the same height, so the view doesn't measure each one
+        self.tableView.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.tableView.horizontalHeader().setStretchLastSection(True)
+        self.tableView.resizeColumnsToContents()
+        self.tableView.setColumnWidth(VALUE, 120)
+        # Plotting needs numpy and matplotlib (see signalPlot.py)
+        if self.dataBack.plotSignals is None:
+            self.tableView.setColumnHidden(PLOT, True)
+        tableLabel.setBuddy(self.tableView)
 
         # Add a reset button for the table to clear old messages from disconnected nodes
         self.buttonResetTable = QtWidgets.QPushButton()
@@ -72,7 +327,7 @@ class FilterTable(QtWidgets.QWidget):
 
         vbox = QtWidgets.QVBoxLayout()
         vbox.addWidget(tableLabel)
-        vbox.addWidget(self.tableWidget)
+        vbox.addWidget(self.tableView)
         vbox.addWidget(self.buttonResetTable)
 
         if self.dataBack.args.debug:
@@ -83,209 +338,170 @@ class FilterTable(QtWidgets.QWidget):
         if singleshot:
             self.populateTable()
 
+    # Rebuild the table from scratch, for when the metadata has changed or the table
+    # has been cleared
     def populateTable(self):
-        try:
-            self.tableWidget.itemChanged.disconnect(self.filterByValue)
-            self.tableWidget.itemChanged.disconnect(
-                                   self.parent.update_messageInfo_to_fields)
-        except TypeError:
-            pass
-        self.tableWidget.clear()
-        self.tableWidget.setSortingEnabled(False)
-        # a list of all 'filter', 'field' pairs to be displayed in table:
-        displayList = self.getDisplayList()
-        headerList = ['', 'Message', 'Field', 'Latest value',
-                      'Filter', 'Units', 'Rate']
-        # Set the size of the table, column X row.
-        self.tableWidget.setColumnCount(len(headerList))
-        self.tableWidget.setRowCount(len(displayList))
-        self.tableWidget.setHorizontalHeaderLabels(headerList)
-        # a map from (filter,field) to row
-        self.tableMap = {}
-        for row, tuple in enumerate(displayList):
-            messageInfoName, fieldName = tuple
-            # The checkbox controls whether the message will be displayed in the message stream
-            checkBoxItem = QtWidgets.QTableWidgetItem()
-            checkBoxItem.setCheckState(QtCore.Qt.Unchecked)
-            checkBoxItem.setToolTip("<font color=black>Check box to display message</font>")
-            self.tableWidget.setItem(row, CHECKBOX, checkBoxItem)
-            ##
-            nameItem = QtWidgets.QTableWidgetItem(messageInfoName)
-            nameItem.setFlags(QtCore.Qt.ItemFlags(~QtCore.Qt.ItemIsEditable))
-            nameItem.setFlags(QtCore.Qt.ItemFlags(QtCore.Qt.ItemIsEnabled))
-            self.tableWidget.setItem(row, MESSAGE, nameItem)
-            ##
-            fieldItem = QtWidgets.QTableWidgetItem(fieldName)
-            fieldItem.setFlags(QtCore.Qt.ItemFlags(~QtCore.Qt.ItemIsEditable))
-            fieldItem.setFlags(QtCore.Qt.ItemFlags(QtCore.Qt.ItemIsEnabled))
-            self.tableWidget.setItem(row, FIELD, fieldItem)
-            ##
-            valueItem = QtWidgets.QTableWidgetItem()
-            valueItem.setFlags(QtCore.Qt.ItemFlags(~QtCore.Qt.ItemIsEditable))
-            valueItem.setFlags(QtCore.Qt.ItemFlags(QtCore.Qt.ItemIsEnabled))
-            valueItem.setTextAlignment(QtCore.Qt.AlignRight)
-            self.tableWidget.setItem(row, VALUE, valueItem)
-            ##
-            # Add the latest value to the table. 
-            fieldData = self.dataBack.messages[messageInfoName].fields[fieldName]
-            ##
-            if not fieldData.byValue[ACTIVE]:
-                byValueText = ''
-            else:
-                byValueText = str(fieldData.byValue)[1:-1]
-            byValue = QtWidgets.QTableWidgetItem(byValueText)
-            byValue.setToolTip("<font color=black>Enter comma-separated values to match, with =, &lt;, or &gt;. Example: \'<4,>9,=5.5\' Use a null character to stop active filtering.</font>")
-            self.tableWidget.setItem(row, FILTER, byValue)
-            ##
-            try:
-                prettyUnits = unitStringMap[fieldData.units]
-            except KeyError:
-                prettyUnits = ''
-            # If there is a valid conversion, its units will show up in 
-            # conversionMap. If this is the case, we use a comboBox.
-            if fieldData.units in backend.conversionMap:
-                unitsComboBox = QtWidgets.QComboBox()
-                for key in list(backend.conversionMap[fieldData.units].keys()):
-                    unitsComboBox.addItem(unitStringMap[key])
-                unitsComboBox.setCurrentText(prettyUnits)
-                self.tableWidget.setCellWidget(row, UNITS, unitsComboBox)
-                unitsComboBox.currentTextChanged.connect(self.changeUnits)
-
-            # Otherwise create a cell that has no widget
-            else:
-                _units = QtWidgets.QTableWidgetItem(prettyUnits)
-                _units.setFlags(QtCore.Qt.ItemFlags(~QtCore.Qt.ItemIsEditable))
-                _units.setFlags(QtCore.Qt.ItemFlags(QtCore.Qt.ItemIsEnabled))
-                self.tableWidget.setItem(row, UNITS, _units)
-                
-            # Update table map dict. This is used to display the latest message
-            # in the tableWidget
-            self.tableMap[(messageInfoName, fieldName)] = row
-
-            ## rate column
-            rateItem = QtWidgets.QTableWidgetItem()
-            rateItem.setFlags(QtCore.Qt.ItemFlags(~QtCore.Qt.ItemIsEditable))
-            rateItem.setFlags(QtCore.Qt.ItemFlags(QtCore.Qt.ItemIsEnabled))
-            self.tableWidget.setItem(row, RATE, rateItem)
-
-        # Before returning, finish off with signals and table flags/geometry
-        self.tableWidget.itemChanged.connect(self.filterByValue)
-        self.tableWidget.itemChanged.connect(
-                                     self.parent.update_messageInfo_to_fields)
-        self.tableWidget.itemChanged.connect(self.parent.csvOutputSet)
-        #self.tableWidget.setSortingEnabled(True)  # FIXME
-        #self.tableWidget.sortByColumn(0,0)        # 
-        self.tableWidget.resizeColumnsToContents()
-        self.tableWidget.setColumnWidth(VALUE, 120)
-
-        # STRETCHY CODE - FIXME
-        #self.tableWidget.horizontalHeader().setSizePolicy(3,3)
-        self.tableWidget.horizontalHeader().setStretchLastSection(True)
-        #self.tableWidget.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)  
-        #self.tableWidget.horizontalHeader().setSectionResizeMode(QHeaderView.Interactive)  
+        self.model.clear()
+        self.shownRates = {}
+        self.addNewMessages()
+
+    # Add rows for the messages that have been seen on the bus since the table was
+    # last brought up to date. Called when the transcoder sees a new message.
+    def addNewMessages(self):
+        # The transcoder thread adds to messagesSeenSoFar, so a copy of the names is taken
+        newMessages = [name for name in list(self.dataBack.messagesSeenSoFar)
+                       if name not in self.model.messageRows and name in self.dataBack.messages]
+        if not newMessages:
+            return
+        now = time.time()
+        rows = []
+        for messageInfoName in newMessages:
+            messageInfo = self.dataBack.messages[messageInfoName]
+            rate = self.rateText(messageInfoName, now)
+            if rate is not None:
+                self.shownRates[messageInfoName] = rate
+            for i, fieldName in enumerate(self.getFieldsByOffset(messageInfo)):
+                row = FilterRow(messageInfoName, fieldName, "{}\0{:04d}".format(messageInfoName.lower(), i))
+                fieldData = messageInfo.fields[fieldName]
+                ##
+                if fieldData.byValue[ACTIVE]:
+                    row.filter = str(fieldData.byValue)[1:-1]
+                ##
+                try:
+                    row.units = unitStringMap[fieldData.unitsConversion or fieldData.units]
+                except KeyError:
+                    row.units = ''
+                # If there is a valid conversion, its units will show up in
+                # conversionMap. If this is the case, the units can be chosen from a list.
+                if fieldData.units in backend.conversionMap:
+                    row.unitChoices = [unitStringMap[key] for key in backend.conversionMap[fieldData.units]]
+                # The latest value goes in whether it has changed or not
+                row.value = self.valueText(messageInfoName, fieldName) or ''
+                # Messages without metadata only have their raw bytes, which can't be plotted
+                if self.dataBack.plotSignals is not None and not messageInfo.anonymous:
+                    row.plottable = True
+                    row.plotted = self.dataBack.plotSignals.isPlotted(messageInfoName, fieldName)
+                row.rate = rate or ''
+                rows.append(row)
+        self.model.addRows(rows)
+        self.fitColumns(rows)
+
+    # Widen the name columns to fit the text of new rows. Only the new rows are
+    # measured, as measuring every row in the table would take longer the more there are.
+    def fitColumns(self, rows):
+        fontMetrics = self.tableView.fontMetrics()
+        # Room for the margins around the text
+        padding = 2 * fontMetrics.averageCharWidth()
+        for column, texts in ((MESSAGE, [row.messageInfoName for row in rows]),
+                              (FIELD, [row.fieldName for row in rows]),
+                              (UNITS, [row.units for row in rows])):
+            width = max(fontMetrics.width(text) for text in set(texts)) + padding
+            if width > self.tableView.columnWidth(column):
+                self.tableView.setColumnWidth(column, width)
 
     # Reset the table by clearing the set of messages seen, and then repopulating
     def resetTable(self):
         self.dataBack.messagesSeenSoFar = {}
+        if self.dataBack.plotSignals is not None:
+            self.dataBack.plotSignals.clear()
         self.populateTable()
 
-    # Change units based on comboBox widget and update dataBack
-    def changeUnits(self, text):
-        text = MapStringUnits[text]
-        widgyWidge = QtWidgets.QApplication.focusWidget()
-        if widgyWidge:
-            index = self.tableWidget.indexAt(widgyWidge.pos())
-        row = index.row()
-        messageInfoName = self.tableWidget.item(row, MESSAGE).text()
-        fieldName = self.tableWidget.item(row, FIELD).text()
-        newUnits = text
-        self.dataBack.messages[messageInfoName].fields[fieldName]\
-                                              .unitsConversion = newUnits
-
-
-    # Populate the "Latest value" and "Rate" columns by calling update() on table.
+    # Change units based on the 'Units' drop-down menu and update dataBack
+    def changeUnits(self, row):
+        filterRow = self.model.rows[row]
+        self.dataBack.messages[filterRow.messageInfoName].fields[filterRow.fieldName]\
+                                              .unitsConversion = MapStringUnits[filterRow.units]
+        # The samples plotted so far are in the old units
+        if self.dataBack.plotSignals is not None:
+            self.dataBack.plotSignals.clearSignal(filterRow.messageInfoName, filterRow.fieldName)
+
+    # Start or stop plotting a field, after its 'Plot' checkbox was changed
+    def changePlotted(self, row):
+        filterRow = self.model.rows[row]
+        self.dataBack.plotSignals.setPlotted(filterRow.messageInfoName, filterRow.fieldName, filterRow.plotted)
+
+    # Show the latest values of the fields that the transcoder has marked as changed
+    # since the last call (see CanDataTranscoder.updateLatest()), so that only the
+    # cells that change are redrawn. Called by a timer a few times a second.
     def updateValueInTable(self):
-        # Use tableMap as {('filter','field'): row)}
-        for tuple in self.tableMap:
-            # first break apart the tuples:
-            message_name, field = tuple
-            # next get the row:
-            row = self.tableMap[tuple]
-
-            # Get the latest freqency value
-            frequencyQueue = self.dataBack.frequencyMap[message_name]
-            newRate = 0
+        changedFields = self.dataBack.changedFields
+        tableMap = self.model.tableMap
+        # Take out only as many as there are now, since the transcoder keeps adding
+        for i in range(len(changedFields)):
+            key = changedFields.pop()
+            row = tableMap.get(key)
+            if row is not None:
+                self.showValue(row, *key)
+
+    # Populate the "Rate" column. Rates are worked out once for each message, and only
+    # the cells whose text changes are set. Called once a second by a timer, which
+    # also brings the rate of a message that has stopped down to 0.
+    def updateRates(self):
+        now = time.time()
+        for message_name, rows in self.model.messageRows.items():
+            newRate = self.rateText(message_name, now)
+            if newRate is not None and self.shownRates.get(message_name) != newRate:
+                self.shownRates[message_name] = newRate
+                for row in rows:
+                    self.model.setRate(row, newRate)
+
+    # The text for the rate of a message, or None if it hasn't been seen
+    def rateText(self, message_name, now):
+        # Get the latest freqency value. If we haven't seen a new message in
+        # the last few seconds, the frequency is 0.
+        tracker = self.dataBack.frequencyMap.get(message_name)
+        if tracker is None:
+            return None
+        newRate = tracker.rate(now)
+
+        # If newRate < 1Hz, take reciprocal to give time period in seconds
+        if newRate < 1 and newRate > 0:
+            return "{: 4.1f}s".format(1.0/newRate)
+        return "{: 4.1f}Hz".format(newRate)
+
+    # Put the latest value of a field in its row of the "Latest value" column
+    def showValue(self, row, message_name, field):
+        value = self.valueText(message_name, field)
+        if value is not None:
+            self.model.setValue(row, value)
+
+    # The text for the latest value of a field, or None if there isn't one
+    def valueText(self, message_name, field):
+        try:
+            # get the update values from dataBack.latest_CANacondaMessages
+            disp_format = self.dataBack.messages[message_name].fields[field].disp_format
+            newValue = self.dataBack.latest_CANacondaMessages[message_name][field]
             try:
-                # If we haven't seen a new messages in the last 3 seconds,
-                # set the frequency to 0.
-                if time.time() - frequencyQueue.queue[-1] > 3:
-                    newRate = 0
-                else:
-                    newRate = self.dataBack.latest_frequencies[message_name]
-            # Will throw exception for first few runs; ignore.
-            except IndexError:
-                pass
-
-            # If newRate < 1Hz, take reciprocal to give time period in seconds
-            if newRate < 1 and newRate > 0:
-                newRate = "{: 4.1f}s".format(1.0/newRate)
-            else:
-                newRate = "{: 4.1f}Hz".format(newRate)
-
+                return disp_format.format(newValue)
+            except (ValueError, AttributeError) as e:
+                return str(newValue)
+        except (AttributeError, KeyError):
+            # Before erroring out, the new message may not have had metadata (anonymous message)
             try:
-                # get the update values from dataBack.latest_CANacondaMessages
-                disp_format = self.dataBack.messages[message_name].fields[field].disp_format
-                newValue = self.dataBack.latest_CANacondaMessages[message_name][field]
-                try:
-                    value = disp_format.format(newValue)
-                except (ValueError, AttributeError) as e:
-                    value = str(newValue)
-                self.tableWidget.item(row, VALUE).setText(value)
-                self.tableWidget.item(row, RATE).setText(newRate)
-            except (AttributeError, KeyError):
-                # Before erroring out, the new message may not have had metadata (anonymous message)
                 if self.dataBack.messages[message_name].anonymous:
-                    value = str(self.dataBack.latest_CANacondaMessages[message_name][field])
-                    self.tableWidget.item(row, VALUE).setText(value)
-                    self.tableWidget.item(row, RATE).setText(newRate)
-                else:
-                    pass
-        # if viewport() is not called, update is slow
-        self.tableWidget.viewport().update()
-
-
-    # Get a list of format ('filter', 'field') to be displayed
-    # in the tableWidget
-    def getDisplayList(self):
-        messages_dict = self.dataBack.messagesSeenSoFar
-        displayList = []
-        for messageInfo in sorted(messages_dict.keys(), key=lambda s: s.lower()):
-            orderedFields = self.getFieldsByOffset(self.dataBack.messages[messageInfo])
-            for field in orderedFields:
-                displayList.append((messageInfo, field))
-        return displayList
+                    return str(self.dataBack.latest_CANacondaMessages[message_name][field])
+            except KeyError:
+                # Not seen on the bus yet
+                pass
+        return None
+
+    # The (filter, field) pairs that have been checked, in the order they are listed
+    def checkedFields(self):
+        return self.model.checkedFields()
 
     def getFieldsByOffset(self, messageInfo):
         return self.parent.mainWindow.transmitGrid.getFieldsByOffset(messageInfo)
 
     # This function needs to be modified so that if an invalid
     # entry occurs, a dialog window warns the user.
-    # Also it is called each time the table updates. Expensive!
-    def filterByValue(self, item):
-        if item.column() != FILTER:
-            return
+    # Called when the user enters 'valueString' in the filter cell of 'row'.
+    def filterByValue(self, row, valueString):
         if self.dataBack.logflag:
-            # FIXME
-            # This prevents the user from editing the 'byValue' filter while logging
-            # is happening, but it doesn't have the intended effect of disabling the
-            # entire tableWidget.
-            self.tableWidget.setSelectionMode(QtWidgets.QAbstractItemView.NoSelection)
             return
 
-        valueString = item.text()
-        currentRow = item.row()
-        messageInfoName = self.tableWidget.item(currentRow, MESSAGE).data(0)
-        fieldName = self.tableWidget.item(currentRow, FIELD).data(0)
+        filterRow = self.model.rows[row]
+        messageInfoName = filterRow.messageInfoName
+        fieldName = filterRow.fieldName
 
         # First, null out the byValue dictionaries, clearing any previous entries
         self.dataBack.messages[messageInfoName].fields[fieldName].byValue[ACTIVE] = False
@@ -293,40 +509,29 @@ class FilterTable(QtWidgets.QWidget):
         self.dataBack.messages[messageInfoName].fields[fieldName].byValue[LT] = None
         self.dataBack.messages[messageInfoName].fields[fieldName].byValue[GT] = None
 
-        # Disconnect the signal to avoid cross talk. Will have to call 'connect' again
-        # before returning from this function
-        self.tableWidget.itemChanged.disconnect(self.filterByValue)
         for value in valueString.split(','):
             try:
                 # Check that the first character of the string is in the CMP tuple, which contains
                 # the three comparison operators '<', '>', '='
                 if len(value) == 0:
-                    self.tableWidget.item(currentRow, FILTER).setText('')
-                    self.tableWidget.item(currentRow, FILTER).setBackground(QtCore.Qt.white)
-                    self.tableWidget.itemChanged.connect(self.filterByValue)
+                    self.model.setFilter(row, '', False)
                     return
                 if value[0] not in CMP:
-                    self.tableWidget.item(currentRow, FILTER).setText('')
-                    self.tableWidget.item(currentRow, FILTER).setBackground(QtCore.Qt.white)
+                    self.model.setFilter(row, '', False)
                     raise Exception('Filtering failed for value \'{}\' in field \'{}\'. \
                             Hint: Correct syntax example with mouseover'.format(valueString, fieldName))
-                    self.tableWidget.itemChanged.connect(self.filterByValue)
-                    return
 
                 # Do the actual setting of the 'byValue' filtering
                 self.byValueHelper(value, self.dataBack, messageInfoName, fieldName, valueString)
-                self.tableWidget.item(currentRow, FILTER).setBackground(QtCore.Qt.cyan)
+                self.model.setFilter(row, valueString, True)
 
             except ValueError:
                 # The filter was a invalid, in which case the user is notified by seeing
                 # the text change to 'None'
-                self.tableWidget.item(currentRow, FILTER).setText('None')
-                self.tableWidget.item(currentRow, FILTER).setBackground(QtCore.Qt.white)
-                self.tableWidget.itemChanged.connect(self.filterByValue)
+                self.model.setFilter(row, 'None', False)
 
         # Finally, set the 'byValue' flag to True
         self.dataBack.messages[messageInfoName].fields[fieldName].byValue[ACTIVE] = True
-        self.tableWidget.itemChanged.connect(self.filterByValue)
 
 
     # A helper function called by 'filterByValue()'. The 'valueString' parameter is the 
@@ -370,33 +575,14 @@ class FilterTable(QtWidgets.QWidget):
         if not (equal or lt or gt):
             raise Exception('Filtering failed for {}. Hint: Correct syntax example with mouseover'.format(valueString))
 
-    # Disable items that are normally editable in the tableWidget. 
+    # Enable the checkboxes and filters again after logging
     def enableItemsAfterLogging(self):
-        i = 0
-        count = self.tableWidget.rowCount()
-        while i < count:
-            # First make a QtWidgetItem.flags() object.
-            currentFilterFlags = self.tableWidget.item(i,FILTER).flags()
-            # Mask the flag object and set the item to 'uneditable'
-            self.tableWidget.item(i,FILTER).setFlags(currentFilterFlags | QtCore.Qt.ItemIsEnabled)
-
-            currentCheckboxFlags = self.tableWidget.item(i,CHECKBOX)
-            self.tableWidget.item(i,CHECKBOX).setFlags(currentFilterFlags | QtCore.Qt.ItemIsEnabled)
-            i += 1
-
-    # Disable items that are normally editable in the tableWidget. 
+        self.model.setLocked(False)
+
+    # Disable items that are normally editable in the table, so that the messages
+    # being logged can't be changed
     def disableItemsForLogging(self):
-        i = 0
-        count = self.tableWidget.rowCount()
-        while i < count:
-            # First make a QtWidgetItem.flags() object.
-            currentFilterFlags = self.tableWidget.item(i,FILTER).flags()
-            # Mask the flag object and set the item to 'uneditable'
-            self.tableWidget.item(i,FILTER).setFlags(currentFilterFlags & ~QtCore.Qt.ItemIsEnabled)
-
-            currentCheckboxFlags = self.tableWidget.item(i,CHECKBOX)
-            self.tableWidget.item(i,CHECKBOX).setFlags(currentFilterFlags & ~QtCore.Qt.ItemIsEnabled)
-            i += 1
+        self.model.setLocked(True)
 
 
     def pdbset(self):
@@ -0,0 +1,133 @@
+'''
+ * Copyright Bar Smith, Bryant Mairs, Alex Bardales 2015
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses.
+'''
+
+'''
+Tracks how often each message is received, for the 'Rate' column of the GUI
+and for '--stats' on the command line.
+
+A FrequencyTracker keeps the times between the last RATE_WINDOW arrivals of a
+message in a ring that is allocated once, along with their running sum and sum
+of squares. Each arrival is then a fixed amount of work however fast the
+message comes in: the rate is the number of intervals over their sum, and the
+jitter is their standard deviation. The shortest and longest intervals ever
+seen and the time the message was last seen are kept too.
+
+Arrivals are given the time the frame was received, so that tracking a message
+doesn't read the clock at all (see CanDataTranscoder.calcFrequency()). Unless
+the CANusb timestamps frames ('--timestamps'), that is when the serial read they
+came in returned, so the rate is right over the window but the jitter and the
+shortest and longest intervals are not the bus's own.
+'''
+
+from math import sqrt
+
+# The number of intervals between arrivals that the rate and jitter are worked out from
+RATE_WINDOW = 64
+
+# A message that hasn't been seen for this many seconds is shown with a rate of 0
+STALE_AGE = 3.0
+
+
+class FrequencyTracker():
+    def __init__(self, window=RATE_WINDOW):
+        # The ring of intervals, in seconds. 'index' is where the next one goes.
+        self.intervals = [0.0] * window
+        self.index = 0
+        # How many of the intervals in the ring are filled in
+        self.filled = 0
+        self.total = 0.0
+        self.totalSquares = 0.0
+
+        self.count = 0
+        self.last = None
+        self.minInterval = None
+        self.maxInterval = None
+
+    # Record an arrival at time 'now', in seconds
+    def update(self, now):
+        self.count += 1
+        last = self.last
+        self.last = now
+        if last is None:
+            return
+        interval = now - last
+        if interval < 0:
+            # The clock went backwards, so there is nothing to learn from this one
+            return
+        if self.minInterval is None or interval < self.minInterval:
+            self.minInterval = interval
+        if self.maxInterval is None or interval > self.maxInterval:
+            self.maxInterval = interval
+
+        intervals = self.intervals
+        index = self.index
+        old = intervals[index]
+        intervals[index] = interval
+        index += 1
+        if index == len(intervals):
+            index = 0
+        self.index = index
+        if self.filled < len(intervals):
+            self.filled += 1
+            self.total += interval
+            self.totalSquares += interval * interval
+        elif index == 0:
+            # Once per trip around the ring, add the sums up afresh so that rounding
+            # errors from taking old intervals away don't build up
+            self.total = sum(intervals)
+            self.totalSquares = sum(i * i for i in intervals)
+        else:
+            self.total += interval - old
+            self.totalSquares += interval * interval - old * old
+
+    # Arrivals per second over the window. With 'now', a message that hasn't been
+    # seen for STALE_AGE seconds has a rate of 0.
+    def rate(self, now=None):
+        if now is not None and self.age(now) > STALE_AGE:
+            return 0.0
+        if self.total <= 0:
+            return 0.0
+        return self.filled / self.total
+
+    # The standard deviation of the intervals over the window, in seconds
+    def jitter(self):
+        if not self.filled:
+            return 0.0
+        mean = self.total / self.filled
+        return sqrt(max(0.0, self.totalSquares / self.filled - mean * mean))
+
+    # Seconds since the message was last seen
+    def age(self, now):
+        if self.last is None:
+            return None
+        return now - self.last
+
+    # The count and rate, and with 'intervals' the jitter and the shortest and longest
+    # intervals too. Those are only worth showing when each frame has a time of its own:
+    # without the CANusb's timestamps, every frame in a read from the serial port is
+    # given the same time, so they would measure the serial reads rather than the bus.
+    def summary(self, intervals=True):
+        if self.minInterval is None:
+            return "{} received".format(self.count)
+        if not intervals:
+            return "{} received, {:.2f}/s".format(self.count, self.rate())
+        return "{} received, {:.2f}/s, jitter {:.1f} ms, interval {:.1f}-{:.1f} ms".format(
+               self.count, self.rate(), 1000 * self.jitter(),
+               1000 * self.minInterval, 1000 * self.maxInterval)
+
+    def __str__(self):
+        return self.summary()
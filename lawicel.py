@@ -0,0 +1,196 @@
+'''
+ * Copyright Bar Smith, Bryant Mairs, Alex Bardales 2015
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses.
+'''
+
+'''
+This code is used to decode the ASCII frames sent by the CANusb (Lawicel) device.
+
+Frames have a fixed layout, so they are sliced at known positions rather than
+run through a regular expression:
+    tiiildd..[ssss]        standard frame, 3 hex digit ID
+    Tiiiiiiiildd..[ssss]   extended frame, 8 hex digit ID
+where 'l' is the payload length, 'dd' is one byte of payload (repeated 'l'
+times), and 'ssss' is the optional millisecond timestamp.
+
+The timestamp is turned on with the 'Z1' command, and counts from 0 to 59999
+before wrapping around. DeviceClock turns it back into a continuous time.
+'''
+
+from binascii import unhexlify
+
+from CanMessage import RawFrame
+
+# Characters that may precede a frame and are skipped: whitespace, and the bell
+# that CANusb sends (without a carriage return) when a command fails.
+LEADING_JUNK = b' \t\n\x07'
+
+# The characters allowed in the ID and timestamp. int() would also take a sign,
+# whitespace or underscores, so these are checked for first.
+HEX_DIGITS = b'0123456789ABCDEFabcdef'
+
+# The largest ID of each frame format
+MAX_STANDARD_ID = 0x7FF
+MAX_EXTENDED_ID = 0x1FFFFFFF
+
+# Length of the optional timestamp that follows the payload
+TIMESTAMP_DIGITS = 4
+
+# The timestamp counts milliseconds and wraps around every minute
+TIMESTAMP_ROLLOVER = 60000
+
+# The command to turn the timestamp on. It may only be sent while the CAN channel
+# is closed, and the CANusb remembers the setting after power off.
+TIMESTAMPS_ON = b'Z1\r'
+
+# The acceptance code and mask that let every frame through, which the CANusb starts with
+ACCEPT_ALL_CODE = 0x00000000
+ACCEPT_ALL_MASK = 0xFFFFFFFF
+
+# The bits of an acceptance filter compared with a standard frame's header: the 11-bit
+# ID and the RTR bit. The low 4 bits of each filter hold half of the first data byte,
+# which filter 1 compares with standard frames (see acceptanceMatch()).
+STANDARD_FIELD_BITS = 0xFFF0
+EXTENDED_FIELD_BITS = 0xFFFF
+DATA_NIBBLE_BITS = 0x000F
+
+# Frame type characters, as ints since frames are sliced from bytes
+STANDARD_FRAME = ord('t')
+EXTENDED_FRAME = ord('T')
+ZERO_CHAR = ord('0')
+
+
+# Parse one frame, without its carriage return, into a RawFrame. 'line' may be a
+# bytes or a bytearray. Returns None for anything that is not a well-formed
+# 't' or 'T' frame, such as the replies CANusb sends to commands.
+def parseFrame(line):
+    line = line.lstrip(LEADING_JUNK)
+    if not line:
+        return None
+    kind = line[0]
+    if kind == STANDARD_FRAME:
+        extended = False
+        dlcIndex = 4
+    elif kind == EXTENDED_FRAME:
+        extended = True
+        dlcIndex = 9
+    else:
+        return None
+    if len(line) <= dlcIndex:
+        return None
+
+    dlc = line[dlcIndex] - ZERO_CHAR
+    if dlc < 0 or dlc > 8:
+        return None
+    end = dlcIndex + 1 + 2 * dlc
+
+    # What follows the payload is either nothing or a timestamp.
+    trailing = len(line) - end
+    if trailing != 0 and trailing != TIMESTAMP_DIGITS:
+        return None
+
+    # Anything left after stripping the hex digits means the line is corrupt
+    idDigits = line[1:dlcIndex]
+    if idDigits.strip(HEX_DIGITS) or (trailing and line[end:].strip(HEX_DIGITS)):
+        return None
+    try:
+        id = int(idDigits, 16)
+        payload = unhexlify(line[dlcIndex + 1:end])
+        timestamp = int(line[end:], 16) if trailing else None
+    except ValueError:
+        return None
+    if id > (MAX_EXTENDED_ID if extended else MAX_STANDARD_ID):
+        return None
+    return RawFrame(id, extended, dlc, payload, timestamp)
+
+
+# Turns CANusb timestamps into times in seconds since the epoch, like time.time().
+# The millisecond count is accumulated across rollovers into a time base that
+# starts at the host time when the first timestamp was seen. Only differences
+# between timestamps are used after that, so the time between two frames is as
+# accurate as the CANusb clock, however late the host reads them.
+class DeviceClock():
+    def __init__(self):
+        self.origin = None # Host time of the first timestamp
+        self.elapsed = 0 # Milliseconds counted up to the last timestamp
+        self.lastStamp = None
+        self.lastHostTime = None
+
+    # Set 'time' on each of 'frames', which were all read at 'hostTime'. Frames without
+    # a timestamp are given 'hostTime'.
+    def setTimes(self, frames, hostTime):
+        stamped = []
+        for frame in frames:
+            if frame.timestamp is None:
+                frame.time = hostTime
+                continue
+            if self.lastStamp is None:
+                self.origin = hostTime
+            else:
+                delta = (frame.timestamp - self.lastStamp) % TIMESTAMP_ROLLOVER
+                # The timestamp alone can't tell how many times it wrapped around if there
+                # was a long gap between frames, so the host clock is used to count those.
+                hostDelta = (hostTime - self.lastHostTime) * 1000
+                if hostDelta - delta > TIMESTAMP_ROLLOVER / 2:
+                    delta += TIMESTAMP_ROLLOVER * round((hostDelta - delta) / TIMESTAMP_ROLLOVER)
+                self.elapsed += delta
+            self.lastStamp = frame.timestamp
+            self.lastHostTime = hostTime
+            frame.time = self.elapsed
+            stamped.append(frame)
+        if not stamped:
+            return
+
+        # None of these frames can have arrived after they were read. If the last one
+        # seems to have, the origin was set too late (or the CANusb clock runs fast), so
+        # move it back to keep the two clocks in step.
+        if self.origin + self.elapsed / 1000 > hostTime:
+            self.origin = hostTime - self.elapsed / 1000
+        for frame in stamped:
+            frame.time = self.origin + frame.time / 1000
+
+
+# The part of an ID that an acceptance filter compares, as the SJA1000 in the CANusb
+# does in dual filter mode: ID.28-13 of an extended ID, or a standard ID followed by
+# its RTR bit (always 0, as remote frames aren't used)
+def acceptanceField(id, extended):
+    if extended:
+        return (id >> 13) & EXTENDED_FIELD_BITS
+    return (id << 5) & STANDARD_FIELD_BITS
+
+
+# Whether a CANusb with the given acceptance code and mask, as set by the 'M' and 'm'
+# commands, lets a frame through. These hold two filters, one in the top 16 bits and
+# one in the bottom 16, and a frame gets through if either matches. A mask bit of 1
+# means that bit isn't compared.
+#
+# For a standard frame with data, filter 1 also compares the first data byte: its
+# high nibble with the low 4 bits of filter 1, and its low nibble with the low 4 bits
+# of filter 2. So those bits of filter 2 matter even when only filter 1 is meant for
+# standard frames.
+def acceptanceMatch(id, extended, code, mask, payload=b''):
+    field = acceptanceField(id, extended)
+    if extended:
+        for shift in (16, 0):
+            if not (field ^ (code >> shift)) & ~(mask >> shift) & EXTENDED_FIELD_BITS:
+                return True
+        return False
+    if not (field ^ code) & ~mask & STANDARD_FIELD_BITS:
+        return True
+    if not payload:
+        return not (field ^ (code >> 16)) & ~(mask >> 16) & STANDARD_FIELD_BITS
+    data = payload[0]
+    return (not ((field | (data >> 4)) ^ (code >> 16)) & ~(mask >> 16) & EXTENDED_FIELD_BITS and
+            not ((data & DATA_NIBBLE_BITS) ^ code) & ~mask & DATA_NIBBLE_BITS)
@@ -39,7 +39,9 @@ ZERO = '0'
 # and initializes the messageInfo objects that are used to parse the incoming 
 # serial messages.
 # This function is shared by the command-line and GUI modes.
-def xmlImport(dataBack, fileName):
+# Messages without a channel of their own are given 'channel', which an include
+# element can set for all the messages in the file it includes.
+def xmlImport(dataBack, fileName, channel=None):
     messageCount = 0
     # Now try and process the XML file.
     try:
@@ -48,7 +50,7 @@ def xmlImport(dataBack, fileName):
         # A file can be included in the metadata. First, we have to scale down the function stack
         for includeFile in root.findall('include'):
             filename_ = 'metadata/' + includeFile.get('file')
-            xmlImport(dataBack, filename_)  
+            xmlImport(dataBack, filename_, includeFile.get('channel', channel))
 
         # Now set the function stack size to what it was when we started.
 
@@ -56,6 +58,8 @@ def xmlImport(dataBack, fileName):
             #from PyQt5.QtCore import pyqtRemoveInputHook; pyqtRemoveInputHook(); import pdb; pdb.set_trace()
             newMessageInfo = MessageInfo()
             newMessageInfo.createNew(message, dataBack, fileName)
+            if newMessageInfo.channel is None:
+                newMessageInfo.channel = channel
             if newMessageInfo.pgn and newMessageInfo.id:
                 raise Exception("Both PGN and ID specified for message '{}', only one may be specified.".format(newMessageInfo.name))
             if not newMessageInfo.fields:
@@ -69,6 +73,67 @@ def xmlImport(dataBack, fileName):
     if messageCount:
         dataBack.messageInfoFlag = True
 
+    # Rebuild the lookup table for incoming frames. It is swapped in with a single
+    # assignment, so the transcoder thread never sees a partially built table.
+    dataBack.dispatchTable = DispatchTable(dataBack.messages)
+
+
+# The lookup table used by CANacondaMessageParse to find the MessageInfo for a received
+# frame. Standard and extended frames are kept apart, so an 11-bit ID can never match
+# a 29-bit one. Extended frames are matched by ID first, and then by PGN.
+# Messages created at run-time for frames without metadata (anonymous) are left out.
+# The table also holds the set of PGNs that have to be reassembled from fast-packets.
+class DispatchTable():
+    # 'channel' builds the table for one channel's own messages, leaving out the rest
+    def __init__(self, messages=None, channel=None):
+        self.standardIds = {}
+        self.extendedIds = {}
+        self.pgns = {}
+        self.fastPacketPgns = set()
+        # A DispatchTable for each channel that has messages of its own. These are
+        # looked in first for frames from that channel.
+        self.channelTables = {}
+        if messages is None:
+            return
+        channelMessages = {}
+        for messageInfo in messages.values():
+            if messageInfo.anonymous:
+                continue
+            if messageInfo.channel != channel:
+                if channel is None:
+                    channelMessages.setdefault(messageInfo.channel, {})[messageInfo.name] = messageInfo
+                continue
+            if messageInfo.id is not None:
+                # An ID too big for 11 bits can only arrive in an extended frame
+                if messageInfo.format == CAN_FORMAT_EXTENDED or messageInfo.id > 0x7FF:
+                    self.extendedIds.setdefault(messageInfo.id, messageInfo)
+                else:
+                    self.standardIds.setdefault(messageInfo.id, messageInfo)
+            elif messageInfo.pgn:
+                self.pgns.setdefault(int(messageInfo.pgn), messageInfo)
+                if messageInfo.fastPacket:
+                    self.fastPacketPgns.add(int(messageInfo.pgn))
+
+        for messageChannel, channelMessageInfos in channelMessages.items():
+            table = self.channelTables[messageChannel] = DispatchTable(channelMessageInfos, messageChannel)
+            self.fastPacketPgns |= table.fastPacketPgns
+
+    # Return the MessageInfo for a frame, or None if there is no metadata for it.
+    # Messages that belong to the frame's channel are preferred over ones for any channel.
+    def find(self, extended, id, pgn, channel=None):
+        if self.channelTables:
+            table = self.channelTables.get(channel)
+            if table is not None:
+                messageInfo = table.find(extended, id, pgn)
+                if messageInfo is not None:
+                    return messageInfo
+        if extended:
+            messageInfo = self.extendedIds.get(id)
+            if messageInfo is None:
+                messageInfo = self.pgns.get(pgn)
+            return messageInfo
+        return self.standardIds.get(id)
+
 
 # This instances of this class are filters created from
 # the metadata file. This class gets instantiated during the
@@ -87,6 +152,8 @@ class MessageInfo():
         self.protocol = None
         self.endian = None
         self.anonymous = False
+        self.fastPacket = False
+        self.channel = None # Only frames from this channel match, or any channel if None
         self.fields = {}
 
     def createNew(self, messageInfo, dataBack, fileName):
@@ -142,6 +209,17 @@ class MessageInfo():
         except:
             self.size = 0
 
+        # NMEA 2000 messages longer than 8 bytes are split over several frames, and
+        # must be reassembled before they are decoded (see reassembly.py).
+        self.fastPacket = messageInfo.get('type') == 'fast-packet'
+        if self.fastPacket and not self.pgn:
+            raise Exception("Parsing failed in XML file '{}' for message '{}': Fast-packet messages must have a PGN.".format(fileName, self.name))
+
+        # When several buses are read at once, a message can be tied to one of them by
+        # its channel name (see multiport.py), so the same IDs can mean different things
+        # on different buses.
+        self.channel = messageInfo.get('channel')
+
         # Get either the endianness or the protocol of the message.
         protocol = messageInfo.get('protocol')
         endian = messageInfo.get('endian')
@@ -190,10 +268,48 @@ class Field():
         self.length = 0
         self.offset = 0   
         self.signed = 'no'
+        self.endian = None
         self.units = None
         self.scaling = 1
         self.unitsConversion = None 
         self.byValue = {ACTIVE:False, EQUAL:None, LT:None, GT:None}
+        self.compileDecoder()
+
+    # The units that the user has chosen to convert this field to. Setting them also
+    # looks up the conversion coefficients from backend.conversionMap once, rather
+    # than on every decoded message.
+    @property
+    def unitsConversion(self):
+        return self._unitsConversion
+
+    @unitsConversion.setter
+    def unitsConversion(self, newUnits):
+        self._unitsConversion = newUnits
+        # 'conversion' is (add before, multiply, add after), in the order they are applied
+        self.conversion = None
+        if newUnits:
+            from backend import conversionMap
+            try:
+                coefficients = conversionMap[self.units][newUnits]
+                self.conversion = (float(coefficients[1]), float(coefficients[0]), float(coefficients[2]))
+            except KeyError:
+                pass
+
+    # Work out once everything needed to pull this field out of a payload that has been
+    # read as a single little-endian integer, so that decoding it is a shift and a mask.
+    # Byte-swapping and sign extension work on whole bytes rather than on 'length' bits,
+    # as the field is handed to int.from_bytes() as an array of bytes.
+    def compileDecoder(self):
+        self.mask = (1 << self.length) - 1
+        self.byteCount = (self.length + 7) // 8
+        self.byteSwap = self.endian == 'big' and self.byteCount > 1
+        if self.signed == 'yes':
+            self.signBit = 1 << (8 * self.byteCount - 1)
+            self.signRange = 1 << (8 * self.byteCount)
+        else:
+            self.signBit = 0
+            self.signRange = 0
+        self.bitfieldFormat = "{:#0" + str(2 + self.length) + "b}"
 
     # 'parent' is a string with the name of the message this field is a member of
     # 'field' is an ElementTree object
@@ -224,7 +340,7 @@ class Field():
 
         # The offset and signed-ness of the field
         self.offset = int(field.get('offset'))
-        self.signed = field.get('signed')
+        self.signed = field.get('signed', 'no')
 
         # The field units
         units_ = field.get('units')
@@ -294,6 +410,9 @@ class Field():
 
             self.disp_format += "f}"
 
+        # Now that the layout of the field is known, set up its decoder
+        self.compileDecoder()
+
     def checkFormat(self, string, fileName):
         if string[0] == ' ' or string[-1] == ' ':
             raise Exception("Parsing failed for XML file '{}'. '{}' has leading or trailing space character".format(fileName, string))
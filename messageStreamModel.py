@@ -0,0 +1,147 @@
+'''
+ * Copyright Bar Smith, Bryant Mairs, Alex Bardales 2015
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses.
+'''
+
+# The MessageStreamModel class gets instantiated in canaconda_GUI.py, as the model
+# behind the Message Stream view. That is a one-column QTableView with fixed row
+# heights, which, unlike a QListView, doesn't lay out every row when rows are added.
+#
+# It holds the latest 'capacity' messages shown in a ring that is allocated once,
+# so the stream takes the same memory however long the program runs. Each message
+# is kept as a StreamRecord, which holds only what it takes to print it. The text
+# of a row is only built when the view asks for it, which is when the row is
+# scrolled into view, and the text of the rows on screen is cached.
+
+from PyQt5 import QtCore
+
+from CanMessage import CanMessage
+
+# How many messages the stream holds before the oldest are dropped
+STREAM_CAPACITY = 1000000
+
+# How many rows' text is cached. This is a few screens' worth.
+TEXT_CACHE_SIZE = 1024
+
+
+# What the message stream keeps of a CanMessage. It has the attributes that
+# printmessage reads, with the body stored as the field names, which are shared
+# by every message with the same name, and a tuple of their values.
+class StreamRecord():
+    __slots__ = ('name', 'id', 'pgn', 'time', 'channel', 'payload', 'fields', 'values')
+
+    # Field names tuples, so each message name has only one
+    fieldNames = {}
+
+    def __init__(self, message):
+        self.name = message.name
+        self.id = message.id
+        self.pgn = message.pgn
+        self.time = message.time
+        self.channel = message.channel
+        self.payload = message.payload
+        fields = tuple(message.body)
+        self.fields = StreamRecord.fieldNames.setdefault((message.name, fields), fields)
+        self.values = tuple(message.body.values())
+
+    @property
+    def body(self):
+        return dict(zip(self.fields, self.values))
+
+    __str__ = CanMessage.__str__
+
+
+class MessageStreamModel(QtCore.QAbstractListModel):
+
+    # 'formatter' turns a StreamRecord into the text shown for it
+    def __init__(self, formatter, capacity=STREAM_CAPACITY):
+        super(MessageStreamModel, self).__init__()
+        self.formatter = formatter
+        self.capacity = capacity
+        self.records = [None] * capacity
+        # Where the oldest record is in the ring, and how many there are
+        self.start = 0
+        self.count = 0
+        # How many records have ever been dropped off the front, so that a row's
+        # cached text can be found by its position in the whole stream
+        self.dropped = 0
+        self.textCache = {}
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self.count
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if role != QtCore.Qt.DisplayRole or not index.isValid():
+            return None
+        key = self.dropped + index.row()
+        text = self.textCache.get(key)
+        if text is None:
+            if len(self.textCache) >= TEXT_CACHE_SIZE:
+                self.textCache.clear()
+            text = self.textCache[key] = self.rowText(index.row())
+        return text
+
+    # The text for one row. The printmessage formats spread a message over several
+    # lines, which are joined to fit in one row.
+    def rowText(self, row):
+        record = self.records[(self.start + row) % self.capacity]
+        text = self.formatter(record)
+        if text is None:
+            text = str(record)
+        return ", ".join(line for line in text.split('\n') if line)
+
+    # Add records to the end of the stream. Once it is full, the newest records
+    # overwrite the oldest and every row moves up, which is signalled as a change to
+    # the rows' data rather than as rows removed and inserted, since that would take
+    # time in proportion to the number of rows. Returns how many rows moved up.
+    def append(self, records):
+        capacity = self.capacity
+        if len(records) > capacity:
+            records = records[-capacity:]
+        position = (self.start + self.count) % capacity
+        for record in records:
+            self.records[position] = record
+            position += 1
+            if position == capacity:
+                position = 0
+
+        inserted = min(len(records), capacity - self.count)
+        if inserted:
+            self.beginInsertRows(QtCore.QModelIndex(), self.count, self.count + inserted - 1)
+            self.count += inserted
+            self.endInsertRows()
+        shifted = len(records) - inserted
+        if shifted:
+            self.start = (self.start + shifted) % capacity
+            self.dropped += shifted
+            self.dataChanged.emit(self.index(0), self.index(self.count - 1))
+        return shifted
+
+    # Forget the text built so far, after the display settings have changed
+    def reformat(self):
+        self.textCache.clear()
+        if self.count:
+            self.dataChanged.emit(self.index(0), self.index(self.count - 1))
+
+    def clear(self):
+        self.beginResetModel()
+        self.records = [None] * self.capacity
+        self.dropped += self.count
+        self.start = 0
+        self.count = 0
+        self.textCache.clear()
+        self.endResetModel()
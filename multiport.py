@@ -0,0 +1,95 @@
+'''
+ * Copyright Bar Smith, Bryant Mairs, Alex Bardales 2015
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses.
+'''
+
+'''
+Support for reading several CAN buses at once, each through its own CANusb.
+
+Every port is given a channel name, either from the command line as
+'--port nav=/dev/ttyUSB0' or, by default, its position in the list ('0', '1',
+...). Each port has its own CANPort and reader thread, and tags the frames it
+reads with its channel name (RawFrame.channel). All of them feed the one
+transcode queue.
+
+Frames from different ports reach the transcoder in batches, so one port's
+frames can arrive before earlier frames from another. FrameMerger puts them
+back in time order before they are decoded.
+'''
+
+import heapq
+
+# How long a frame may be held waiting for frames from other channels, in seconds
+MERGE_DELAY = 0.05
+
+# Separates a channel name from its port in '--port name=port'
+CHANNEL_SEPARATOR = '='
+
+
+# Split a '--port' argument into (channel name, port). Ports given without a name are
+# named after their position, 'index'.
+def parsePortSpec(spec, index):
+    name, separator, port = spec.partition(CHANNEL_SEPARATOR)
+    if not separator:
+        return str(index), spec
+    return name, port
+
+
+# Merges frames from several channels into time order. Each channel's frames arrive
+# in order, so once every channel has been heard from up to some time, everything
+# before it can be released. A channel that goes quiet would hold the others up, so
+# no frame is held for more than 'delay' seconds.
+class FrameMerger():
+    def __init__(self, channels, delay=MERGE_DELAY):
+        self.delay = delay
+        self.heap = []
+        # Breaks ties between frames with the same time, keeping them in arrival order
+        self.count = 0
+        # The time of the newest frame from each channel
+        self.latest = {channel: None for channel in channels}
+
+    def add(self, frames):
+        heap = self.heap
+        latest = self.latest
+        for frame in frames:
+            heapq.heappush(heap, (frame.time, self.count, frame))
+            self.count += 1
+            if latest.get(frame.channel) is None or frame.time > latest[frame.channel]:
+                latest[frame.channel] = frame.time
+
+    # Remove and return, in time order, the frames that can't be preceded by any
+    # still to come, or that have waited long enough. 'now' is a time.time().
+    def release(self, now):
+        heap = self.heap
+        if not heap:
+            return []
+        limit = now - self.delay
+        latest = self.latest.values()
+        if None not in latest:
+            limit = max(limit, min(latest))
+        released = []
+        while heap and heap[0][0] <= limit:
+            released.append(heapq.heappop(heap)[2])
+        return released
+
+    # How long until the oldest frame being held must be released, or None if there
+    # are none
+    def timeUntilRelease(self, now):
+        if not self.heap:
+            return None
+        return max(0.0, self.heap[0][0] + self.delay - now)
+
+    def __len__(self):
+        return len(self.heap)
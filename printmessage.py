@@ -41,6 +41,12 @@ unitStringMap = {
 # displayList constants
 ID, PGN, BODY, RAW = range(4)
 
+# The time to show for a message: when it was received if that is known, otherwise now.
+def messageTime(message):
+    if message.time is None:
+        return time.time()
+    return message.time
+
 # this is just a copy of the parseMessage function from canpython
 # add boolean checks to match args for correct outmsg format
 # Messages not specified in messages file still have a PGN number,
@@ -62,11 +68,15 @@ def noGuiParse(dataBack, message):
     dataFound = False
     # Print the timestamp of the message first, per user request
     if dataBack.args.time:
-        outmsg += "\nTime: {0:0.3f}".format(time.time())
+        outmsg += "\nTime: {0:0.3f}".format(messageTime(message))
     
     # Append the message name as specified in the metadata
     if message.name:
         outmsg += "\n" + message.name
+
+    # Then the bus it came from, if several are being read
+    if dataBack.multiChannel:
+        outmsg += "\nChannel: " + str(message.channel)
     
     # Then the PGN, if format is extended. First check format.
     Extended = dataBack.messages[message.name].format == CAN_FORMAT_EXTENDED
@@ -142,7 +152,10 @@ def noGuiParseCSV(dataBack, message):
     # Display message
     if dataFound:
         if dataBack.args.time:
-            lineData[0] = "{0:0.3f}".format(time.time())
+            lineData[0] = "{0:0.3f}".format(messageTime(message))
+        # When reading several buses, the bus comes after the time
+        if dataBack.multiChannel:
+            lineData.insert(1, str(message.channel))
         return (','.join(lineData))
 
 
@@ -163,10 +176,31 @@ def noGuiParseCSV_zero(dataBack, message):
             if field in dataBack.messageInfo_to_fields[message.name]:
                 fieldList[field] = message.body[field]
     if dataBack.args.time:
-        outmsg += "{0:0.3f}".format(time.time()) + ", "
+        outmsg += "{0:0.3f}".format(messageTime(message)) + ", "
+    if dataBack.multiChannel:
+        outmsg += str(message.channel) + ", "
     outmsg += (str([(fieldList[key]) for key in sorted(fieldList)])[1:-1])
     return (outmsg)
 
+# Whether the GUI's message stream shows 'message' at all in the current display
+# mode: the same answer as whether guiParseCSV() or noGuiParse() would return any
+# text, but without building it. The text is built later, only for the messages
+# that are scrolled into view.
+def guiShown(dataBack, message):
+    body = message.body
+    if dataBack.GUI_CSVflag and dataBack.messageInfoFlag and not dataBack.GUI_rawFlag:
+        fieldIndices = dataBack.fieldIndices
+        return any(field in fieldIndices for field in body)
+    fields = dataBack.messageInfo_to_fields.get(message.name)
+    if fields is None:
+        return dataBack.GUI_rawFlag and not dataBack.messageInfoFlag
+    if not any(field in fields for field in body):
+        return False
+    # A field filtered out by value hides the whole message
+    if dataBack.displayList[BODY]:
+        return None not in body.values()
+    return dataBack.displayList[RAW]
+
 # good enough for now
 def guiParseCSV(dataBack, message):
     # A mapping dictionary from fields to array indices
@@ -185,6 +219,77 @@ def guiParseCSV(dataBack, message):
             dataFound = True
     # Display message
     if dataFound:
-        lineData[0] = "{0:0.3f}".format(time.time())
+        lineData[0] = "{0:0.3f}".format(messageTime(message))
         return (','.join(lineData))
 
+
+
+# Output modes for BufferedOutput
+LINE_MODE = 'line'
+THROUGHPUT_MODE = 'throughput'
+OUTPUT_MODES = (LINE_MODE, THROUGHPUT_MODE)
+
+# Collects lines of output and writes them to 'stream' several at a time, so that
+# the CLI doesn't make a write() and flush() call for every message.
+#
+# In LINE_MODE, everything is written out at the end of each batch of messages the
+# transcoder handles, which keeps the delay low for live uses like pipePlotter.py.
+# In THROUGHPUT_MODE, lines are held until 'bufferSize' characters are waiting or
+# the oldest has waited 'flushInterval' seconds, which suits capturing to a file.
+class BufferedOutput():
+    BUFFER_SIZE = 64 * 1024
+
+    def __init__(self, stream=None, mode=LINE_MODE, flushInterval=0.02, bufferSize=BUFFER_SIZE):
+        self.stream = stream if stream is not None else sys.stdout
+        self.mode = mode
+        self.flushInterval = flushInterval
+        self.bufferSize = bufferSize
+        self.lines = []
+        self.size = 0
+        # When the oldest waiting line was written, as a time.monotonic()
+        self.deadline = None
+
+        # Statistics
+        self.startTime = time.monotonic()
+        self.bytesWritten = 0
+        self.linesWritten = 0
+        self.flushes = 0
+
+    def write(self, line):
+        if not self.lines:
+            self.deadline = time.monotonic() + self.flushInterval
+        self.lines.append(line)
+        self.size += len(line) + 1
+        if self.size >= self.bufferSize:
+            self.flush()
+
+    # Called by the transcoder once it has handled everything it was given
+    def batchDone(self):
+        if self.lines and (self.mode == LINE_MODE or time.monotonic() >= self.deadline):
+            self.flush()
+
+    # How long the caller can wait for more messages before flush() is due, or None
+    # if nothing is waiting to be written
+    def timeUntilFlush(self):
+        if not self.lines:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def flush(self):
+        if not self.lines:
+            return
+        # A trailing empty string gives the last line its newline
+        self.lines.append('')
+        self.stream.write('\n'.join(self.lines))
+        self.stream.flush()
+        self.bytesWritten += self.size
+        self.linesWritten += len(self.lines) - 1
+        self.flushes += 1
+        self.lines = []
+        self.size = 0
+
+    def __str__(self):
+        elapsed = time.monotonic() - self.startTime
+        return "output: {} lines, {:.0f} bytes/s, {} flushes, {:.1f} lines per flush ({})".format(
+               self.linesWritten, self.bytesWritten / elapsed if elapsed else 0.0, self.flushes,
+               self.linesWritten / self.flushes if self.flushes else 0.0, self.mode)
@@ -0,0 +1,361 @@
+'''
+ * Copyright Bar Smith, Bryant Mairs, Alex Bardales 2015
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses.
+'''
+
+'''
+This code rebuilds messages that are too big for a single CAN frame from the
+frames that carry them. It sits between the serial port and
+CANacondaMessageParse(). Batches of RawFrames go in, and the same batches come
+out with each multi-frame message replaced by one RawFrame holding its whole
+payload. Its 'dlc' is the payload length in bytes.
+
+NMEA 2000 fast-packet:
+    A message of up to 223 bytes is sent as up to 32 frames. The first byte of
+    every frame is a 3-bit sequence number, which is the same for every frame
+    of one message, followed by a 5-bit frame counter. The first frame
+    (counter 0) gives the total length in its second byte and then holds
+    6 bytes of data. Each frame after it holds 7 bytes of data.
+    Only PGNs marked type = "fast-packet" in the metadata are reassembled.
+
+J1939 / ISO 11783 transport protocol:
+    A message of up to 1785 bytes is announced with a TP.CM frame (PGN 60416),
+    and its data follows in TP.DT frames (PGN 60160). Each TP.DT frame holds a
+    sequence number from 1 to 255 and then 7 bytes of data. A broadcast (BAM)
+    is sent to every node without any handshake. A message to one node starts
+    with a request to send (RTS). The receiver then asks for packets with clear
+    to send (CTS), acknowledges the whole message at the end (EOM ACK), or
+    gives up (Abort). CANaconda only listens. It reassembles both kinds of
+    transfer, whatever their PGN, and the TP frames themselves are not passed on.
+'''
+
+import time
+
+from CanMessage import RawFrame
+from Nmea2000 import Iso11783Decode, Iso11783Encode
+
+# The largest fast-packet payload: 6 bytes in the first frame and 7 in each of the other 31
+FAST_PACKET_MAX = 223
+FAST_PACKET_FIRST_DATA = 6
+FAST_PACKET_DATA = 7
+
+# Transport protocol PGNs, and the control bytes that start a TP.CM frame
+TP_CM = 60416
+TP_DT = 60160
+TP_RTS = 16
+TP_CTS = 17
+TP_BAM = 32
+TP_ABORT = 255
+
+# The largest transport protocol payload: 255 packets of 7 bytes
+TP_MAX = 1785
+TP_DATA = 7
+GLOBAL_ADDRESS = 0xFF
+
+
+# Passes batches of frames through all of the reassembly stages. Each extended frame
+# is looked at once to find its PGN, and then handed to the stage that wants it.
+class Reassembler():
+    def __init__(self):
+        self.fastPackets = FastPacketAssembler()
+        self.transport = TransportProtocolSessions()
+
+    # Return a list of the frames in 'frames', with fragments replaced by the messages
+    # they complete. 'fastPacketPgns' is the set of PGNs to reassemble as fast-packets.
+    def process(self, frames, fastPacketPgns):
+        now = time.monotonic()
+        self.fastPackets.sweep(now)
+        self.transport.sweep(now)
+
+        output = []
+        for frame in frames:
+            if not frame.extended:
+                output.append(frame)
+                continue
+            pgn, src, dest, pri = Iso11783Decode(frame.id)
+            if pgn == TP_CM or pgn == TP_DT:
+                message = self.transport.addFrame(frame, pgn, src, dest, pri, now)
+            elif pgn in fastPacketPgns:
+                message = self.fastPackets.addFrame(frame, pgn, src, now)
+            else:
+                output.append(frame)
+                continue
+            if message is not None:
+                output.append(message)
+        return output
+
+    def __str__(self):
+        return "fast-packet: {}\n    transport protocol: {}".format(self.fastPackets, self.transport)
+
+
+# A message being reassembled. Sessions and their buffers are created up front and
+# reused, so receiving a frame never allocates a new buffer.
+class FastPacketSession():
+    __slots__ = ('key', 'buffer', 'size', 'received', 'nextCounter', 'frames', 'lastTime')
+
+    def __init__(self):
+        self.key = None # (PGN, source address, sequence number)
+        self.buffer = bytearray(FAST_PACKET_MAX)
+        self.size = 0 # The total payload size given in the first frame
+        self.received = 0 # Payload bytes received so far
+        self.nextCounter = 0 # The frame counter expected next
+        self.frames = 0 # Frames received so far, for counting dropped fragments
+        self.lastTime = 0 # time.monotonic() when the last frame arrived
+
+
+# Reassembles NMEA 2000 fast-packet messages.
+# Messages are tracked by (PGN, source address, sequence number). There are at most
+# 'maxSessions' messages in progress, and at most 'maxPerSource' from one source
+# address. A message that gets no new frames for 'timeout' seconds is thrown away.
+# Frames that cannot be used, because they arrive out of order, belong to no message,
+# or there is no room for a new message, are counted in 'droppedFragments'.
+class FastPacketAssembler():
+    def __init__(self, maxSessions=64, maxPerSource=8, timeout=0.75):
+        self.maxPerSource = maxPerSource
+        self.timeout = timeout
+        self.sessions = {}
+        self.perSource = {}
+        self.freeSessions = [FastPacketSession() for i in range(maxSessions)]
+        self.lastSweep = 0
+
+        # Statistics
+        self.completed = 0
+        self.timedOut = 0
+        self.droppedFragments = 0
+
+    # Throw away stale messages, at most twice per timeout period
+    def sweep(self, now):
+        if self.sessions and now - self.lastSweep > self.timeout / 2:
+            self.expire(now)
+
+    # Add one fragment. Returns the reassembled RawFrame if this completed a message.
+    def addFrame(self, frame, pgn, src, now):
+        payload = frame.payload
+        if not payload:
+            self.droppedFragments += 1
+            return None
+        counter = payload[0] & 0x1F
+        key = (pgn, src, payload[0] >> 5)
+        session = self.sessions.get(key)
+
+        if counter == 0:
+            # A new message. If one with the same key is still in progress, it will
+            # never be finished, as its sequence number has been reused.
+            if session is not None:
+                self.release(session)
+                self.droppedFragments += session.frames
+            if len(payload) < 2 or payload[1] > FAST_PACKET_MAX:
+                self.droppedFragments += 1
+                return None
+            session = self.acquire(key, src, now)
+            if session is None:
+                self.droppedFragments += 1
+                return None
+            session.size = payload[1]
+            data = payload[2:2 + FAST_PACKET_FIRST_DATA]
+        else:
+            if session is None:
+                self.droppedFragments += 1
+                return None
+            if counter != session.nextCounter:
+                # A frame was missed, so this message can't be completed
+                self.release(session)
+                self.droppedFragments += session.frames + 1
+                return None
+            data = payload[1:1 + FAST_PACKET_DATA]
+
+        session.buffer[session.received:session.received + len(data)] = data
+        session.received += len(data)
+        session.nextCounter = counter + 1
+        session.frames += 1
+        session.lastTime = now
+        if session.received < session.size:
+            return None
+
+        self.release(session)
+        self.completed += 1
+        return RawFrame(frame.id, True, session.size, bytes(session.buffer[:session.size]), frame.timestamp, frame.time, frame.channel)
+
+    # Take a session from the free list for a new message, or None if no room is left
+    def acquire(self, key, src, now):
+        if not self.freeSessions or self.perSource.get(src, 0) >= self.maxPerSource:
+            self.expire(now)
+            if not self.freeSessions or self.perSource.get(src, 0) >= self.maxPerSource:
+                return None
+        session = self.freeSessions.pop()
+        session.key = key
+        session.received = 0
+        session.frames = 0
+        self.sessions[key] = session
+        self.perSource[src] = self.perSource.get(src, 0) + 1
+        return session
+
+    # Return a session to the free list
+    def release(self, session):
+        del self.sessions[session.key]
+        src = session.key[1]
+        self.perSource[src] -= 1
+        if not self.perSource[src]:
+            del self.perSource[src]
+        self.freeSessions.append(session)
+
+    # Throw away messages that have not had a frame for longer than the timeout
+    def expire(self, now):
+        self.lastSweep = now
+        for session in [s for s in self.sessions.values() if now - s.lastTime > self.timeout]:
+            self.release(session)
+            self.timedOut += 1
+            self.droppedFragments += session.frames
+
+    def __str__(self):
+        return "{} completed, {} timed out, {} fragments dropped, {} in progress".format(
+               self.completed, self.timedOut, self.droppedFragments, len(self.sessions))
+
+
+# A transport protocol transfer being reassembled. Like FastPacketSession, these are
+# created up front and reused.
+class TransportSession():
+    __slots__ = ('key', 'pgn', 'priority', 'buffer', 'size', 'packets', 'received', 'have', 'lastTime')
+
+    def __init__(self):
+        self.key = None # (source address, destination address), 255 as the destination for BAM
+        self.pgn = 0 # The PGN of the message being transferred
+        self.priority = 0
+        self.buffer = bytearray(TP_MAX)
+        self.size = 0 # The payload size given by the RTS or BAM
+        self.packets = 0 # The number of TP.DT packets the payload is sent in
+        self.received = 0 # The number of distinct packets received so far
+        self.have = bytearray(256) # have[n] is 1 once packet n has been received
+        self.lastTime = 0
+
+
+# Tracks J1939 / ISO 11783 transport protocol transfers. There can be one transfer in
+# progress for each (source, destination) pair, so BAM and RTS/CTS transfers from many
+# nodes can run at once, up to 'maxSessions' of them. A transfer with no traffic for
+# 'timeout' seconds is thrown away. Packets may be sent again after a CTS asks for
+# them, so each is stored by its sequence number and a transfer is complete once every
+# packet has been seen.
+class TransportProtocolSessions():
+    def __init__(self, maxSessions=32, timeout=1.25):
+        self.timeout = timeout
+        self.sessions = {}
+        self.freeSessions = [TransportSession() for i in range(maxSessions)]
+        self.lastSweep = 0
+
+        # Statistics
+        self.completed = 0
+        self.aborted = 0 # Ended by an Abort, or by a new RTS or BAM on the same pair
+        self.timedOut = 0
+        self.rejected = 0 # Not tracked because the session table was full
+        self.droppedFragments = 0 # TP.DT packets that belong to no transfer
+
+    # Add one TP.CM or TP.DT frame. Returns the reassembled RawFrame if this completed a transfer.
+    def addFrame(self, frame, pgn, src, dest, pri, now):
+        payload = frame.payload
+        if pgn == TP_DT:
+            return self.addData(frame, src, dest, now)
+        if len(payload) < 8:
+            return None
+
+        control = payload[0]
+        if control == TP_RTS or control == TP_BAM:
+            key = (src, GLOBAL_ADDRESS if control == TP_BAM else dest)
+            session = self.sessions.get(key)
+            if session is not None:
+                self.release(session)
+                self.aborted += 1
+            size = payload[1] | (payload[2] << 8)
+            packets = payload[3]
+            if size > TP_MAX or packets == 0 or packets * TP_DATA < size:
+                return None
+            session = self.acquire(key, now)
+            if session is None:
+                self.rejected += 1
+                return None
+            session.pgn = payload[5] | (payload[6] << 8) | (payload[7] << 16)
+            session.priority = pri
+            session.size = size
+            session.packets = packets
+        elif control == TP_ABORT:
+            # Either end may abort, so look for the transfer in both directions
+            for key in ((src, dest), (dest, src)):
+                session = self.sessions.get(key)
+                if session is not None:
+                    self.release(session)
+                    self.aborted += 1
+        elif control == TP_CTS:
+            # The CTS comes from the receiver, so the transfer is keyed the other way round
+            session = self.sessions.get((dest, src))
+            if session is not None:
+                session.lastTime = now
+        return None
+
+    def addData(self, frame, src, dest, now):
+        payload = frame.payload
+        session = self.sessions.get((src, dest))
+        if session is None or not payload:
+            self.droppedFragments += 1
+            return None
+        sequence = payload[0]
+        if sequence == 0 or sequence > session.packets:
+            self.droppedFragments += 1
+            return None
+        session.lastTime = now
+        if not session.have[sequence]:
+            start = (sequence - 1) * TP_DATA
+            data = payload[1:1 + TP_DATA]
+            session.buffer[start:start + len(data)] = data
+            session.have[sequence] = 1
+            session.received += 1
+        if session.received < session.packets:
+            return None
+
+        self.release(session)
+        self.completed += 1
+        id = Iso11783Encode(session.pgn, session.key[0], session.key[1], session.priority)
+        return RawFrame(id, True, session.size, bytes(session.buffer[:session.size]), frame.timestamp, frame.time, frame.channel)
+
+    # Take a session from the free list for a new transfer, or None if the table is full
+    def acquire(self, key, now):
+        if not self.freeSessions:
+            self.expire(now)
+            if not self.freeSessions:
+                return None
+        session = self.freeSessions.pop()
+        session.key = key
+        session.received = 0
+        session.have[:] = bytes(256)
+        session.lastTime = now
+        self.sessions[key] = session
+        return session
+
+    def release(self, session):
+        del self.sessions[session.key]
+        self.freeSessions.append(session)
+
+    # Throw away stale transfers, at most twice per timeout period
+    def sweep(self, now):
+        if self.sessions and now - self.lastSweep > self.timeout / 2:
+            self.expire(now)
+
+    def expire(self, now):
+        self.lastSweep = now
+        for session in [s for s in self.sessions.values() if now - s.lastTime > self.timeout]:
+            self.release(session)
+            self.timedOut += 1
+
+    def __str__(self):
+        return "{} completed, {} aborted, {} timed out, {} rejected, {} fragments dropped, {} in progress".format(
+               self.completed, self.aborted, self.timedOut, self.rejected, self.droppedFragments, len(self.sessions))
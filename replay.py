@@ -0,0 +1,243 @@
+'''
+ * Copyright Bar Smith, Bryant Mairs, Alex Bardales 2015
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses.
+'''
+
+'''
+Plays recorded frames into the transcoder in place of a CANPort, for the
+'--replay' option.
+
+Three kinds of recording can be read, and are told apart by their contents:
+  * binary captures written with '--capture' (see captureFile.py)
+  * candump .log files from can-utils, with lines like
+        (1436509052.249713) can0 0CF00400#FFFFFF8000FFFF
+  * raw CANusb output, Lawicel frames separated by carriage returns or newlines.
+    If the CANusb's timestamps were on, they give the time between frames, and
+    the first frame is given the time the file was last modified. Otherwise every
+    frame has that time. The timestamps wrap around every minute and the file has
+    nothing else to count the wraps by, so a gap of a minute or more between two
+    frames is shortened to its remainder.
+
+Frames keep their recorded times, so the output looks as it did when they were
+received. With a 'speed' of 0 they are replayed as fast as the transcoder will
+take them. Otherwise they are replayed at the pace they were recorded, sped up
+by 'speed'.
+'''
+
+import os
+import time
+
+from CanMessage import RawFrame
+from captureFile import CaptureReader, MAGIC as CAPTURE_MAGIC
+from lawicel import parseFrame, TIMESTAMP_ROLLOVER
+
+# Frames handed to the transcoder at a time when replaying as fast as possible
+REPLAY_BATCH = 1024
+
+# When replaying as fast as possible, wait for the transcoder while more than this
+# many frames are waiting for it, rather than loading the whole file into its queue
+REPLAY_BACKLOG = 8 * REPLAY_BATCH
+
+# How long to sleep while waiting for the transcoder to catch up
+REPLAY_POLL = 0.001
+
+# Put in the transcode queue after the last frame of a replay. The transcoder
+# returns once it has handled everything before it.
+END_OF_REPLAY = RawFrame(-1, False, 0, b'')
+
+# Bytes of raw CANusb output read at a time
+LAWICEL_CHUNK = 64 * 1024
+
+# Longest standard ID in a candump log, in hex digits. Longer IDs are extended.
+CANDUMP_STANDARD_DIGITS = 3
+
+
+# Parse one line of a candump .log file into a RawFrame. Returns None for lines that
+# aren't classic CAN data frames, such as remote frames, CAN FD frames and errors.
+def parseCandumpLine(line):
+    try:
+        stamp, interface, frame = line.split()
+        id, data = frame.split('#', 1)
+        if data.startswith(('R', '#')):
+            return None
+        payload = bytes.fromhex(data)
+        frameTime = float(stamp.strip('()'))
+        idValue = int(id, 16)
+    except ValueError:
+        return None
+    if len(payload) > 8:
+        return None
+    return RawFrame(idValue, len(id) > CANDUMP_STANDARD_DIGITS, len(payload), payload, None, frameTime)
+
+
+def readCandumpLog(fileName):
+    with open(fileName) as f:
+        for line in f:
+            frame = parseCandumpLine(line)
+            if frame is not None:
+                yield frame
+
+
+# Yield each line of raw CANusb output, which may end in a carriage return or newline
+def readLawicelLines(fileName):
+    rest = b''
+    with open(fileName, 'rb') as f:
+        for chunk in iter(lambda: f.read(LAWICEL_CHUNK), b''):
+            lines = (rest + chunk).replace(b'\n', b'\r').split(b'\r')
+            rest = lines.pop()
+            yield from lines
+    yield rest
+
+
+# Frames are timed like lawicel.DeviceClock does, except that there's no host clock to
+# count the timestamp's wraps: the time between two frames is always under a minute.
+def readLawicelText(fileName):
+    origin = os.path.getmtime(fileName)
+    elapsed = 0
+    lastStamp = None
+    for frame in map(parseFrame, readLawicelLines(fileName)):
+        if frame is None:
+            continue
+        if frame.timestamp is None:
+            frame.time = origin
+        else:
+            if lastStamp is not None:
+                elapsed += (frame.timestamp - lastStamp) % TIMESTAMP_ROLLOVER
+            lastStamp = frame.timestamp
+            frame.time = origin + elapsed / 1000
+        yield frame
+
+
+def readBinaryCapture(fileName):
+    reader = CaptureReader(fileName)
+    try:
+        yield from reader.frames()
+    finally:
+        reader.close()
+
+
+# Return an iterator over the frames in a recording, in whichever format it is, and
+# whether it records each frame's own time. Raw CANusb output only does if its frames
+# have timestamps, which isn't known until they are read.
+def openRecording(fileName):
+    with open(fileName, 'rb') as f:
+        start = f.read(len(CAPTURE_MAGIC))
+    if start == CAPTURE_MAGIC:
+        return readBinaryCapture(fileName), True
+    if start.lstrip().startswith(b'('):
+        return readCandumpLog(fileName), True
+    return readLawicelText(fileName), False
+
+
+# Return an iterator over the frames in a recording, in whichever format it is
+def readRecording(fileName):
+    return openRecording(fileName)[0]
+
+
+# Stands in for a CANPort, reading frames from a recording instead of a serial port.
+# run() is the target of the thread that would otherwise read the serial port.
+class ReplayPort():
+    def __init__(self, dataBack, fileName, speed=1.0):
+        self.dataBack = dataBack
+        self.fileName = fileName
+        self.speed = speed
+        self.live = True
+        # The bridge.BridgeDirection forwarding the recording to a port, if bridging
+        self.bridge = None
+        # Whether the frames replayed so far have times of their own, rather than all
+        # having the time the file was last modified
+        self.frameTimes = False
+
+        # Statistics
+        self.framesReplayed = 0
+        self.elapsed = 0.0
+
+    def run(self):
+        frames, self.frameTimes = openRecording(self.fileName)
+        start = time.monotonic()
+        if self.speed:
+            self.replayTimed(frames)
+        else:
+            self.replayFast(frames)
+        self.finish()
+        self.elapsed = time.monotonic() - start
+
+    # Hand frames to the transcoder as fast as it takes them
+    def replayFast(self, frames):
+        batch = []
+        for frame in frames:
+            batch.append(frame)
+            if len(batch) == REPLAY_BATCH:
+                self.push(batch)
+                batch = []
+                while self.backlog() > REPLAY_BACKLOG and self.live:
+                    time.sleep(REPLAY_POLL)
+                if not self.live:
+                    return
+        if batch:
+            self.push(batch)
+
+    # Hand each frame to the transcoder when it is due, going by the recorded times.
+    # Frames that are due together go in one batch, as they would from the serial port.
+    def replayTimed(self, frames):
+        firstTime = None
+        batch = []
+        for frame in frames:
+            if not self.live:
+                return
+            if firstTime is None:
+                firstTime = frame.time
+                startTime = time.monotonic()
+            due = startTime + (frame.time - firstTime) / self.speed
+            delay = due - time.monotonic()
+            if (delay > 0 or len(batch) == REPLAY_BATCH) and batch:
+                self.push(batch)
+                batch = []
+            if delay > 0:
+                time.sleep(delay)
+            batch.append(frame)
+        if batch:
+            self.push(batch)
+
+    # The most frames waiting for the transcoder, or to be forwarded by a bridge
+    def backlog(self):
+        waiting = self.dataBack.CANacondaRx_TranscodeQueue.qsize()
+        if self.bridge:
+            waiting = max(waiting, self.bridge.queue.qsize())
+        return waiting
+
+    def push(self, frames):
+        if self.dataBack.capture:
+            self.dataBack.capture.write(frames)
+        self.framesReplayed += len(frames)
+        if not self.frameTimes:
+            self.frameTimes = frames[0].timestamp is not None
+        if self.bridge:
+            frames = self.bridge.forward(frames)
+        if frames:
+            self.dataBack.CANacondaRx_TranscodeQueue.putMany(frames)
+
+    # Tell the transcoder there is nothing more to come, once it has room for the
+    # marker, so that the marker can't be dropped by a full queue
+    def finish(self):
+        transcodeQueue = self.dataBack.CANacondaRx_TranscodeQueue
+        while transcodeQueue.qsize() and self.live:
+            time.sleep(REPLAY_POLL)
+        transcodeQueue.put(END_OF_REPLAY)
+
+    def __str__(self):
+        return "Replayed {} frames in {:.2f} s ({:.0f} frames/s)".format(
+               self.framesReplayed, self.elapsed, self.framesReplayed / self.elapsed if self.elapsed else 0.0)
+
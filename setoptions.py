@@ -77,6 +77,37 @@ def createListAndDict(dataBack, filterString):
     return True
 
 
+# Messages in '--filter' can be limited to one bus with 'Name@channel', as in
+# --filter='Wind Data@nav{Wind Speed}'. Strip the channels from the names in
+# messageInfo_to_fields and messageInfoList, and record them in messageInfo_to_channels.
+# A message given both with and without a channel is chosen on every channel.
+def setFilterChannels(dataBack):
+    messageInfo_to_fields = {}
+    anyChannel = set()
+    for key, fields in dataBack.messageInfo_to_fields.items():
+        name, at, channel = key.rpartition('@')
+        if not at:
+            name = key
+            anyChannel.add(name)
+        else:
+            dataBack.messageInfo_to_channels.setdefault(name, set()).add(channel)
+            channelNames = [channelName for channelName, port in dataBack.channels]
+            if channelNames and channel not in channelNames:
+                print("\nWARNING, channel '" + channel + "' of '" + name + "' is not the name of a port.\n")
+        # No fields means all of them, so that wins over a list of fields
+        if name in messageInfo_to_fields:
+            if messageInfo_to_fields[name] and fields:
+                messageInfo_to_fields[name] += [field for field in fields if field not in messageInfo_to_fields[name]]
+            else:
+                messageInfo_to_fields[name] = []
+        else:
+            messageInfo_to_fields[name] = list(fields)
+    for name in anyChannel:
+        dataBack.messageInfo_to_channels.pop(name, None)
+    dataBack.messageInfo_to_fields = messageInfo_to_fields
+    dataBack.messageInfoList = list(messageInfo_to_fields)
+
+
 # Nested for loops :D
 # This can be corrected by refactoring backend.py
 # However this loop is only executed once.
@@ -258,6 +289,9 @@ def setDisplayCSVmode(dataBack):
         out += str(dataBack.csvDisplayList[key]) + ","
         dataBack.fieldIndices[key] = i
         i += 1
+    # When reading several buses, each line says which one the message came from
+    if dataBack.multiChannel:
+        out = "channel," + out
     if dataBack.args.time:
         print("t,",out[:-1])
     else:
@@ -0,0 +1,299 @@
+'''
+ * Copyright Bar Smith, Bryant Mairs, Alex Bardales 2015
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses.
+'''
+
+'''
+Live plots of the fields ticked in the 'Plot' column of the GUI's messages
+table. This needs numpy and matplotlib; without them the GUI has no 'Plot' tab.
+
+Each plotted field has a SignalBuffer, a pair of NumPy arrays of times and
+values used as a ring, allocated once. The transcoder thread hands each batch
+of decoded messages to PlotSignals.add(), which picks out the plotted fields
+and copies their samples into the rings with one slice assignment per field
+per batch, rather than touching NumPy for every message.
+
+The SignalPlot tab redraws PLOT_FPS times a second, and only while it is on
+screen. It takes the last PLOT_WINDOW seconds of each signal and reduces them
+to the smallest and largest value in each pixel column of the plot, so drawing
+costs the same however fast a signal comes in. The axes, grid and legend are
+drawn once and kept as a bitmap, and each frame only the lines are drawn over
+it (blitting). The axes are drawn again only when a signal leaves the range of
+the y axis, or uses only a small part of it.
+'''
+
+import threading
+import time
+
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
+from PyQt5 import QtCore, QtWidgets
+
+# How many samples each plotted field keeps
+PLOT_CAPACITY = 65536
+
+# How many seconds of each field are shown
+PLOT_WINDOW = 30.0
+
+# How many times a second the plot is redrawn. With a PLOT_WINDOW of 30 seconds a
+# pixel is a few hundredths of a second, so the lines move a few pixels a frame.
+PLOT_FPS = 10
+
+# The y axis is drawn again if the signals use less than this much of it
+MIN_Y_USE = 0.25
+
+
+# A ring of the times and values of one field
+class SignalBuffer():
+    def __init__(self, capacity=PLOT_CAPACITY):
+        self.times = np.zeros(capacity)
+        self.values = np.zeros(capacity)
+        # Where the next sample goes, and how many samples there are
+        self.end = 0
+        self.count = 0
+
+    # Add arrays of times and values to the end of the ring
+    def add(self, times, values):
+        capacity = len(self.times)
+        if len(times) > capacity:
+            times = times[-capacity:]
+            values = values[-capacity:]
+        count = len(times)
+        # The samples that fit before the end of the arrays, and the rest at the start
+        first = min(count, capacity - self.end)
+        self.times[self.end:self.end + first] = times[:first]
+        self.values[self.end:self.end + first] = values[:first]
+        self.times[:count - first] = times[first:]
+        self.values[:count - first] = values[first:]
+        self.end = (self.end + count) % capacity
+        self.count = min(capacity, self.count + count)
+
+    # Copies of the times and values received since 'start', oldest first
+    def since(self, start):
+        if self.count < len(self.times):
+            times = self.times[:self.count]
+            values = self.values[:self.count]
+        else:
+            times = np.concatenate((self.times[self.end:], self.times[:self.end]))
+            values = np.concatenate((self.values[self.end:], self.values[:self.end]))
+        first = np.searchsorted(times, start)
+        return times[first:].copy(), values[first:].copy()
+
+
+# Reduce a signal to the smallest and largest value in each of 'width' columns
+# between the times 'start' and 'end'. The times must be in order.
+def decimate(times, values, start, end, width):
+    if len(times) <= 2 * width:
+        return times, values
+    columns = ((times - start) * (width / (end - start))).astype(np.intp)
+    # The index where each column's samples begin
+    edges = np.concatenate(([0], np.flatnonzero(np.diff(columns)) + 1))
+    x = np.repeat(times[edges], 2)
+    y = np.empty(len(x))
+    y[0::2] = np.minimum.reduceat(values, edges)
+    y[1::2] = np.maximum.reduceat(values, edges)
+    return x, y
+
+
+# The fields being plotted, and their samples. The transcoder thread adds the
+# samples, and the GUI thread reads them, so the rings are only used with 'lock' held.
+class PlotSignals():
+    def __init__(self, capacity=PLOT_CAPACITY):
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        # ('messageInfo', 'field') -> SignalBuffer, in the order they were ticked
+        self.buffers = {}
+        # 'messageInfo' -> the fields of it that are plotted. This is what add() looks
+        # at, and it is replaced rather than changed, so it can be read without the lock.
+        self.fields = {}
+
+    def isPlotted(self, messageName, fieldName):
+        return (messageName, fieldName) in self.buffers
+
+    def setPlotted(self, messageName, fieldName, plotted):
+        key = (messageName, fieldName)
+        with self.lock:
+            if plotted:
+                self.buffers.setdefault(key, SignalBuffer(self.capacity))
+            else:
+                self.buffers.pop(key, None)
+            fields = {}
+            for name, field in self.buffers:
+                fields[name] = fields.get(name, ()) + (field,)
+            self.fields = fields
+
+    # Forget the samples of a field, as when its units have changed
+    def clearSignal(self, messageName, fieldName):
+        with self.lock:
+            if (messageName, fieldName) in self.buffers:
+                self.buffers[(messageName, fieldName)] = SignalBuffer(self.capacity)
+
+    # Stop plotting every field
+    def clear(self):
+        with self.lock:
+            self.buffers = {}
+            self.fields = {}
+
+    # The fields being plotted, as ('messageInfo', 'field') pairs
+    def keys(self):
+        return list(self.buffers)
+
+    # Add the samples of the plotted fields in a batch of decoded messages. Called by
+    # the transcoder thread.
+    def add(self, messages):
+        fields = self.fields
+        if not fields:
+            return
+        samples = {}
+        for message in messages:
+            plotted = fields.get(message.name)
+            if plotted is None:
+                continue
+            for field in plotted:
+                value = message.body.get(field)
+                # Fields filtered out by value are None, and there is nothing to plot
+                # for fields that aren't numbers
+                if isinstance(value, (int, float)):
+                    try:
+                        times, values = samples[(message.name, field)]
+                    except KeyError:
+                        times, values = samples[(message.name, field)] = ([], [])
+                    times.append(message.time)
+                    values.append(value)
+        if not samples:
+            return
+        with self.lock:
+            for key, (times, values) in samples.items():
+                buffer = self.buffers.get(key)
+                if buffer is not None:
+                    buffer.add(np.array(times, dtype=float), np.array(values, dtype=float))
+
+    # The times and values of a field received since 'start'
+    def since(self, key, start):
+        with self.lock:
+            buffer = self.buffers.get(key)
+            if buffer is None:
+                return np.empty(0), np.empty(0)
+            return buffer.since(start)
+
+
+# The SignalPlot class gets instantiated in canaconda_GUI.py, as the 'Plot' tab.
+# Times are shown in seconds before now, so that the x axis doesn't change and
+# only the lines need to be drawn on each frame.
+class SignalPlot(QtWidgets.QWidget):
+
+    def setup(self, dataBack, parent):
+        super(SignalPlot, self).__init__()
+        self.dataBack = dataBack
+        self.parent = parent
+        self.plotSignals = dataBack.plotSignals
+
+        self.figure = Figure()
+        self.canvas = FigureCanvasQTAgg(self.figure)
+        self.axes = self.figure.add_subplot(111)
+        self.axes.set_xlim(-PLOT_WINDOW, 0)
+        self.axes.set_ylim(-1, 1)
+        self.axes.set_xlabel("Seconds ago")
+        self.axes.grid(True)
+        # ('messageInfo', 'field') -> the line it is drawn with
+        self.lines = {}
+        # The axes without the lines, taken after each full draw
+        self.background = None
+        self.canvas.mpl_connect('draw_event', self.saveBackground)
+        # The first draw loads fonts and takes a while, so it is done now rather than
+        # when the first field is plotted
+        self.canvas.draw()
+
+        self.hintLabel = QtWidgets.QLabel("Tick fields in the 'Plot' column of the messages table to plot them here.")
+        vbox = QtWidgets.QVBoxLayout()
+        vbox.addWidget(self.hintLabel)
+        vbox.addWidget(self.canvas)
+        self.setLayout(vbox)
+
+        # Frames are drawn at a fixed rate, however fast the signals come in
+        self.plotTimer = QtCore.QTimer()
+        self.plotTimer.timeout.connect(self.updatePlot)
+        self.plotTimer.start(1000 // PLOT_FPS)
+
+    # After the axes are drawn in full, keep them as a bitmap and draw the lines on
+    # top. This can happen while Qt is painting the canvas, so the lines are drawn
+    # into the canvas's image without blitting.
+    def saveBackground(self, event):
+        self.background = self.canvas.copy_from_bbox(self.axes.bbox)
+        for line in self.lines.values():
+            self.axes.draw_artist(line)
+
+    # Make a line for each field being plotted. The axes and legend then need to be
+    # drawn again.
+    def updateLines(self, keys):
+        for line in self.lines.values():
+            line.remove()
+        self.lines = {}
+        for key in keys:
+            # Thin lines, as the time it takes to draw a line grows with its width
+            line, = self.axes.plot([], [], label="{}: {}".format(*key), linewidth=1, animated=True)
+            self.lines[key] = line
+        if self.lines:
+            self.axes.legend(loc='upper left', fontsize='small')
+        elif self.axes.get_legend():
+            self.axes.get_legend().remove()
+        self.hintLabel.setVisible(not self.lines)
+
+    def drawLines(self):
+        if self.background is None:
+            return
+        self.canvas.restore_region(self.background)
+        for line in self.lines.values():
+            self.axes.draw_artist(line)
+        self.canvas.blit(self.axes.bbox)
+
+    # Draw a frame. Called PLOT_FPS times a second by 'plotTimer'.
+    def updatePlot(self):
+        if not self.isVisible():
+            return
+        keys = self.plotSignals.keys()
+        drawAxes = keys != list(self.lines)
+        if drawAxes:
+            self.updateLines(keys)
+        if not self.lines:
+            if drawAxes:
+                self.canvas.draw()
+            return
+
+        now = time.time()
+        width = max(1, int(self.axes.bbox.width))
+        low = high = None
+        for key, line in self.lines.items():
+            times, values = self.plotSignals.since(key, now - PLOT_WINDOW)
+            x, y = decimate(times - now, values, -PLOT_WINDOW, 0.0, width)
+            line.set_data(x, y)
+            if len(y):
+                finite = y[np.isfinite(y)]
+                if len(finite):
+                    low = finite.min() if low is None else min(low, finite.min())
+                    high = finite.max() if high is None else max(high, finite.max())
+
+        # Redraw the axes if the signals have gone off them, or use little of them
+        if low is not None:
+            bottom, top = self.axes.get_ylim()
+            margin = 0.1 * (high - low) or 1.0
+            if low < bottom or high > top or (high - low + 2 * margin) < MIN_Y_USE * (top - bottom):
+                self.axes.set_ylim(low - margin, high + margin)
+                drawAxes = True
+        if drawAxes:
+            self.canvas.draw()
+        else:
+            self.drawLines()